@@ -0,0 +1,92 @@
+"""Checkpoint bytes/step and resume latency of DeltaPostgresSaver as a thread grows.
+
+A toy graph with the agent's state schema appends one AI reply per turn. At each
+reported size the script prints the bytes written for the last step (delta) next to
+what a full `messages` snapshot would cost, and the latency of resuming the thread
+from the hot cache and cold from postgres.
+
+Run from app/src against a reachable postgres:
+    python ../benchmarks/bench_checkpointer.py --turns 250
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import StateGraph
+
+from database.checkpointer import DeltaPostgresSaver
+from database.db import engine, Base
+from state import AgentState
+
+
+def build_graph(checkpointer, reply_chars):
+    async def reply(state):
+        return {"messages": [AIMessage(content="x" * reply_chars)]}
+
+    workflow = StateGraph(AgentState)
+    workflow.add_node("reply", reply)
+    workflow.set_entry_point("reply")
+    workflow.set_finish_point("reply")
+    return workflow.compile(checkpointer=checkpointer)
+
+
+async def timed(coro_factory, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await coro_factory()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=250)
+    parser.add_argument("--reply-chars", type=int, default=400)
+    args = parser.parse_args()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    checkpointer = DeltaPostgresSaver(engine)
+    graph = build_graph(checkpointer, args.reply_chars)
+    config = {"configurable": {"thread_id": f"bench-{uuid.uuid4()}"}}
+    report_at = {5, 25, 50, 100, 250, 500}
+
+    results = []
+    for turn in range(1, args.turns + 1):
+        before = dict(checkpointer.stats)
+        await graph.ainvoke({"messages": [HumanMessage(content=f"question {turn}")]}, config)
+        n_messages = turn * 2
+        if n_messages not in report_at and turn != args.turns:
+            continue
+
+        written = sum(checkpointer.stats[key] - before[key] for key in ("checkpoint_bytes", "blob_bytes", "delta_bytes"))
+        steps = checkpointer.stats["steps"] - before["steps"]
+        state = (await checkpointer.aget_tuple(config)).checkpoint["channel_values"]["messages"]
+        full_snapshot = len(checkpointer.serde.dumps_typed(state)[1])
+
+        hot_ms = await timed(lambda: checkpointer.aget_tuple(config))
+
+        async def cold():
+            checkpointer.evict(config["configurable"]["thread_id"])
+            await checkpointer.aget_tuple(config)
+        cold_ms = await timed(cold)
+
+        results.append({"messages": n_messages,
+                        "delta_bytes_per_step": round(written / max(steps, 1)),
+                        "full_snapshot_bytes": full_snapshot,
+                        "resume_hot_ms": round(hot_ms, 4),
+                        "resume_cold_ms": round(cold_ms, 3)})
+
+    print(json.dumps(results, indent=2))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
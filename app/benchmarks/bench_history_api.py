@@ -0,0 +1,140 @@
+"""Page latency of the history read API at 10M agent_history rows.
+
+Seeds --rows rows spread over --threads threads, plus one --hot-rows thread, with
+server-side generate_series, then builds the composite index. Reports per-page
+latency of keyset pagination at increasing depth into the hot thread next to
+LIMIT/OFFSET, and of listing threads deep into the thread list. Keyset pages should
+cost the same at page 1 and page 1000; OFFSET grows with depth.
+
+Run from app/src against a reachable postgres (seeding 10M rows takes a few minutes):
+    python ../benchmarks/bench_history_api.py --rows 10000000 --threads 100000 --hot-rows 500000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sqlalchemy import text
+
+from database.db import AsyncSessionLocal, engine, Base
+from database.crud import ensure_history_indexes, async_db_list_threads, async_db_thread_messages
+
+HOT_THREAD = "thread-hot"
+
+SEED_SQL = text("""
+INSERT INTO agent_history (id, prompt, response, message_type, thread_id, created_at)
+SELECT gen_random_uuid(), 'seed prompt', repeat('x', :chars),
+       CASE WHEN g % 2 = 0 THEN 'assistant' ELSE 'user' END,
+       CASE WHEN :thread_id <> '' THEN :thread_id ELSE 'thread-' || lpad((g % :threads)::text, 8, '0') END,
+       timestamptz '2025-01-01' + (g * interval '1 millisecond')
+FROM generate_series(:start, :stop) g
+""")
+
+
+async def seed(rows, threads, hot_rows, chars, batch=1_000_000):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.execute(text("DROP INDEX IF EXISTS ix_agent_history_thread_created_id"))
+        await conn.execute(text("TRUNCATE agent_history"))
+
+    for start in range(1, rows + 1, batch):
+        stop = min(rows, start + batch - 1)
+        async with engine.begin() as conn:
+            await conn.execute(SEED_SQL, {"chars": chars, "thread_id": "", "threads": threads, "start": start, "stop": stop})
+        print(f"seeded {stop:,}/{rows:,}", flush=True)
+    async with engine.begin() as conn:
+        await conn.execute(SEED_SQL, {"chars": chars, "thread_id": HOT_THREAD, "threads": 1, "start": 1, "stop": hot_rows})
+
+    start = time.perf_counter()
+    await ensure_history_indexes(engine)
+    print(f"index built in {time.perf_counter() - start:.1f}s")
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("VACUUM ANALYZE agent_history"))
+
+
+async def timed(coro_factory, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await coro_factory()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+async def keyset_pages(page_size, depths, repeat):
+    """Walk the hot thread with cursors and time the pages at the requested depths."""
+    results, cursor, page = {}, None, 0
+    async with AsyncSessionLocal() as db:
+        while page < max(depths):
+            page += 1
+            if page in depths:
+                current = cursor
+                results[page] = await timed(lambda: async_db_thread_messages(db, HOT_THREAD, cursor=current, limit=page_size), repeat)
+            _, cursor = await async_db_thread_messages(db, HOT_THREAD, cursor=cursor, limit=page_size)
+            if cursor is None:
+                break
+    return results
+
+
+async def offset_pages(page_size, depths, repeat):
+    query = text("SELECT id, prompt, response, message_type, created_at FROM agent_history WHERE thread_id = :thread_id "
+                 "ORDER BY created_at, id LIMIT :limit OFFSET :offset")
+    results = {}
+    async with AsyncSessionLocal() as db:
+        for page in depths:
+            params = {"thread_id": HOT_THREAD, "limit": page_size, "offset": (page - 1) * page_size}
+            results[page] = await timed(lambda: db.execute(query, params), repeat)
+    return results
+
+
+async def thread_list_pages(page_size, depths, repeat):
+    results, cursor, page = {}, None, 0
+    async with AsyncSessionLocal() as db:
+        while page < max(depths):
+            page += 1
+            if page in depths:
+                current = cursor
+                results[page] = await timed(lambda: async_db_list_threads(db, cursor=current, limit=page_size), repeat)
+            _, cursor = await async_db_list_threads(db, cursor=cursor, limit=page_size)
+            if cursor is None:
+                break
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--threads", type=int, default=100_000)
+    parser.add_argument("--hot-rows", type=int, default=500_000)
+    parser.add_argument("--chars", type=int, default=200, help="response size per row")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the rows of a previous run")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        await seed(args.rows, args.threads, args.hot_rows, args.chars)
+
+    depths = [1, 10, 100, 1000, 4000]
+    keyset = await keyset_pages(args.page_size, depths, args.repeat)
+    offset = await offset_pages(args.page_size, list(keyset), args.repeat)
+    print(f"\nthread messages ({args.hot_rows:,} rows in thread, {args.page_size}/page, median ms)")
+    print(f"{'page':>6} {'keyset':>10} {'offset':>10}")
+    for page in keyset:
+        print(f"{page:>6} {keyset[page]:>10.2f} {offset[page]:>10.2f}")
+
+    threads = await thread_list_pages(args.page_size, [1, 10, 100, 500], args.repeat)
+    print(f"\nthread list ({args.threads:,} threads, {args.page_size}/page, median ms)")
+    for page, latency in threads.items():
+        print(f"{page:>6} {latency:>10.2f}")
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
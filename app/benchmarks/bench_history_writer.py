@@ -0,0 +1,93 @@
+"""Compare per-item `async_db_save` against the write-behind `HistoryWriter`.
+
+Each simulated request writes `--rows-per-turn` agent_history rows (one per streamed
+graph item). Reports rows/sec (until every row is committed) and p50/p99 request
+latency (time until the endpoint could return its response).
+
+Run from app/src against a reachable postgres:
+    python ../benchmarks/bench_history_writer.py --requests 500 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from database.db import AsyncSessionLocal, engine, Base
+from database.crud import async_db_save
+from database.writer import HistoryWriter
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+async def per_item_request(i, rows_per_turn):
+    start = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        for j in range(rows_per_turn):
+            await async_db_save(db, prompt=f"bench prompt {i}", response=f"item {j}",
+                                message_type="assistant", thread_id=f"bench-{i}")
+    return time.perf_counter() - start
+
+
+async def write_behind_request(writer, i, rows_per_turn):
+    start = time.perf_counter()
+    for j in range(rows_per_turn):
+        writer.add(prompt=f"bench prompt {i}", response=f"item {j}",
+                   message_type="assistant", thread_id=f"bench-{i}")
+        await asyncio.sleep(0) # yield like the streaming loop does between graph items
+    return time.perf_counter() - start
+
+
+async def run(mode, n_requests, concurrency, rows_per_turn):
+    semaphore = asyncio.Semaphore(concurrency)
+    writer = HistoryWriter(AsyncSessionLocal)
+    if mode == "write_behind":
+        await writer.start()
+
+    async def one(i):
+        async with semaphore:
+            if mode == "per_item":
+                return await per_item_request(i, rows_per_turn)
+            return await write_behind_request(writer, i, rows_per_turn)
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(one(i) for i in range(n_requests)))
+    if mode == "write_behind":
+        await writer.stop() # rows only count once they are committed
+    elapsed = time.perf_counter() - start
+
+    total_rows = n_requests * rows_per_turn
+    return {"mode": mode,
+            "rows": total_rows,
+            "rows_per_sec": round(total_rows / elapsed, 1),
+            "p50_ms": round(statistics.median(latencies) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "elapsed_s": round(elapsed, 3)}
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--rows-per-turn", type=int, default=6)
+    args = parser.parse_args()
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    results = []
+    for mode in ("per_item", "write_behind"):
+        results.append(await run(mode, args.requests, args.concurrency, args.rows_per_turn))
+    print(json.dumps(results, indent=2))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""recall_memory index: build rate, merge/snapshot cost, startup from the snapshot and query latency.
+
+Generates synthetic agent_history rows (Zipf-distributed vocabulary, `--threads`
+threads spread over `--users` users), indexes them through MemoryIndex.add_rows in
+batches as the history writer would, merges every `--merge-docs` rows, then maps the
+snapshot back in a fresh index and times BM25 queries scoped to one thread and to a
+user's threads. No postgres needed.
+
+    python ../benchmarks/bench_memory.py --rows 1000000 --queries 500
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from tool.memory import MemoryIndex
+
+TYPES = ("user", "assistant", "tool")
+
+
+def make_words(vocab_size, rng):
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    return ["".join(rng.choice(letters, size=rng.integers(3, 10))) for _ in range(vocab_size)]
+
+
+def make_rows(rows, words, threads, words_per_row, rng):
+    """Rows in created_at order over the last week, like agent_history."""
+    ids = np.minimum(rng.zipf(1.2, size=rows * words_per_row) - 1, len(words) - 1).reshape(rows, words_per_row)
+    thread_of = rng.integers(0, threads, size=rows)
+    start = datetime.now(timezone.utc) - timedelta(days=7)
+    step = timedelta(days=7) / rows
+    for i in range(rows):
+        yield {"thread_id": f"thread-{thread_of[i]}", "message_type": TYPES[i % 3], "created_at": start + step * i,
+               "response": " ".join(words[j] for j in ids[i])}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(args):
+    rng = np.random.default_rng(7)
+    words = make_words(args.vocab, rng)
+    index_dir = args.index_dir or tempfile.mkdtemp(prefix="memory-bench-")
+    index = MemoryIndex(index_dir, merge_docs=args.rows + 1) # merges are triggered and timed here instead
+    index.ready = True # no postgres to catch up with
+    for thread in range(args.threads):
+        index.bind_user(f"thread-{thread}", f"user-{thread % args.users}")
+
+    add_time, merge_times, batch = 0.0, [], []
+    for row in make_rows(args.rows, words, args.threads, args.words, rng):
+        batch.append(row)
+        if len(batch) == 200: # one history writer batch
+            start = time.perf_counter()
+            index.add_rows(batch)
+            add_time += time.perf_counter() - start
+            batch = []
+            if len(index._live) >= args.merge_docs:
+                start = time.perf_counter()
+                await index.merge()
+                merge_times.append(time.perf_counter() - start)
+    if batch:
+        index.add_rows(batch)
+        start = time.perf_counter()
+        await index.merge()
+        merge_times.append(time.perf_counter() - start)
+
+    stats = index.stats()
+    size = sum(os.path.getsize(os.path.join(index.snapshot, name)) for name in os.listdir(index.snapshot))
+    print(f"{args.rows} rows, {stats['terms']} terms, {args.threads} threads, {args.users} users")
+    print(f"add_rows: {args.rows / add_time:,.0f} rows/s on the event loop ({add_time * 1e6 / args.rows:.1f} us/row)")
+    print(f"merges (off the event loop, incl. writing the snapshot): {len(merge_times)}, "
+          f"median {statistics.median(merge_times):.2f}s, max {max(merge_times):.2f}s, snapshot {size / 2**20:.0f} MiB")
+
+    start = time.perf_counter()
+    loaded = MemoryIndex(index_dir)
+    loaded.load_snapshot()
+    print(f"startup: snapshot mapped in {(time.perf_counter() - start) * 1000:.0f} ms")
+    loaded.ready = True
+
+    queries = [" ".join(rng.choice(words[:2000], size=3)) for _ in range(args.queries)]
+    for scope in ("thread", "user"):
+        latencies = []
+        for i, query in enumerate(queries):
+            thread_id = f"thread-{i % args.threads}"
+            start = time.perf_counter()
+            await loaded.asearch(query, thread_id, scope=scope, limit=5)
+            latencies.append(time.perf_counter() - start)
+        print(f"query scope={scope:<6} p50 {percentile(latencies, 50) * 1000:.2f} ms  p95 {percentile(latencies, 95) * 1000:.2f} ms  "
+              f"max {max(latencies) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--words", type=int, default=30, help="words per message")
+    parser.add_argument("--vocab", type=int, default=50_000)
+    parser.add_argument("--threads", type=int, default=20_000)
+    parser.add_argument("--users", type=int, default=2_000)
+    parser.add_argument("--merge-docs", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--index-dir", default=None, help="default: a temporary directory")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""LLM router over several local fake vLLM replicas.
+
+Starts --replicas copies of fake_services.py, runs --threads conversations of --turns
+requests each through LLMRouter, and kills one replica halfway to show retry and
+ejection. Prints requests per replica, the share of turns that stayed on their
+thread's replica (prefix-cache affinity), errors and latency percentiles.
+
+Run from app/src:
+    python ../benchmarks/bench_router.py --replicas 3 --threads 60 --turns 5 --fail-rate 0.02
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from llm.router import Backend, LLMRouter
+
+FAKE_SERVICES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_services.py")
+
+
+def start_replicas(n, base_port, fail_rate):
+    processes = []
+    for i in range(n):
+        processes.append(subprocess.Popen([sys.executable, FAKE_SERVICES, "--port", str(base_port + i),
+                                           "--latency-ms", "20", "--tokens-per-sec", "400", "--reply-tokens", "8",
+                                           "--fail-rate", str(fail_rate)]))
+    return processes
+
+
+async def wait_ready(urls, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        for url in urls:
+            while True:
+                try:
+                    if (await client.get(url.removesuffix("/v1") + "/health")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{url} did not come up")
+                await asyncio.sleep(0.2)
+
+
+def build_router(urls):
+    backends = []
+    for url in urls:
+        llm = ChatOpenAI(model="Llama-3.2-1B-Instruct-FP8", openai_api_base=url, openai_api_key="dummy-key", max_retries=0)
+        backends.append(Backend(url, llm, llm))
+    return LLMRouter(backends, ejection_s=5.0)
+
+
+async def run_thread(router, turns, served_by, latencies, errors):
+    thread_id = str(uuid.uuid4())
+    previous = None
+    for _ in range(turns):
+        start = time.perf_counter()
+        try:
+            await router.ainvoke([{"role": "user", "content": "hello"}], thread_id=thread_id)
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - start)
+        backend = router._affinity.get(thread_id)
+        served_by.append((previous, backend.url if backend else None))
+        previous = backend.url if backend else None
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replicas", type=int, default=3)
+    parser.add_argument("--base-port", type=int, default=18100)
+    parser.add_argument("--threads", type=int, default=60)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--no-kill", action="store_true", help="keep every replica up")
+    args = parser.parse_args()
+
+    urls = [f"http://127.0.0.1:{args.base_port + i}/v1" for i in range(args.replicas)]
+    processes = start_replicas(args.replicas, args.base_port, args.fail_rate)
+    try:
+        await wait_ready(urls)
+        router = build_router(urls)
+        served_by, latencies, errors = [], [], []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def bounded():
+            async with semaphore:
+                await run_thread(router, args.turns, served_by, latencies, errors)
+
+        async def kill_one():
+            await asyncio.sleep(1.0)
+            if not args.no_kill and args.replicas > 1:
+                print(f"killing replica {urls[-1]}")
+                processes[-1].kill()
+
+        start = time.perf_counter()
+        await asyncio.gather(kill_one(), *(bounded() for _ in range(args.threads)))
+        elapsed = time.perf_counter() - start
+
+        per_replica = Counter(url for _, url in served_by)
+        repeats = [(previous, url) for previous, url in served_by if previous is not None]
+        sticky = sum(previous == url for previous, url in repeats)
+        latencies.sort()
+        print(f"requests: {len(served_by)} ok, {len(errors)} failed in {elapsed:.2f}s")
+        for url in urls:
+            print(f"  {url}: {per_replica[url]} requests, {router.stats()[url]}")
+        if repeats:
+            print(f"thread affinity kept on {sticky}/{len(repeats)} follow-up turns ({sticky / len(repeats):.1%})")
+        if latencies:
+            print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+                  f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+        for error in Counter(errors).most_common(3):
+            print("error:", *error)
+    finally:
+        for process in processes:
+            process.kill()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
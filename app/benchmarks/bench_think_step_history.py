@@ -0,0 +1,80 @@
+"""think_step preparation cost at 10/100/1000 messages.
+
+Compares the previous path (convert every message with its additional_kwargs and
+response_metadata, then json.dumps the full list for each think_step call) with the
+incremental HistorySerializer, in the steady state where each step adds one message.
+
+    python ../benchmarks/bench_think_step_history.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from tool.history import HistorySerializer
+
+
+def legacy_prepare(messages, thought):
+    formatted = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage):
+            formatted.append({"role": "user", "content": msg.content, "additional_kwargs": msg.additional_kwargs,
+                              "response_metadata": msg.response_metadata, "id": msg.id})
+        elif isinstance(msg, AIMessage):
+            formatted.append({"role": "assistant", "content": msg.content, "additional_kwargs": msg.additional_kwargs,
+                              "response_metadata": msg.response_metadata, "id": msg.id, "tool_calls": msg.tool_calls})
+        elif isinstance(msg, ToolMessage):
+            formatted.append({"role": "tool", "content": msg.content, "name": msg.name, "id": msg.id,
+                              "tool_call_id": msg.tool_call_id})
+    formatted.append({"role": "user", "content": thought})
+    return json.dumps(formatted)
+
+
+def make_message(i):
+    metadata = {"token_usage": {"prompt_tokens": 812, "completion_tokens": 64}, "model_name": "Llama-3.2-1B-Instruct-FP8",
+                "finish_reason": "tool_calls"}
+    if i % 3 == 0:
+        return HumanMessage(content=f"question {i} " * 10, id=f"h{i}")
+    if i % 3 == 1:
+        return AIMessage(content="", id=f"a{i}", response_metadata=metadata, additional_kwargs={"refusal": None},
+                         tool_calls=[{"name": "tavily_search", "args": {"query": f"q{i}"}, "id": f"call{i}"}])
+    return ToolMessage(content=json.dumps({"results": ["lorem ipsum " * 40]}), name="tavily_search",
+                       tool_call_id=f"call{i - 1}", id=f"t{i}")
+
+
+def per_step_us(fn, messages, steps=50):
+    """Average cost of one step while the thread grows from len(messages) by `steps` messages."""
+    history = list(messages)
+    start = time.perf_counter()
+    for step in range(steps):
+        history.append(make_message(len(history)))
+        fn(history)
+    return (time.perf_counter() - start) / steps * 1e6
+
+
+def main():
+    results = []
+    for size in (10, 100, 1000):
+        messages = [make_message(i) for i in range(size)]
+
+        legacy_us = per_step_us(lambda history: legacy_prepare(history, "thought"), messages)
+
+        serializer = HistorySerializer()
+        serializer.encode_prefix(messages, thread_id="bench") # warm, as after the previous step
+        incremental_us = per_step_us(lambda history: serializer.extend(serializer.encode_prefix(history, thread_id="bench"),
+                                                                       {"role": "user", "content": "thought"}), messages)
+
+        payload_legacy = len(legacy_prepare(messages, "thought"))
+        payload_compact = len(serializer.extend(serializer.encode_prefix(messages, thread_id="size"), {"role": "user", "content": "thought"}))
+        results.append({"messages": size, "legacy_us": round(legacy_us, 1), "incremental_us": round(incremental_us, 1),
+                        "legacy_bytes": payload_legacy, "compact_bytes": payload_compact})
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
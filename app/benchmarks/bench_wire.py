@@ -0,0 +1,131 @@
+"""Wire protocol of the streaming workflow endpoints: payload size and encode/decode cost.
+
+Compares the previous events (`{"event": "message", "data": dumpd(message)}` through
+json.dumps, decoded with json.loads) with the compact events of wire.py as orjson
+NDJSON, SSE and length-prefixed msgpack, for one turn: streamed tokens, the tool-call
+message, the interrupt, the tool result after the resume, and the final answer.
+
+    python ../benchmarks/bench_wire.py --tool-chars 4000 --tokens 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from langchain_core.load import dumpd
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+from langgraph.types import Interrupt
+
+import wire
+
+METADATA = {"token_usage": {"prompt_tokens": 812, "completion_tokens": 64, "total_tokens": 876},
+            "model_name": "Llama-3.2-1B-Instruct-FP8", "system_fingerprint": None, "finish_reason": "tool_calls", "logprobs": None}
+
+
+def make_turn(tool_chars, tokens):
+    """(kind, item) in the order the graph yields them, as in app.workflow_events."""
+    tool_call = {"name": "tavily_search", "args": {"query": "latest vLLM release notes"}, "id": "chatcmpl-tool-5f1c", "type": "tool_call"}
+    call = AIMessage(content="", id="run-1b2c", tool_calls=[tool_call], response_metadata=METADATA,
+                     additional_kwargs={"refusal": None}, usage_metadata={"input_tokens": 812, "output_tokens": 64, "total_tokens": 876})
+    result = ToolMessage(content=("search result text " * (tool_chars // 19 + 1))[:tool_chars], name="tavily_search",
+                         tool_call_id=tool_call["id"], id="tool-9e8f")
+    answer_text = " word" * tokens
+    answer = AIMessage(content=answer_text, id="run-3d4e", response_metadata={**METADATA, "finish_reason": "stop"},
+                       additional_kwargs={"refusal": None}, usage_metadata={"input_tokens": 1700, "output_tokens": tokens, "total_tokens": 1700 + tokens})
+    items = [("message", call), ("interrupt", Interrupt(value={"question": "Is this correct?", "tool_call": tool_call}, ns=["human_feedback:1"])),
+             ("message", result)]
+    items += [("token", AIMessageChunk(content=" word", id="run-3d4e")) for _ in range(tokens)]
+    items.append(("message", answer))
+    return items
+
+
+def legacy_events(items):
+    events = []
+    for kind, item in items:
+        if kind == "token":
+            events.append({"event": "token", "id": item.id, "content": item.content})
+        elif kind == "interrupt":
+            events.append({"event": "interrupt", "value": item.value})
+        else:
+            events.append({"event": "message", "data": dumpd(item)})
+            if isinstance(item, AIMessage) and item.tool_calls:
+                events.append({"event": "tool_call", "tool_calls": item.tool_calls})
+    events.append({"event": "end", "ttft_ms": 41.2, "total_ms": 2310.5, "tokens": 200})
+    return events
+
+
+def compact_events(items):
+    events = []
+    for kind, item in items:
+        if kind == "token":
+            events.append(wire.token_event(item))
+        elif kind == "interrupt":
+            events.append(wire.interrupt_event(item))
+        else:
+            events.append(wire.message_event(item))
+            if isinstance(item, AIMessage) and item.tool_calls:
+                events.append(wire.tool_call_event(item))
+    events.append(wire.end_event(41.2, 2310.5, 200))
+    return events
+
+
+def legacy_encode(items):
+    return b"".join((json.dumps(event, default=str) + "\n").encode() for event in legacy_events(items))
+
+
+def legacy_decode(body):
+    return [json.loads(line) for line in body.decode().splitlines() if line]
+
+
+def compact_encode(items, encoding):
+    return b"".join(wire.encode(event, encoding) for event in compact_events(items))
+
+
+def compact_decode(body, encoding):
+    return wire.Decoder(encoding).feed(body)
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tool-chars", type=int, default=4000, help="size of the tool result")
+    parser.add_argument("--tokens", type=int, default=200, help="streamed tokens of the final answer")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    items = make_turn(args.tool_chars, args.tokens)
+    paths = {"dumpd + json (previous)": (lambda: legacy_encode(items), legacy_decode)}
+    for encoding in (wire.NDJSON, wire.SSE, wire.MSGPACK):
+        paths[f"compact {encoding}"] = (lambda encoding=encoding: compact_encode(items, encoding),
+                                        lambda body, encoding=encoding: compact_decode(body, encoding))
+
+    print(f"one turn: {len(items) + 2} events, tool result {args.tool_chars} chars, {args.tokens} tokens\n")
+    print(f"{'path':<26} {'bytes':>8} {'non-token bytes':>16} {'encode us':>10} {'decode us':>10}")
+    baseline = None
+    for name, (encode, decode) in paths.items():
+        body = encode()
+        message_items = [item for item in items if item[0] != "token"]
+        non_token = len(legacy_encode(message_items)) if name.startswith("dumpd") else \
+            len(compact_encode(message_items, name.split()[-1]))
+        encode_us = timed(encode, args.repeat) * 1e6
+        decode_us = timed(lambda: decode(body), args.repeat) * 1e6
+        baseline = baseline or (len(body), non_token, encode_us, decode_us)
+        print(f"{name:<26} {len(body):>8} {non_token:>16} {encode_us:>10.0f} {decode_us:>10.0f}"
+              + ("" if baseline[0] == len(body) else
+                 f"   ({len(body) / baseline[0]:.2f}x size, {non_token / baseline[1]:.2f}x non-token,"
+                 f" {encode_us / baseline[2]:.2f}x encode, {decode_us / baseline[3]:.2f}x decode)"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Local stand-ins for vLLM and the Tavily API, for load tests without a GPU or API quota.
+
+* POST /v1/chat/completions  OpenAI-compatible, streaming and non-streaming. When the
+  request carries tools and the last message is from the user, it answers (with
+  probability --tool-call-rate) with a llama3_json tool call, returned parsed into
+  `tool_calls` the way vLLM's llama3_json parser does.
+* GET /health, GET /v1/models  what the agent-app probes
+* --fail-rate                  answer a share of completions with 500, to exercise the LLM router
+* POST /search                 Tavily-shaped search results
+
+Point the agent-app at it with:
+    VLLM_SERVER_URL=http://localhost:8000/v1 TAVILY_API_URL=http://localhost:8000 TAVILY_API_KEY=fake
+
+    python fake_services.py --port 8000 --latency-ms 80 --tokens-per-sec 60 --tool-call-rate 0.7
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+settings = argparse.Namespace(latency_ms=50.0, tokens_per_sec=50.0, reply_tokens=40, tool_call_rate=0.7,
+                              search_latency_ms=300.0, tools=["tavily_search"], model="Llama-3.2-1B-Instruct-FP8",
+                              fail_rate=0.0)
+
+WORDS = "the agent reviewed the search results and found a concise answer to your question".split()
+
+
+def llama3_json_tool_call(name, last_user_content):
+    """Raw model output in the llama3_json tool format."""
+    if name == "think_step":
+        parameters = {"properties": {"thought": f"Do I have everything to answer: {last_user_content}"}}
+    else:
+        parameters = {"query": last_user_content}
+    return json.dumps({"name": name, "parameters": parameters})
+
+
+def parse_llama3_json(text):
+    """What vLLM's llama3_json tool parser turns the raw output into."""
+    call = json.loads(text)
+    return {"id": f"chatcmpl-tool-{uuid.uuid4().hex[:24]}", "type": "function",
+            "function": {"name": call["name"], "arguments": json.dumps(call["parameters"])}}
+
+
+def plan_reply(body):
+    messages = body["messages"]
+    last = messages[-1]
+    if body.get("tools") and last["role"] == "user" and random.random() < settings.tool_call_rate:
+        available = [tool["function"]["name"] for tool in body["tools"]]
+        names = [name for name in settings.tools if name in available] or available
+        return None, parse_llama3_json(llama3_json_tool_call(random.choice(names), str(last["content"])))
+    tokens = [random.choice(WORDS) for _ in range(settings.reply_tokens)]
+    return tokens, None
+
+
+def usage(body, completion_tokens):
+    prompt_tokens = sum(len(str(message.get("content", ""))) for message in body["messages"]) // 4
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.get("/health")
+async def health():
+    return {}
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": settings.model, "object": "model"}]}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < settings.fail_rate: # replica trouble, for router retry/ejection tests
+        return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    tokens, tool_call = plan_reply(body)
+    await asyncio.sleep(settings.latency_ms / 1000) # queueing + prefill
+
+    if not body.get("stream"):
+        await asyncio.sleep(len(tokens or [1]) / settings.tokens_per_sec)
+        message = {"role": "assistant", "content": " ".join(tokens) if tokens else None}
+        if tool_call:
+            message["tool_calls"] = [tool_call]
+        return {"id": completion_id, "object": "chat.completion", "created": created, "model": body.get("model"),
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_call else "stop"}],
+                "usage": usage(body, len(tokens or [1]))}
+
+    async def stream():
+        def chunk(delta, finish_reason=None, **extra):
+            return "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                          "model": body.get("model"), **extra,
+                                          "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}) + "\n\n"
+
+        yield chunk({"role": "assistant", "content": ""})
+        if tool_call:
+            yield chunk({"tool_calls": [{"index": 0, **tool_call}]})
+            yield chunk({}, "tool_calls")
+        else:
+            for i, token in enumerate(tokens):
+                await asyncio.sleep(1 / settings.tokens_per_sec)
+                yield chunk({"content": token if i == 0 else " " + token})
+            yield chunk({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                                         "model": body.get("model"), "choices": [],
+                                         "usage": usage(body, len(tokens or [1]))}) + "\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+@app.head("/")
+async def search_root():
+    return {}
+
+
+@app.post("/search")
+async def search(request: Request):
+    body = await request.json()
+    start = time.perf_counter()
+    await asyncio.sleep(settings.search_latency_ms / 1000)
+    results = [{"title": f"Result {i} for {body.get('query')}", "url": f"https://example.com/{i}",
+                "content": " ".join(random.choice(WORDS) for _ in range(60)), "score": round(1 - i * 0.1, 2),
+                "raw_content": None} for i in range(body.get("max_results", 5))]
+    return {"query": body.get("query"), "follow_up_questions": None, "answer": None, "images": [],
+            "results": results, "response_time": round(time.perf_counter() - start, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=settings.latency_ms, help="time before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=settings.tokens_per_sec)
+    parser.add_argument("--reply-tokens", type=int, default=settings.reply_tokens)
+    parser.add_argument("--tool-call-rate", type=float, default=settings.tool_call_rate)
+    parser.add_argument("--search-latency-ms", type=float, default=settings.search_latency_ms)
+    parser.add_argument("--tools", default=",".join(settings.tools), help="tools the fake model may call")
+    parser.add_argument("--model", default=settings.model)
+    parser.add_argument("--fail-rate", type=float, default=settings.fail_rate, help="share of chat completions answered with 500")
+    args = parser.parse_args()
+
+    for key, value in vars(args).items():
+        setattr(settings, key, value)
+    settings.tools = args.tools.split(",")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
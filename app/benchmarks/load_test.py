@@ -0,0 +1,193 @@
+"""Load-test driver for the agent-app.
+
+Replays scripted multi-turn sessions at a fixed concurrency. Each turn calls
+/initiate-workflow; while the graph stops on a human-review interrupt the session
+answers it through /resume-workflow ("continue"). A share of turns go to
+/generate-text instead. Reports p50/p95/p99 latency and requests/sec per endpoint,
+agent_history rows/sec (with --database-url) and the app's event-loop lag sampled
+from /health, and saves everything as JSON for regression comparison.
+
+    python load_test.py --base-url http://localhost:8050 --sessions 50 --concurrency 10 \
+        --output results.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+PROMPTS = [
+    "What is the weather like in Kuala Lumpur today?",
+    "Summarise the latest news about open-source LLM serving.",
+    "Who won the last Formula 1 race?",
+    "Explain what a KV cache is in two sentences.",
+]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def has_interrupt(response_json):
+    return any("Interrupt" in item.get("id", []) for item in response_json.get("response", []))
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def post(self, client, endpoint, payload):
+        start = time.perf_counter()
+        try:
+            response = await client.post(endpoint, json=payload)
+            response.raise_for_status()
+            return response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            self.errors[endpoint] += 1
+            print(f"{endpoint} failed: {e!r}", file=sys.stderr)
+            return None
+        finally:
+            self.latencies[endpoint].append(time.perf_counter() - start)
+
+
+async def run_session(client, recorder, args):
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    for _ in range(args.turns):
+        prompt = [{"role": "user", "content": random.choice(PROMPTS)}]
+
+        if random.random() < args.generate_ratio:
+            await recorder.post(client, "/generate-text", {"prompt": prompt, "config": config})
+            continue
+
+        response = await recorder.post(client, "/initiate-workflow", {"prompt": prompt, "config": config})
+        cycles = 0
+        while response is not None and has_interrupt(response) and cycles < args.max_resumes:
+            await asyncio.sleep(args.think_time)
+            response = await recorder.post(client, "/resume-workflow",
+                                           {"prompt": prompt, "resume": {"action": "continue"}, "config": config})
+            cycles += 1
+
+
+async def sample_loop_lag(client, samples, stop):
+    while not stop.is_set():
+        try:
+            lag = (await client.get("/health")).json().get("loop_lag_ms", {})
+            if lag.get("recent_max") is not None:
+                samples.append(lag["recent_max"])
+        except (httpx.HTTPError, ValueError):
+            pass
+        await asyncio.sleep(0.5)
+
+
+async def count_history_rows(database_url):
+    if not database_url:
+        return None
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(database_url)
+    try:
+        async with engine.connect() as conn:
+            return (await conn.execute(text("SELECT count(*) FROM agent_history"))).scalar()
+    finally:
+        await engine.dispose()
+
+
+def summarize(recorder, elapsed):
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        endpoints[endpoint] = {"count": len(latencies), "errors": recorder.errors[endpoint],
+                               "rps": round(len(latencies) / elapsed, 2),
+                               "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+                               "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+                               "p99_ms": round(percentile(latencies, 99) * 1000, 2)}
+    return endpoints
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            change = (current[metric] - previous[metric]) / previous[metric] if previous[metric] else 0
+            print(f"{endpoint:22} {metric:7} {previous[metric]:10.2f} -> {current[metric]:10.2f} ({change:+.1%})")
+            if change > threshold:
+                regressions.append(f"{endpoint} {metric} {change:+.1%}")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://localhost:8050")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--generate-ratio", type=float, default=0.2, help="share of turns sent to /generate-text")
+    parser.add_argument("--max-resumes", type=int, default=4)
+    parser.add_argument("--think-time", type=float, default=0.0, help="simulated human review delay (s)")
+    parser.add_argument("--database-url", default=None, help="postgresql+asyncpg URL to measure agent_history rows/sec")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="baseline JSON from a previous run")
+    parser.add_argument("--regression-threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    recorder = Recorder()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rows_before = await count_history_rows(args.database_url)
+
+    limits = httpx.Limits(max_connections=args.concurrency + 2)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        lag_samples, stop = [], asyncio.Event()
+        lag_task = asyncio.create_task(sample_loop_lag(client, lag_samples, stop))
+
+        async def bounded_session():
+            async with semaphore:
+                await run_session(client, recorder, args)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded_session() for _ in range(args.sessions)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await lag_task
+
+    rows_after = await count_history_rows(args.database_url)
+    total_requests = sum(len(latencies) for latencies in recorder.latencies.values())
+    results = {
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "requests": total_requests,
+        "rps": round(total_requests / elapsed, 2),
+        "endpoints": summarize(recorder, elapsed),
+        "db_rows_per_sec": round((rows_after - rows_before) / elapsed, 2) if rows_before is not None else None,
+        "loop_lag_ms": {"p50": percentile(lag_samples, 50), "p95": percentile(lag_samples, 95),
+                        "max": max(lag_samples, default=None)},
+        "timestamp": time.time(),
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare, args.regression_threshold)
+        if regressions:
+            print("Regressions:", *regressions, sep="\n  ")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
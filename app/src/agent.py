@@ -1,15 +1,23 @@
 from typing import Annotated, TypedDict, Dict, List,Any,Literal
 from langgraph.graph import StateGraph, START, END
 from langchain_core.runnables import RunnableConfig
+from langchain_core.messages import convert_to_messages
 from langgraph.types import Command, interrupt
 import logging
 import sys
 import uuid
 import asyncio
-
-from llm.llm_services import llm_with_tools, async_generate_tool_response
-from tool.tools import tool_node
-from langgraph.checkpoint.memory import InMemorySaver
+import json
+
+from llm.llm_services import async_generate_tool_response
+from tool.tools import build_tool_node, tools_for_llm
+from tool.speculation import speculation
+from tool.approval import approval_policy
+from database.writer import history_writer
+from llm.context import ContextAssembler
+from metrics import observe_node, track_thread, review_requested, review_skipped, thread_id_of
+from database.checkpointer import DeltaPostgresSaver
+from database.db import engine
 
 from dotenv import load_dotenv
 from state import AgentState
@@ -17,20 +25,17 @@ from state import AgentState
 
 
 load_dotenv()
-logging.basicConfig(
-    level=logging.DEBUG,  # Can be DEBUG, INFO, WARNING, ERROR, CRITICAL
-    stream=sys.stdout,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
+logger = logging.getLogger(__name__)
 
-checkpointer = InMemorySaver()
+checkpointer = DeltaPostgresSaver(engine)
+context_assembler = ContextAssembler() # tool schemas are added when the graph is compiled
 
 # counter_call_llm = 0
 # counter_human_node = 0
 
 async def call_llm(state: AgentState, config:RunnableConfig) -> Dict[str, Any]:
     """Calls the LLM hosted in vLLM server."""
-    print("--- Calling LLM ---")
+    logger.debug("Calling LLM")
 
     # global counter_call_llm
 
@@ -38,18 +43,25 @@ async def call_llm(state: AgentState, config:RunnableConfig) -> Dict[str, Any]:
     # print(f"Entered `call_llm` a total of {counter_call_llm} times")
     # print("state:",state['messages'])
 
-    response = await async_generate_tool_response(state['messages'], config=config)# All the context
+    with observe_node("call_llm", config):
+        # fit the thread into the model window: pinned system + current turn, older content truncated/summarized
+        messages = context_assembler.assemble(state['messages'], thread_id=config["configurable"].get("thread_id"))
+        response = await async_generate_tool_response(messages, config=config)
  
 
     return {"messages":[response]}
 
 
-def call_human_feedback(state: AgentState) -> Command[Literal["call_llm", "tool_node"]]:
+def call_human_feedback(state: AgentState, config: RunnableConfig) -> Command[Literal["call_llm", "tool_node"]]:
     """Request feedback from a human."""
     
     last_message = state["messages"][-1]
     tool_call = last_message.tool_calls[-1]
 
+    # low-risk calls pass the approval policy and skip the interrupt -> /resume-workflow round trip
+    if approval_policy is not None and auto_approved(last_message.tool_calls, config):
+        return Command(goto="tool_node")
+
     # global counter_human_node
     # counter_human_node += 1 # This code will run again!
     # print(f"Entered human_node a total of {counter_human_node} times")
@@ -87,6 +99,8 @@ def call_human_feedback(state: AgentState) -> Command[Literal["call_llm", "tool_
     
     # provide feedback to LLM
     elif review_action == "feedback":
+        if speculation is not None: # the tool will not run, drop its speculative result
+            speculation.discard(thread_id_of(config), tool_call["id"])
 
         tool_message = {
             "role":"tool",
@@ -98,14 +112,27 @@ def call_human_feedback(state: AgentState) -> Command[Literal["call_llm", "tool_
   
 
 
+def auto_approved(tool_calls: List[Dict[str, Any]], config: RunnableConfig) -> bool:
+    """Consult the approval policy; approvals are audited in agent_history as message_type "approval"."""
+    thread_id = thread_id_of(config)
+    approved, decisions = approval_policy.decide(tool_calls, thread_id, config["configurable"].get("tenant_id"))
+    if approved:
+        logger.info(f"Auto-approved {[decision.tool for decision in decisions]} by {[decision.rule for decision in decisions]}")
+        review_skipped((decision.tool, decision.rule) for decision in decisions)
+        history_writer.add(prompt=json.dumps([{"name": call["name"], "args": call["args"], "id": call["id"]} for call in tool_calls], default=str),
+                           response=json.dumps({"decision": "auto_approved", "decisions": [decision.to_dict() for decision in decisions]}),
+                           message_type="approval", thread_id=thread_id)
+    return approved
+
+
 def routing_decision(state) -> Literal["END", "call_human_feedback"]:
     """Route LLM decision to either seeking human feedback or ending the graph """
 
     if len(state["messages"][-1].tool_calls) == 0:
-        ("--- Decision: Latest message is AIMessage with content without tool calling, ending graph ---")
+        logger.debug("Decision: latest AIMessage has no tool calls, ending graph")
         return "END"
     else:
-        print("--- Decision: tool_calls in state, proceeding to 'call_human_feedback' node ---")
+        logger.debug("Decision: tool_calls in state, proceeding to 'call_human_feedback' node")
         return "call_human_feedback"
 
 
@@ -116,11 +143,21 @@ def routing_decision(state) -> Literal["END", "call_human_feedback"]:
 class AgentWorkflow:
     def __init__(self):
         self.call_llm = call_llm
-        self.tool_node = tool_node
+        self.tool_node = None
         self.call_human_feeedback = call_human_feedback
         self.routing_decision = routing_decision
         self.agent_state = AgentState
         self.checkpointer = checkpointer
+        self.react_graph = None
+
+    def compile(self):
+        """Instantiate the tools and compile the graph. Called once from the app lifespan, so importing
+        this module stays cheap and no request waits for it."""
+        if self.react_graph is not None:
+            return self.react_graph
+
+        self.tool_node = build_tool_node()
+        context_assembler.set_tool_schemas(tools_for_llm())
 
         self.workflow = StateGraph(self.agent_state)
         # Define the nodes
@@ -145,6 +182,15 @@ class AgentWorkflow:
 
         # Compile the graph
         self.react_graph = self.workflow.compile(checkpointer=self.checkpointer)
+        return self.react_graph
+
+    def _review_requested(self, config: RunnableConfig, interrupt) -> None:
+        """The graph stopped for human review: start the wait timer and, for read-only tools, the tool itself."""
+        thread_id = thread_id_of(config)
+        review_requested(thread_id)
+        tool_call = (getattr(interrupt, "value", None) or {}).get("tool_call")
+        if tool_call:
+            self.tool_node.speculate(thread_id, tool_call)
 
     async def async_predict_react_agent_answer(self,inputs):
         """Invoke Method"""
@@ -158,18 +204,51 @@ class AgentWorkflow:
     async def async_astream_react_agent(self,inputs,config:RunnableConfig):
         """Use this in initiate workflow API"""
 
-        async for event in self.react_graph.astream({"messages":inputs}, config,stream_mode="values"): # use return will return coroutine instead of async generator
-            if "messages" in event:
-                yield event["messages"][-1] # async generator
-            if '__interrupt__' in event:
-                yield event['__interrupt__'][-1]
+        with track_thread(config):
+            async for event in self.react_graph.astream({"messages":inputs}, config,stream_mode="values"): # use return will return coroutine instead of async generator
+                if "messages" in event:
+                    yield event["messages"][-1] # async generator
+                if '__interrupt__' in event:
+                    self._review_requested(config, event['__interrupt__'][-1])
+                    yield event['__interrupt__'][-1]
+
+    async def async_astream_events(self,inputs,config:RunnableConfig):
+        """Use this in the streaming APIs. `inputs` is either {"messages": [...]} or a resume Command.
+
+        Yields as the graph runs:
+            ("token", AIMessageChunk)  LLM tokens of call_llm
+            ("message", BaseMessage)   complete messages produced by a node
+            ("interrupt", Interrupt)   human review requested
+        """
+
+        with track_thread(config, resumed=isinstance(inputs, Command)):
+            async for mode, payload in self.react_graph.astream(inputs, config, stream_mode=["messages","updates"]):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    # think_step streams its nested LLM call too, only surface the agent's own reply
+                    if metadata.get("langgraph_node") == "call_llm" and chunk.content:
+                        yield "token", chunk
+
+                elif mode == "updates":
+                    for node, update in payload.items():
+                        if node == "__interrupt__":
+                            for item in update:
+                                self._review_requested(config, item)
+                                yield "interrupt", item
+                        elif update and "messages" in update:
+                            for message in convert_to_messages(update["messages"]): # nodes may return dict messages
+                                yield "message", message
 
     async def async_astream_command(self,inputs,config:RunnableConfig):
         """Use this in resume workflow API"""
 
-        async for event in self.react_graph.astream(inputs, config,stream_mode="values"): # use return will return coroutine instead of async generator
-            if "messages" in event:
-                yield event["messages"][-1] # async generator
+        with track_thread(config, resumed=True):
+            async for event in self.react_graph.astream(inputs, config,stream_mode="values"): # use return will return coroutine instead of async generator
+                if "messages" in event:
+                    yield event["messages"][-1] # async generator
+                if '__interrupt__' in event: # the resumed run can stop on the next tool call
+                    self._review_requested(config, event['__interrupt__'][-1])
+                    yield event['__interrupt__'][-1]
 
 
 
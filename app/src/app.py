@@ -1,22 +1,35 @@
 import os
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query, Header
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any,TypedDict, Annotated
+from typing import List, Optional, Dict, Any,TypedDict, Annotated, Tuple
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import gc
+import time
 import logging
 import sys
 from langchain_core.runnables import RunnableConfig
-from llm.llm_services import async_generate_text_response,check_server_status
-from agent import react_graph
+from llm.llm_services import async_generate_text_response, get_llm, get_llm_router, llm_scheduler, LLMOverloaded
+from llm.response_cache import response_cache, CacheControl, sampling_params, is_deterministic, response_cache_key
+from health import health_prober
+from metrics import render_metrics, review_abandoned
+from log_config import configure_logging, bind_thread_id, log_payload
+from agent import react_graph, checkpointer, context_assembler
+from tool.approval import approval_policy
+from tool.tools import memory_index
+from sessions import sessions
+from profiler import profiler, profile_id_var
+import wire
 import json
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 from langchain_core.load import dumpd, dumps, load, loads
 
 from database.db import AsyncSessionLocal, engine, get_async_db_session,Base
 from sqlalchemy.ext.asyncio import AsyncSession
-from database.crud import async_db_save
+from database.crud import async_db_save, ensure_history_indexes, async_db_list_threads, async_db_thread_messages, async_db_recent_transcript
+from database.writer import history_writer
+from idempotency import idempotency, request_key, body_hash, Execution, IdempotencyConflict
+from database.partitions import build_partition_manager
 import asyncio
 from sqlalchemy.ext.asyncio import AsyncEngine
 from langgraph.types import Command
@@ -33,11 +46,8 @@ from langchain_core.messages import (
 load_dotenv()
 
 
-logging.basicConfig(
-    level=logging.DEBUG,  # Can be DEBUG, INFO, WARNING, ERROR, CRITICAL
-    stream=sys.stdout,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
+# queue-based, JSON by default; LOG_LEVEL / LOG_LEVELS set per-subsystem levels
+configure_logging()
 
 # Create a logger instance
 logger = logging.getLogger(__name__) # app name
@@ -49,6 +59,29 @@ async def create_all_tables(engine: AsyncEngine):
 
 
 
+def get_message_type_and_content(item):
+    """Map a streamed graph item to the (message_type, content) pair stored in agent_history."""
+    if isinstance(item, SystemMessage): # if provided one
+        return "system", item.content
+    elif isinstance(item, HumanMessage):
+        return "user", item.content
+    elif isinstance(item, AIMessage):
+        return "assistant", item.content
+    elif isinstance(item, ToolMessage):
+        return "tool", item.content
+    else:
+        return str(type(item)), f"{item}"
+
+
+
+def build_resume_command(resume_command: Dict) -> Command:
+    """Turns the UI's {"action", "data"} payload into the graph resume Command."""
+    if resume_command["action"]=="continue":
+        return Command(resume={"action": resume_command["action"]})
+    return Command(resume={"action": resume_command["action"],"data":resume_command["data"]})
+
+
+
 class Message(TypedDict):
     role: str
     content: str
@@ -87,166 +120,463 @@ class GenerationResponse(BaseModel):
 
 
 
+history_partitions = build_partition_manager(engine)
+
+
+def build_agent():
+    """Chat models, tools and the compiled graph. Kept out of module import: langchain_openai and
+    langchain_tavily alone take over a second (see benchmarks/bench_startup.py)."""
+    router = get_llm_router()
+    react_graph.compile()
+    # per-thread state dropped when the session manager evicts an idle thread
+    sessions.register(checkpointer.evict, context_assembler.forget, react_graph.tool_node.history_serializer.forget,
+                      router.forget, review_abandoned)
+
+
+async def thread_has_checkpoint(thread_id: str) -> bool:
+    return await checkpointer.aget_tuple({"configurable": {"thread_id": thread_id, "checkpoint_ns": ""}}) is not None
+
+
+async def thread_transcript(thread_id: str, limit: int) -> List[Dict]:
+    async with AsyncSessionLocal() as db:
+        return await async_db_recent_transcript(db, thread_id, limit)
+
+
 @asynccontextmanager
 async def startup_event(app: FastAPI):
     logger.info("Starting application...")
+    start = time.perf_counter()
+    # imports run in a worker thread while the event loop talks to postgres
+    agent_built = asyncio.create_task(asyncio.to_thread(build_agent))
 
     logger.info("Creating all tables...")
     await create_all_tables(engine)
+    await ensure_history_indexes(engine)
     logger.info("Tables created.")
+    await agent_built
+    logger.info(f"Agent graph compiled, startup took {time.perf_counter() - start:.2f}s")
+    await history_partitions.start() # daily partitions of agent_history + retention/archival in the background
+
+    if (index := memory_index()) is not None: # recall_memory: index rows as they are written, catch up in the background
+        history_writer.add_listener(index.add_rows)
+        await index.start(AsyncSessionLocal, engine)
+    await history_writer.start()
+    await health_prober.start()
+    sessions.configure(is_busy=idempotency.thread_busy, has_checkpoint=thread_has_checkpoint,
+                       transcript=thread_transcript, delete=checkpointer.adelete_thread, thread_lock=idempotency.thread_lock)
+    await sessions.start()
 
     yield
 
     logger.info("Application is shutting down...")
+    await history_partitions.stop()
+    await sessions.stop()
+    await idempotency.stop()
+    await health_prober.stop()
+    if (index := memory_index()) is not None:
+        await index.stop() # snapshot of the rows indexed since the last merge
+    await history_writer.stop() # flush buffered history before exit
+    logger.info(f"History writer drained: {history_writer.stats()}")
 
 
 app = FastAPI(lifespan=startup_event)
 
 
-# a custom health-check endpoint
+@app.exception_handler(LLMOverloaded)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloaded):
+    """Load shedding: the LLM scheduler's queue is full, tell the client when to come back."""
+    return JSONResponse({"detail": str(exc)}, status_code=429, headers={"Retry-After": str(exc.retry_after)})
+
+
+# liveness: the process is up and serving. Answered from memory, never waits on a dependency
 @app.get("/health")
 async def health():
-    status = check_server_status()
-    return status
+    return health_prober.liveness()
+
+
+# readiness: cached dependency status from the background prober, 503 when a critical one is down or slow
+@app.get("/ready")
+async def ready():
+    status = health_prober.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint: node/tool/LLM latency, token counts, vLLM queue time."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+# ----------------------------------- Profiling ---------------------------------------------------
+# off unless PROFILER_TOKEN is set. A workflow request with "X-Profile: 1" and the token in
+# X-Profile-Token is profiled on its own; its X-Profile-Id response header names the profile.
+
+def require_profiler_token(x_profile_token: Optional[str] = Header(default=None)):
+    if not profiler.enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiler.authorized(x_profile_token):
+        raise HTTPException(status_code=403, detail="invalid X-Profile-Token")
+
+
+@app.post("/debug/profile", dependencies=[Depends(require_profiler_token)])
+async def profile_window(seconds: float = Query(default=10.0, gt=0)):
+    """Sample everything the event loop does for `seconds`, then return the summary."""
+    profile = await profiler.window(min(seconds, profiler.max_seconds))
+    if profile is None:
+        raise HTTPException(status_code=429, detail="too many profiles running")
+    return profile.summary()
+
+
+@app.get("/debug/profiles", dependencies=[Depends(require_profiler_token)])
+async def list_profiles():
+    return {"profiles": profiler.profiles()}
+
+
+@app.get("/debug/profile/{profile_id}", dependencies=[Depends(require_profiler_token)])
+async def get_profile(profile_id: str, mode: str = Query(default="cpu", pattern="^(cpu|wait)$")):
+    """Collapsed stacks (flamegraph.pl, speedscope): cpu = on the event loop, wait = where the tasks were suspended."""
+    profile = profiler.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"no profile {profile_id}")
+    return PlainTextResponse(profile.collapsed(mode))
+
+
+@app.get("/debug/loop-stalls", dependencies=[Depends(require_profiler_token)])
+async def loop_stalls():
+    """Recent stalls of the event loop over LOOP_STALL_THRESHOLD_MS, with the stack that held it."""
+    return {"threshold_ms": health_prober.stall_monitor.threshold * 1000, "stalls": health_prober.stall_monitor.recent()}
     
 
 
 
+def bind_tenant(config: Dict, http_request: Request) -> None:
+    """The tenant the approval policy matches on: from the proxy-signed X-Tenant-Id, never from the request body."""
+    configurable = config.setdefault("configurable", {})
+    tenant = approval_policy.verified_tenant(http_request.headers.get("x-tenant-id"),
+                                             http_request.headers.get("x-tenant-signature")) if approval_policy else None
+    if tenant is None:
+        configurable.pop("tenant_id", None)
+    else:
+        configurable["tenant_id"] = tenant
+
+
+def start_or_join(endpoint: str, http_request: Request, payload: Dict, thread_id: str, events) -> Tuple[Execution, str]:
+    """Join the running or recently finished execution of this request, or start one (one at a time per thread)."""
+    sessions.touch(thread_id)
+    if (index := memory_index()) is not None:
+        # never from the request body: the proxy that authenticated the user signs its id
+        index.bind_user(thread_id, index.verified_user(http_request.headers.get("x-user-id"),
+                                                       http_request.headers.get("x-user-signature")))
+    key, explicit = request_key(endpoint, http_request.headers.get("idempotency-key"), payload)
+    payload_hash = body_hash(payload) if explicit else None
+    try:
+        execution, status = idempotency.get(key, payload_hash)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if execution is None:
+        if resume_position(http_request):
+            # a retry of a run this process no longer has (expired, restarted): running the turn
+            # again would append the prompt twice and splice two runs together on the client
+            raise HTTPException(status_code=409, detail="execution to resume not found, start the turn again")
+        llm_scheduler.admit("call_llm") # only a new run takes LLM capacity
+        profile = None
+        if "x-profile" in http_request.headers:
+            if not profiler.authorized(http_request.headers.get("x-profile-token")):
+                if profiler.enabled:
+                    raise HTTPException(status_code=403, detail="invalid X-Profile-Token")
+            else:
+                profile = profiler.begin("request", thread_id)
+        # the execution task copies the context, so the graph's tasks all carry the profile id
+        context_token = profile_id_var.set(profile.id) if profile is not None else None
+        try:
+            execution = idempotency.start(key, thread_id, explicit, events, payload_hash)
+        finally:
+            if context_token is not None:
+                profile_id_var.reset(context_token)
+        if profile is not None:
+            execution.profile_id = profile.id
+            execution.task.add_done_callback(lambda task: profiler.end(profile))
+    if status != "new":
+        logger.info(f"Request {status} to execution {key}")
+    return execution, status
+
+
 @app.post("/initiate-workflow")
-async def initiate_workflow(request: GenerationRequest,db:Annotated[AsyncSession, Depends(get_async_db_session)]):
-    """Initiates action workflow."""
+async def initiate_workflow(request: GenerationRequest, http_request: Request, http_response: Response):
+    """Initiates action workflow. Repeats with the same Idempotency-Key get the same result without re-running."""
     
     input_prompt = request.prompt # list
     config = request.config
-    print(f"Initiating workflow for thread_id: {config["configurable"]["thread_id"]} with prompt: {input_prompt}")
-    print(input_prompt)
+    thread_id = config["configurable"]["thread_id"]
+    bind_thread_id(config)
+    bind_tenant(config, http_request)
 
-    # gather all response and send them back at once
-    response = []
-    async for item in react_graph.async_astream_react_agent(input_prompt,config):
-        print("initiate item:",item)
-        
+    async def items():
+        logger.info("Initiating workflow")
+        log_payload(logger, "prompt", input_prompt)
+        graph_input = await sessions.restore(thread_id, input_prompt)
+        async for item in react_graph.async_astream_react_agent(graph_input,config):
+            log_payload(logger, "initiate item", item)
 
-        if isinstance(item, SystemMessage): # if provided one
-            message_type="system"
-            item_content = item.content
-        elif isinstance(item, HumanMessage):
-            message_type="user"
-            item_content = item.content
-        elif isinstance(item, AIMessage):
-            message_type="assistant"
-            item_content = item.content
-        elif isinstance(item, ToolMessage):
-            message_type="tool"
-            item_content = item.content
-        else:
-            message_type = str(type(item))
-            item_content = f"{item}"
+            message_type, item_content = get_message_type_and_content(item)
 
-        
+            # write-behind: rows are flushed in bulk by the background history writer
+            history_writer.add(prompt=input_prompt[0]["content"], response=item_content, message_type=message_type,thread_id=thread_id)
+            yield dumpd(item) # serialize to dict
 
-        try:
-            agent_history = await async_db_save(db,prompt=input_prompt[0]["content"], response=item_content, message_type=message_type,thread_id=config["configurable"]["thread_id"])
-        except Exception as db_error:
-            logging.info("DB ERROR CAUGHT:", db_error)
-            raise HTTPException(status_code=500,detail=str(db_error))
-        
-        serialized_item = dumpd(item) # serialize to dict
-        response.append(serialized_item)
-    print("check_response:",{"response":response})
+    execution, status = start_or_join("initiate-workflow", http_request, request.model_dump(), thread_id, items)
+    http_response.headers["X-Idempotency"] = status
+    if execution.profile_id:
+        http_response.headers["X-Profile-Id"] = execution.profile_id
+
+    # gather all response and send them back at once
+    response = [item async for item in execution.subscribe()]
+    logger.info(f"Workflow returned {len(response)} items")
     return {"response":response}
 
 
 @app.post("/resume-workflow")
-async def resume_workflow(request: ResumeGenerationRequest,db:Annotated[AsyncSession, Depends(get_async_db_session)]):
-    """Resumes action workflow."""
+async def resume_workflow(request: ResumeGenerationRequest, http_request: Request, http_response: Response):
+    """Resumes action workflow. A resubmitted resume joins or replays the first one instead of resuming twice."""
     
     resume_command = request.resume # list
     config = request.config
     input_prompt = request.prompt
-    print(f"Resuming workflow for thread_id: {config["configurable"]["thread_id"]} with human feedback: {resume_command}")
-    
+    thread_id = config["configurable"]["thread_id"]
+    bind_thread_id(config)
+    bind_tenant(config, http_request)
 
-    if resume_command["action"]=="continue":
-        human_command = Command(resume={"action": resume_command["action"]})
-    else:
-        human_command = Command(resume={"action": resume_command["action"],"data":resume_command["data"]})
-    print(human_command)
-    # gather all response and send them back at once
-    response = []
-    async for item in react_graph.async_astream_command(human_command,config):
-        print("resume item:",item)
-
-        if isinstance(item, SystemMessage): # if provided one
-            message_type="system"
-            item_content = item.content
-        elif isinstance(item, HumanMessage):
-            message_type="user"
-            item_content = item.content
-        elif isinstance(item, AIMessage):
-            message_type="assistant"
-            item_content = item.content
-        elif isinstance(item, ToolMessage):
-            message_type="tool"
-            item_content = item.content
-        else:
-            message_type = str(type(item))
-            item_content = f"{item}"
+    async def items():
+        logger.info(f"Resuming workflow with human feedback action {resume_command.get('action')}")
+        human_command = build_resume_command(resume_command)
+        async for item in react_graph.async_astream_command(human_command,config):
+            log_payload(logger, "resume item", item)
 
-        try:
-            agent_history = await async_db_save(db,prompt=input_prompt[0]["content"],response=item_content,message_type=message_type,thread_id=config["configurable"]["thread_id"])
-        except Exception as db_error:
-            logging.info("DB ERROR CAUGHT:", db_error)
-            raise HTTPException(status_code=500,detail=str(db_error))
-        
-        serialized_item = dumpd(item) # serialize to dict
-        response.append(serialized_item)
+            message_type, item_content = get_message_type_and_content(item)
 
-    print("check_response:",{"response":response})
+            history_writer.add(prompt=input_prompt[0]["content"],response=item_content,message_type=message_type,thread_id=thread_id)
+            yield dumpd(item) # serialize to dict
+
+    execution, status = start_or_join("resume-workflow", http_request, request.model_dump(), thread_id, items)
+    http_response.headers["X-Idempotency"] = status
+    if execution.profile_id:
+        http_response.headers["X-Profile-Id"] = execution.profile_id
+
+    # gather all response and send them back at once
+    response = [item async for item in execution.subscribe()]
+    logger.info(f"Resumed workflow returned {len(response)} items")
     return {"response":response}
 
 
 
 @app.post("/generate-text")
-async def generate_text(request: GenerationRequest,db:Annotated[AsyncSession, Depends(get_async_db_session)]):
-    """Generates text using the loaded model in vllm server."""
+async def generate_text(request: GenerationRequest,http_request: Request,http_response: Response):
+    """Generates text using the loaded model in vllm server.
+
+    When RESPONSE_CACHE is enabled, deterministic requests are answered from the exact-match
+    response cache. Cache-Control (no-store, no-cache, max-age=N, only-if-cached) and
+    X-Cache-Force control it per request, X-Cache reports what happened.
+    """
     input_prompt = request.prompt
-    print("input:",input_prompt)
+    thread_id = request.config.get("configurable",{}).get("thread_id")
+    bind_thread_id(request.config)
+    log_payload(logger, "generate-text input", input_prompt)
+
+    cache_control = CacheControl(http_request.headers.get("cache-control"), http_request.headers.get("x-cache-force"))
+    key, cache_status = None, "bypass"
+    if response_cache is not None and not cache_control.no_store:
+        params = sampling_params(get_llm())
+        if is_deterministic(params) or cache_control.force:
+            key = response_cache_key(input_prompt, params)
+        else:
+            response_cache.skipped += 1
+            cache_status = "skip-nondeterministic"
+
+    if key is not None and not cache_control.no_cache:
+        response = await response_cache.get(key, max_age=cache_control.max_age)
+        if response is not None:
+            http_response.headers["X-Cache"] = "hit"
+            history_writer.add(prompt=input_prompt[0]["content"], response=response.content, message_type="assistant",thread_id=thread_id)
+            return {"response":response}
+    if cache_control.only_if_cached:
+        raise HTTPException(status_code=504, detail="Response not in cache")
 
     try:
-        response = await async_generate_text_response(input_prompt)
-        print("response:",response.content)        
+        response = await async_generate_text_response(input_prompt, config=request.config)
+        log_payload(logger, "generate-text response", response.content)
+    except LLMOverloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"LLM generation failed: {str(e)}")
+
+    if key is not None:
+        await response_cache.set(key, params["model"], response)
+        cache_status = "miss"
+    http_response.headers["X-Cache"] = cache_status
     
-    try:
-        agent_history = await async_db_save(db,prompt=input_prompt[0]["content"], response=response.content)
-    except Exception as db_error:
-        logging.info("DB ERROR CAUGHT:", db_error)
-        raise HTTPException(status_code=500,detail=str(db_error))
+    history_writer.add(prompt=input_prompt[0]["content"], response=response.content, message_type="assistant",thread_id=thread_id)
     
     return {"response":response}
 
 
 
 
-# ----------------------------------- In development -------------------------------------------------    
+# ----------------------------------- History ---------------------------------------------------
+# keyset pagination over agent_history; rows still buffered in history_writer show up after its next flush
+
+@app.get("/threads")
+async def list_threads(db:Annotated[AsyncSession, Depends(get_async_db_session)],
+                       cursor: Optional[str] = None, limit: int = Query(default=50, ge=1, le=500)):
+    """Threads with their first/last activity, ordered by thread_id."""
+    try:
+        threads, next_cursor = await async_db_list_threads(db, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"threads": threads, "next_cursor": next_cursor}
+
+
+@app.get("/threads/{thread_id}/messages")
+async def thread_messages(thread_id: str, db:Annotated[AsyncSession, Depends(get_async_db_session)],
+                          cursor: Optional[str] = None, limit: int = Query(default=100, ge=1, le=1000)):
+    """One page of a thread's history, oldest first. Pass next_cursor back for the following page."""
+    try:
+        messages, next_cursor = await async_db_thread_messages(db, thread_id, cursor=cursor, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"thread_id": thread_id, "messages": messages, "next_cursor": next_cursor}
+
+
+@app.get("/threads/{thread_id}/messages/stream")
+async def stream_thread_messages(thread_id: str, batch_size: int = Query(default=500, ge=1, le=5000)):
+    """Whole thread as NDJSON, fetched page by page so memory stays flat and no transaction is held open."""
+
+    async def rows():
+        cursor = None
+        while True:
+            async with AsyncSessionLocal() as db:
+                messages, cursor = await async_db_thread_messages(db, thread_id, cursor=cursor, limit=batch_size)
+            for message in messages:
+                yield json.dumps(message) + "\n"
+            if cursor is None:
+                break
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+
+@app.get("/history/archive")
+async def list_archives():
+    """agent_history partitions exported by the retention task."""
+    return {"archives": await asyncio.to_thread(history_partitions.archives), "retention": history_partitions.stats()}
+
+
+@app.get("/history/archive/rows")
+async def query_archive(thread_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                        limit: int = Query(default=1000, ge=1, le=100000)):
+    """Archived rows of the days in [start, end] (YYYY-MM-DD), optionally of one thread, as NDJSON."""
+
+    async def rows():
+        async for row in history_partitions.query_archive(thread_id=thread_id, start=start, end=end, limit=limit):
+            yield json.dumps(row) + "\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
+
+
+
+# ----------------------------------- Streaming -------------------------------------------------
+async def workflow_events(graph_input, config, input_prompt):
+    """Runs the graph and yields token, message, tool_call and interrupt events (see wire.py) as they happen."""
+    thread_id = config["configurable"]["thread_id"]
+    start = time.perf_counter()
+    ttft_ms = None
+    n_tokens = 0
+
+    try:
+        async for kind, item in react_graph.async_astream_events(graph_input, config):
+            if kind == "token":
+                if ttft_ms is None:
+                    ttft_ms = (time.perf_counter() - start) * 1000
+                    logger.info(f"time to first token {ttft_ms:.1f} ms")
+                n_tokens += 1
+                yield wire.token_event(item)
+                continue
+
+            message_type, item_content = get_message_type_and_content(item)
+            history_writer.add(prompt=input_prompt[0]["content"], response=item_content, message_type=message_type,thread_id=thread_id)
+
+            if kind == "interrupt":
+                yield wire.interrupt_event(item)
+            else:
+                yield wire.message_event(item)
+                if isinstance(item, AIMessage) and item.tool_calls:
+                    yield wire.tool_call_event(item)
+    except LLMOverloaded as e: # the response has started, report it in-band
+        yield wire.error_event(429, str(e), e.retry_after)
+
+    total_ms = (time.perf_counter() - start) * 1000
+    yield wire.end_event(ttft_ms, total_ms, n_tokens)
+
+
+def resume_position(http_request: Request) -> int:
+    resume_from = http_request.headers.get("x-resume-from", "0")
+    return int(resume_from) if resume_from.isdigit() else 0
+
+
+async def execution_events(execution: Execution, start: int):
+    """The execution's events; a failed run ends with an error event, the response has already started."""
+    try:
+        async for event in execution.subscribe(start):
+            yield event
+    except Exception as e:
+        yield wire.error_event(500, f"workflow failed: {type(e).__name__}")
+
+
+def stream_execution(execution: Execution, status: str, http_request: Request) -> StreamingResponse:
+    """Encode an execution's events as NDJSON, SSE or msgpack, by Accept header.
+    X-Resume-From skips events a retrying client already has, only when it joins the same execution."""
+    encoding = wire.negotiate(http_request.headers.get("accept"))
+    start = resume_position(http_request) if status in ("attached", "replayed") else 0
+    event_stream = (wire.encode(event, encoding) async for event in execution_events(execution, start))
+    headers = {"X-Idempotency": status, "X-Wire-Protocol": str(wire.PROTOCOL_VERSION)}
+    if execution.profile_id:
+        headers["X-Profile-Id"] = execution.profile_id
+    return StreamingResponse(event_stream, media_type=wire.MEDIA_TYPES[encoding], headers=headers)
+
+
 @app.post("/initiate-workflow-stream")
-async def initiate_workflow_stream(request: GenerationRequest):
-    """Stream action workflow."""
-    #input_prompt = {"prompt": request.prompt}
+async def initiate_workflow_stream(request: GenerationRequest, http_request: Request):
+    """Streams action workflow: LLM tokens, tool calls and interrupts as NDJSON (or SSE)."""
     input_prompt = request.prompt # list
-    print(input_prompt)
-    response = []
+    config = request.config
+    thread_id = config["configurable"]["thread_id"]
+    bind_thread_id(config)
+    bind_tenant(config, http_request)
+
+    async def events():
+        # the transcript is read before this turn's row is queued, or a quick flush would repeat the prompt
+        graph_input = {"messages": await sessions.restore(thread_id, input_prompt)}
+        history_writer.add(prompt=input_prompt[0]["content"], response=input_prompt[-1]["content"], message_type="user",thread_id=thread_id)
+        async for event in workflow_events(graph_input, config, input_prompt):
+            yield event
+
+    execution, status = start_or_join("initiate-workflow-stream", http_request, request.model_dump(), thread_id, events)
+    return stream_execution(execution, status, http_request)
+
+
+@app.post("/resume-workflow-stream")
+async def resume_workflow_stream(request: ResumeGenerationRequest, http_request: Request):
+    """Streams the resumed action workflow, same events as /initiate-workflow-stream."""
+    config = request.config
+    input_prompt = request.prompt
+    thread_id = config["configurable"]["thread_id"]
+    bind_thread_id(config)
+    bind_tenant(config, http_request)
 
-    async def event_stream():
-        async for event in react_graph.async_astream_react_agent(input_prompt):
-            if "messages" in event:
-                # Serialize the last message
-                serialized = dumpd(event["messages"][-1])
-                yield f"data: {json.dumps(serialized)}\n\n" 
+    events = lambda: workflow_events(build_resume_command(request.resume), config, input_prompt)
+    execution, status = start_or_join("resume-workflow-stream", http_request, request.model_dump(), thread_id, events)
+    return stream_execution(execution, status, http_request)
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
 
 # To run this server:
 # Run in your terminal: uvicorn app:app --reload --host 0.0.0.0 --port 8050
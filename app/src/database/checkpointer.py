@@ -0,0 +1,444 @@
+import asyncio
+import random
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+)
+from sqlalchemy import and_, delete, select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+import database.models as models
+
+MESSAGES_CHANNEL = "messages"
+
+
+class _ThreadEntry:
+    """Hot state of one (thread_id, checkpoint_ns): the latest checkpoint and its messages."""
+    __slots__ = ("checkpoint", "metadata", "parent_checkpoint_id", "writes", "early_writes", "messages_version", "messages")
+
+    def __init__(self):
+        self.checkpoint: Optional[Checkpoint] = None
+        self.metadata: Optional[CheckpointMetadata] = None
+        self.parent_checkpoint_id: Optional[str] = None
+        self.writes: Dict[Tuple[str, int], Tuple[str, str, Any]] = {}
+        # writes of a newer checkpoint whose aput has not finished yet: langgraph runs them concurrently
+        self.early_writes: Dict[str, Dict[Tuple[str, int], Tuple[str, str, Any]]] = {}
+        self.messages_version: Optional[str] = None
+        self.messages: List = []
+
+
+def diff_messages(previous: Sequence, current: Sequence) -> Tuple[int, List]:
+    """Returns (keep, tail) so that current == previous[:keep] + tail."""
+    keep = 0
+    limit = min(len(previous), len(current))
+    while keep < limit and (previous[keep] is current[keep] or previous[keep] == current[keep]):
+        keep += 1
+    return keep, list(current[keep:])
+
+
+class DeltaPostgresSaver(BaseCheckpointSaver[str]):
+    """Postgres checkpointer on the app's async SQLAlchemy engine.
+
+    The `messages` channel is stored as a per-step delta against the previous
+    stored version instead of the full list, other channels are stored only when
+    they change. The latest checkpoint of the most recently used threads is kept in
+    a bounded LRU so resuming an active thread does not read from the database.
+    """
+
+    def __init__(self, engine: AsyncEngine, max_hot_threads: int = 256, serde=None) -> None:
+        super().__init__(serde=serde)
+        self.engine = engine
+        self.max_hot_threads = max_hot_threads
+        self._hot: "OrderedDict[Tuple[str, str], _ThreadEntry]" = OrderedDict()
+
+        self.stats = {"steps": 0, "checkpoint_bytes": 0, "blob_bytes": 0, "delta_bytes": 0,
+                      "cache_hits": 0, "cache_misses": 0}
+        # the loop the engine runs on, recorded by the async methods; the sync API runs them there
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ------------------------------------------------------------------ cache
+    def _entry(self, thread_id: str, checkpoint_ns: str, create: bool = False) -> Optional[_ThreadEntry]:
+        key = (thread_id, checkpoint_ns)
+        entry = self._hot.get(key)
+        if entry is not None:
+            self._hot.move_to_end(key)
+        elif create:
+            entry = self._hot[key] = _ThreadEntry()
+            while len(self._hot) > self.max_hot_threads:
+                self._hot.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _early_writes(entry: _ThreadEntry, checkpoint_id: str) -> Dict[Tuple[str, int], Tuple[str, str, Any]]:
+        """Writes that arrived before `checkpoint_id` became the hot checkpoint; older ones are dropped."""
+        writes = entry.early_writes.pop(checkpoint_id, {})
+        for early_id in [early_id for early_id in entry.early_writes if early_id < checkpoint_id]:
+            del entry.early_writes[early_id]
+        return writes
+
+    def evict(self, thread_id: str) -> None:
+        """Drop a thread from the hot cache. Its checkpoints stay in postgres."""
+        for key in [key for key in self._hot if key[0] == thread_id]:
+            del self._hot[key]
+
+    # ------------------------------------------------------------------ write path
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        self.loop = asyncio.get_running_loop()
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        parent_checkpoint_id = configurable.get("checkpoint_id")
+
+        entry = self._entry(thread_id, checkpoint_ns, create=True)
+        channel_values = checkpoint["channel_values"]
+
+        blob_rows = []
+        delta_row = None
+        for channel, version in new_versions.items():
+            if channel == MESSAGES_CHANNEL and channel in channel_values:
+                messages = channel_values[channel]
+                base_version, base = await self._base_messages(entry, thread_id, checkpoint_ns, parent_checkpoint_id)
+                keep, tail = diff_messages(base, messages)
+                tail_type, tail_blob = self.serde.dumps_typed(tail)
+                delta_row = {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "version": version,
+                             "base_version": base_version, "keep": keep,
+                             "tail_type": tail_type, "tail": tail_blob}
+                self.stats["delta_bytes"] += len(tail_blob)
+            elif channel in channel_values:
+                blob_type, blob = self.serde.dumps_typed(channel_values[channel])
+                blob_rows.append({"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "channel": channel,
+                                  "version": version, "blob_type": blob_type, "blob": blob})
+                self.stats["blob_bytes"] += len(blob)
+            else:
+                blob_rows.append({"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "channel": channel,
+                                  "version": version, "blob_type": "empty", "blob": None})
+
+        checkpoint_type, checkpoint_blob = self.serde.dumps_typed({**checkpoint, "channel_values": {}})
+        metadata_type, metadata_blob = self.serde.dumps_typed(metadata)
+        self.stats["checkpoint_bytes"] += len(checkpoint_blob) + len(metadata_blob)
+        self.stats["steps"] += 1
+
+        async with self.engine.begin() as conn:
+            if blob_rows:
+                await conn.execute(insert(models.CheckpointBlob).on_conflict_do_nothing(), blob_rows)
+            if delta_row is not None:
+                await conn.execute(insert(models.CheckpointMessageDelta).values(**delta_row).on_conflict_do_nothing())
+            stmt = insert(models.CheckpointRecord).values(
+                thread_id=thread_id, checkpoint_ns=checkpoint_ns, checkpoint_id=checkpoint["id"],
+                parent_checkpoint_id=parent_checkpoint_id, checkpoint_type=checkpoint_type,
+                checkpoint=checkpoint_blob, metadata_type=metadata_type, checkpoint_metadata=metadata_blob)
+            await conn.execute(stmt.on_conflict_do_update(
+                index_elements=["thread_id", "checkpoint_ns", "checkpoint_id"],
+                set_={"checkpoint_type": stmt.excluded.checkpoint_type,
+                      "checkpoint": stmt.excluded.checkpoint,
+                      "metadata_type": stmt.excluded.metadata_type,
+                      "checkpoint_metadata": stmt.excluded.checkpoint_metadata}))
+
+        # only advance the hot state once the step is durable
+        if delta_row is not None:
+            entry.messages_version = delta_row["version"]
+            entry.messages = list(channel_values[MESSAGES_CHANNEL])
+        entry.checkpoint = {**checkpoint, "channel_values": dict(channel_values)}
+        entry.metadata = metadata
+        entry.parent_checkpoint_id = parent_checkpoint_id
+        entry.writes = self._early_writes(entry, checkpoint["id"])
+
+        return {"configurable": {"thread_id": thread_id,
+                                 "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        self.loop = asyncio.get_running_loop()
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = configurable["checkpoint_id"]
+
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            blob_type, blob = self.serde.dumps_typed(value)
+            rows.append({"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint_id,
+                         "task_id": task_id, "idx": WRITES_IDX_MAP.get(channel, idx), "channel": channel,
+                         "blob_type": blob_type, "blob": blob, "task_path": task_path})
+        if not rows:
+            return
+
+        stmt = insert(models.CheckpointWrite)
+        if all(channel in WRITES_IDX_MAP for channel, _ in writes):
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["thread_id", "checkpoint_ns", "checkpoint_id", "task_id", "idx"],
+                set_={"channel": stmt.excluded.channel, "blob_type": stmt.excluded.blob_type,
+                      "blob": stmt.excluded.blob})
+        else:
+            stmt = stmt.on_conflict_do_nothing()
+        async with self.engine.begin() as conn:
+            await conn.execute(stmt, rows)
+
+        entry = self._entry(thread_id, checkpoint_ns, create=True)
+        if entry.checkpoint is not None and entry.checkpoint["id"] == checkpoint_id:
+            pending = entry.writes
+        elif entry.checkpoint is None or checkpoint_id > entry.checkpoint["id"]: # ids sort by time
+            pending = entry.early_writes.setdefault(checkpoint_id, {})
+        else:
+            return # an older checkpoint, only in postgres
+        for (channel, value), row in zip(writes, rows):
+            key = (task_id, row["idx"])
+            if key not in pending or channel in WRITES_IDX_MAP:
+                pending[key] = (task_id, channel, value)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.evict(thread_id)
+        async with self.engine.begin() as conn:
+            for model in (models.CheckpointRecord, models.CheckpointBlob,
+                          models.CheckpointMessageDelta, models.CheckpointWrite):
+                await conn.execute(delete(model).where(model.thread_id == thread_id))
+
+    # ------------------------------------------------------------------ read path
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        self.loop = asyncio.get_running_loop()
+        configurable = config["configurable"]
+        thread_id = configurable["thread_id"]
+        checkpoint_ns = configurable.get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+
+        entry = self._entry(thread_id, checkpoint_ns)
+        if entry is not None and entry.checkpoint is not None and checkpoint_id in (None, entry.checkpoint["id"]):
+            self.stats["cache_hits"] += 1
+            return self._entry_tuple(thread_id, checkpoint_ns, entry)
+
+        self.stats["cache_misses"] += 1
+        async with self.engine.connect() as conn:
+            query = select(models.CheckpointRecord).where(
+                models.CheckpointRecord.thread_id == thread_id,
+                models.CheckpointRecord.checkpoint_ns == checkpoint_ns)
+            if checkpoint_id:
+                query = query.where(models.CheckpointRecord.checkpoint_id == checkpoint_id)
+            else:
+                query = query.order_by(models.CheckpointRecord.checkpoint_id.desc()).limit(1)
+            row = (await conn.execute(query)).first()
+            if row is None:
+                return None
+            checkpoint_tuple, writes = await self._load_tuple(conn, row)
+
+        if checkpoint_id is None:
+            # latest checkpoint of a cold thread becomes hot
+            entry = self._entry(thread_id, checkpoint_ns, create=True)
+            entry.checkpoint = checkpoint_tuple.checkpoint
+            entry.metadata = checkpoint_tuple.metadata
+            entry.parent_checkpoint_id = row.parent_checkpoint_id
+            entry.writes = {**self._early_writes(entry, row.checkpoint_id), **writes}
+            messages_version = checkpoint_tuple.checkpoint["channel_versions"].get(MESSAGES_CHANNEL)
+            if MESSAGES_CHANNEL in checkpoint_tuple.checkpoint["channel_values"]:
+                entry.messages_version = messages_version
+                entry.messages = list(checkpoint_tuple.checkpoint["channel_values"][MESSAGES_CHANNEL])
+        return checkpoint_tuple
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        self.loop = asyncio.get_running_loop()
+        query = select(models.CheckpointRecord)
+        if config is not None:
+            configurable = config["configurable"]
+            query = query.where(models.CheckpointRecord.thread_id == configurable["thread_id"])
+            if "checkpoint_ns" in configurable:
+                query = query.where(models.CheckpointRecord.checkpoint_ns == configurable["checkpoint_ns"])
+            if checkpoint_id := get_checkpoint_id(config):
+                query = query.where(models.CheckpointRecord.checkpoint_id == checkpoint_id)
+        if before is not None and (before_id := get_checkpoint_id(before)):
+            query = query.where(models.CheckpointRecord.checkpoint_id < before_id)
+        query = query.order_by(models.CheckpointRecord.checkpoint_id.desc())
+
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(query)).all()
+            yielded = 0
+            for row in rows:
+                if limit is not None and yielded >= limit:
+                    break
+                metadata = self.serde.loads_typed((row.metadata_type, row.checkpoint_metadata))
+                if filter and not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+                checkpoint_tuple, _ = await self._load_tuple(conn, row, metadata=metadata)
+                yield checkpoint_tuple
+                yielded += 1
+
+    # ------------------------------------------------------------------ helpers
+    def _entry_tuple(self, thread_id: str, checkpoint_ns: str, entry: _ThreadEntry) -> CheckpointTuple:
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": entry.checkpoint["id"]}},
+            checkpoint={**entry.checkpoint, "channel_values": dict(entry.checkpoint["channel_values"])},
+            metadata=entry.metadata,
+            parent_config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                            "checkpoint_id": entry.parent_checkpoint_id}}
+            if entry.parent_checkpoint_id else None,
+            pending_writes=list(entry.writes.values()),
+        )
+
+    async def _load_tuple(self, conn, row, metadata: Optional[CheckpointMetadata] = None
+                          ) -> Tuple[CheckpointTuple, Dict[Tuple[str, int], Tuple[str, str, Any]]]:
+        """Reads one checkpoint with its channel values. Also returns the pending writes keyed by (task_id, idx)."""
+        thread_id, checkpoint_ns = row.thread_id, row.checkpoint_ns
+        checkpoint = self.serde.loads_typed((row.checkpoint_type, row.checkpoint))
+        if metadata is None:
+            metadata = self.serde.loads_typed((row.metadata_type, row.checkpoint_metadata))
+
+        channel_values = {}
+        versions = checkpoint["channel_versions"]
+        pairs = [(channel, version) for channel, version in versions.items() if channel != MESSAGES_CHANNEL]
+        if pairs:
+            blobs = await conn.execute(select(models.CheckpointBlob).where(
+                models.CheckpointBlob.thread_id == thread_id,
+                models.CheckpointBlob.checkpoint_ns == checkpoint_ns,
+                tuple_(models.CheckpointBlob.channel, models.CheckpointBlob.version).in_(pairs)))
+            for blob in blobs:
+                if blob.blob_type != "empty":
+                    channel_values[blob.channel] = self.serde.loads_typed((blob.blob_type, blob.blob))
+        if MESSAGES_CHANNEL in versions:
+            messages = await self._load_messages(conn, thread_id, checkpoint_ns, versions[MESSAGES_CHANNEL])
+            if messages is not None:
+                channel_values[MESSAGES_CHANNEL] = messages
+        checkpoint["channel_values"] = channel_values
+
+        writes = await conn.execute(select(models.CheckpointWrite).where(
+            models.CheckpointWrite.thread_id == thread_id,
+            models.CheckpointWrite.checkpoint_ns == checkpoint_ns,
+            models.CheckpointWrite.checkpoint_id == row.checkpoint_id,
+        ).order_by(models.CheckpointWrite.task_id, models.CheckpointWrite.idx))
+        pending_writes = {(write.task_id, write.idx): (write.task_id, write.channel,
+                                                       self.serde.loads_typed((write.blob_type, write.blob)))
+                          for write in writes}
+
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": row.checkpoint_id}},
+            checkpoint=checkpoint,
+            metadata=metadata,
+            parent_config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                            "checkpoint_id": row.parent_checkpoint_id}}
+            if row.parent_checkpoint_id else None,
+            pending_writes=list(pending_writes.values()),
+        ), pending_writes
+
+    async def _load_messages(self, conn, thread_id: str, checkpoint_ns: str, version: str) -> Optional[List]:
+        """Rebuilds the messages list at `version` by replaying its base_version chain, read in one query."""
+        deltas = models.CheckpointMessageDelta
+        chain = select(deltas).where(deltas.thread_id == thread_id, deltas.checkpoint_ns == checkpoint_ns,
+                                     deltas.version == version).cte("chain", recursive=True)
+        chain = chain.union(select(deltas).join(chain, and_(deltas.thread_id == chain.c.thread_id,
+                                                            deltas.checkpoint_ns == chain.c.checkpoint_ns,
+                                                            deltas.version == chain.c.base_version)))
+        by_version = {delta.version: delta for delta in await conn.execute(select(chain))}
+        if version not in by_version:
+            return None
+
+        replay = []
+        current = version
+        while current is not None:
+            delta = by_version.get(current)
+            if delta is None or len(replay) >= len(by_version):
+                raise RuntimeError(f"cannot rebuild messages {version} of thread {thread_id}: "
+                                   f"delta {current} is missing or its base chain loops")
+            replay.append(delta)
+            current = delta.base_version
+
+        messages: List = []
+        for delta in reversed(replay):
+            messages = messages[:delta.keep] + self.serde.loads_typed((delta.tail_type, delta.tail))
+        return messages
+
+    async def _base_messages(self, entry: _ThreadEntry, thread_id: str, checkpoint_ns: str,
+                             parent_checkpoint_id: Optional[str]) -> Tuple[Optional[str], List]:
+        """(version, messages) of the parent checkpoint's messages channel, the base of the next delta.
+
+        From the hot entry when the parent is the hot checkpoint; from postgres for a cold thread
+        or a fork / update_state from an older checkpoint.
+        """
+        if parent_checkpoint_id is None:
+            return None, []
+        hot_parent = entry.checkpoint is not None and entry.checkpoint["id"] == parent_checkpoint_id
+        if hot_parent:
+            version = entry.checkpoint["channel_versions"].get(MESSAGES_CHANNEL)
+            if version is None:
+                return None, []
+            if version == entry.messages_version:
+                return version, entry.messages
+        async with self.engine.connect() as conn:
+            if not hot_parent:
+                row = (await conn.execute(select(models.CheckpointRecord.checkpoint_type, models.CheckpointRecord.checkpoint)
+                                          .where(models.CheckpointRecord.thread_id == thread_id,
+                                                 models.CheckpointRecord.checkpoint_ns == checkpoint_ns,
+                                                 models.CheckpointRecord.checkpoint_id == parent_checkpoint_id))).first()
+                if row is None:
+                    return None, []
+                version = self.serde.loads_typed((row.checkpoint_type, row.checkpoint))["channel_versions"].get(MESSAGES_CHANNEL)
+                if version is None:
+                    return None, []
+            messages = await self._load_messages(conn, thread_id, checkpoint_ns, version)
+        return (version, messages) if messages is not None else (None, [])
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
+
+    # ------------------------------------------------------------------ sync API
+    # Like langgraph's AsyncPostgresSaver: the async methods run on the engine's loop and the
+    # caller's thread waits for the result. Calling these from that loop would deadlock it.
+    def _run_sync(self, coro):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self.loop is None or self.loop.is_closed() or running is self.loop:
+            coro.close()
+            raise asyncio.InvalidStateError("DeltaPostgresSaver's sync API must be called from another thread "
+                                            "while the app's event loop is running, use the async API on the loop")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self._run_sync(self.aget_tuple(config))
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        checkpoints = self.alist(config, filter=filter, before=before, limit=limit)
+        try:
+            while True:
+                try:
+                    yield self._run_sync(anext(checkpoints))
+                except StopAsyncIteration:
+                    break
+        finally:
+            try:
+                self._run_sync(checkpoints.aclose())
+            except asyncio.InvalidStateError:
+                pass
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        return self._run_sync(self.aput(config, checkpoint, metadata, new_versions))
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        return self._run_sync(self.aput_writes(config, writes, task_id, task_path))
+
+    def delete_thread(self, thread_id: str) -> None:
+        return self._run_sync(self.adelete_thread(thread_id))
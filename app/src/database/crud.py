@@ -1,19 +1,173 @@
 import database.models as models
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import insert, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
 from sqlalchemy.exc import SQLAlchemyError
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime
+import base64
+import json
+import uuid
+from metrics import DB_WRITE_DURATION, DB_ROWS_WRITTEN
+import logging
+
+logger = logging.getLogger(__name__)
 
 async def async_db_save(db:AsyncSession,prompt, response,message_type,thread_id):
     try:
 
-        print("Saving\n")
         agent_history = models.AgentHistory(prompt=prompt,response=response,message_type=message_type,thread_id=thread_id)
         db.add(agent_history)
-        await db.commit()
+        with DB_WRITE_DURATION.labels("save").time():
+            await db.commit()
+        DB_ROWS_WRITTEN.inc()
         await db.refresh(agent_history)
-        print("save successful\n")
+        logger.debug(f"Saved agent_history row {agent_history.id}")
 
 
         return agent_history
     
     except SQLAlchemyError as e:
-        raise RuntimeError(f"Database Savings failed: {str(e)}")
\ No newline at end of file
+        raise RuntimeError(f"Database Savings failed: {str(e)}")
+
+
+async def async_db_save_many(db:AsyncSession, rows:List[Dict]):
+    """Bulk insert of agent_history rows in a single multi-row INSERT and one commit."""
+    try:
+        if rows:
+            with DB_WRITE_DURATION.labels("save_many").time():
+                await db.execute(insert(models.AgentHistory), rows)
+                await db.commit()
+            DB_ROWS_WRITTEN.inc(len(rows))
+        return len(rows)
+
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise RuntimeError(f"Database Savings failed: {str(e)}")
+
+
+
+# ------------------------------- history reads -------------------------------
+
+async def ensure_history_indexes(engine:AsyncEngine):
+    """create_all skips indexes of tables that already exist, so build missing ones without locking writes."""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT") # CONCURRENTLY cannot run in a transaction
+        relkind = (await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'agent_history'"))).scalar()
+        # a partitioned parent cannot be indexed concurrently; create_all already indexed it and partitions inherit
+        concurrently = "" if relkind == "p" else "CONCURRENTLY "
+        for index in models.AgentHistory.__table__.indexes:
+            columns = ", ".join(column.name for column in index.columns)
+            await conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS {index.name} ON {index.table.name} ({columns})"))
+
+
+def encode_cursor(*values) -> str:
+    """Opaque pagination cursor, the last row's sort key as a JSON list (thread ids may contain any character)."""
+    return base64.urlsafe_b64encode(json.dumps([str(value) for value in values]).encode()).decode()
+
+
+def decode_cursor(cursor:str, size:int) -> List[str]:
+    """The `size` values of a cursor made by encode_cursor. ValueError for anything else."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(value, str) for value in values):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+# loose index scan: one index probe per distinct thread_id instead of a GROUP BY over the whole table
+LIST_THREADS_SQL = text("""
+WITH RECURSIVE threads AS (
+    (SELECT thread_id FROM agent_history WHERE thread_id > :after ORDER BY thread_id LIMIT 1)
+    UNION ALL
+    SELECT (SELECT h.thread_id FROM agent_history h WHERE h.thread_id > threads.thread_id ORDER BY h.thread_id LIMIT 1)
+    FROM threads WHERE threads.thread_id IS NOT NULL
+)
+SELECT threads.thread_id,
+       (SELECT min(created_at) FROM agent_history h WHERE h.thread_id = threads.thread_id) AS first_at,
+       (SELECT max(created_at) FROM agent_history h WHERE h.thread_id = threads.thread_id) AS last_at
+FROM threads WHERE threads.thread_id IS NOT NULL
+LIMIT :limit
+""")
+
+
+async def async_db_list_threads(db:AsyncSession, cursor:Optional[str]=None, limit:int=50) -> Tuple[List[Dict], Optional[str]]:
+    """Threads ordered by thread_id. Returns (page, next_cursor)."""
+    after = decode_cursor(cursor, 1)[0] if cursor else ""
+    rows = (await db.execute(LIST_THREADS_SQL, {"after": after, "limit": limit})).all()
+    threads = [{"thread_id": row.thread_id, "first_at": row.first_at, "last_at": row.last_at} for row in rows]
+    next_cursor = encode_cursor(rows[-1].thread_id) if len(rows) == limit else None
+    return threads, next_cursor
+
+
+async def async_db_thread_messages(db:AsyncSession, thread_id:str, cursor:Optional[str]=None, limit:int=100) -> Tuple[List[Dict], Optional[str]]:
+    """One page of a thread's messages in (created_at, id) order. Returns (page, next_cursor)."""
+    history = models.AgentHistory
+    query = select(history.id, history.prompt, history.response, history.message_type, history.created_at)\
+        .where(history.thread_id == thread_id)
+    if cursor:
+        created_at, row_id = decode_cursor(cursor, 2)
+        query = query.where(tuple_(history.created_at, history.id) > (datetime.fromisoformat(created_at), uuid.UUID(row_id)))
+    query = query.order_by(history.created_at, history.id).limit(limit)
+
+    rows = (await db.execute(query)).all()
+    messages = [{"id": str(row.id), "prompt": row.prompt, "response": row.response,
+                 "message_type": row.message_type, "created_at": row.created_at.isoformat()} for row in rows]
+    next_cursor = encode_cursor(rows[-1].created_at.isoformat(), rows[-1].id) if len(rows) == limit else None
+    return messages, next_cursor
+
+
+async def async_db_recent_transcript(db:AsyncSession, thread_id:str, limit:int=50) -> List[Dict]:
+    """The last `limit` user/assistant turns of a thread, oldest first, as chat messages."""
+    history = models.AgentHistory
+    query = select(history.response, history.message_type)\
+        .where(history.thread_id == thread_id, history.message_type.in_(("user", "assistant")), history.response != "")\
+        .order_by(history.created_at.desc(), history.id.desc()).limit(limit)
+    rows = (await db.execute(query)).all()
+    return [{"role": row.message_type, "content": row.response} for row in reversed(rows)]
+
+
+async def ensure_history_fts_index(engine:AsyncEngine):
+    """GIN full-text index on agent_history.response, for the recall_memory fallback (MEMORY_PG_FTS)."""
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        relkind = (await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = 'agent_history'"))).scalar()
+        concurrently = "" if relkind == "p" else "CONCURRENTLY "
+        await conn.execute(text(f"CREATE INDEX {concurrently}IF NOT EXISTS ix_agent_history_response_fts "
+                                f"ON agent_history USING gin (to_tsvector('simple', response))"))
+
+
+SEARCH_HISTORY_SQL = text("""
+SELECT thread_id, message_type, response, created_at, ts_rank(to_tsvector('simple', response), query) AS score
+FROM agent_history, to_tsquery('simple', :query) AS query
+WHERE to_tsvector('simple', response) @@ query
+  AND thread_id = ANY(:thread_ids) AND message_type = ANY(:message_types) AND created_at > :after
+ORDER BY score DESC
+LIMIT :limit
+""")
+
+
+async def async_db_search_history(db:AsyncSession, terms:List[str], thread_ids:List[str], message_types:List[str],
+                                  after:datetime, limit:int=5) -> List[Dict]:
+    """Full-text search of agent_history rows matching any of `terms` (plain words) in the given threads."""
+    if not terms or not thread_ids:
+        return []
+    params = {"query": " | ".join(terms), "thread_ids": thread_ids, "message_types": message_types, "after": after, "limit": limit}
+    rows = (await db.execute(SEARCH_HISTORY_SQL, params)).all()
+    return [{"thread_id": row.thread_id, "message_type": row.message_type, "response": row.response,
+             "created_at": row.created_at, "score": float(row.score)} for row in rows]
+
+
+async def async_db_history_since(db:AsyncSession, after:Tuple[datetime, Optional[uuid.UUID]], until:datetime,
+                                 message_types:List[str], limit:int=5000) -> List[Dict]:
+    """Rows created in (after, until], in (created_at, id) order: one keyset page of a catch-up scan."""
+    history = models.AgentHistory
+    created_at, row_id = after
+    position = tuple_(history.created_at, history.id) > (created_at, row_id) if row_id is not None else history.created_at > created_at
+    query = select(history.id, history.response, history.message_type, history.thread_id, history.created_at)\
+        .where(position, history.created_at <= until, history.message_type.in_(message_types))\
+        .order_by(history.created_at, history.id).limit(limit)
+    rows = (await db.execute(query)).all()
+    return [{"id": row.id, "response": row.response, "message_type": row.message_type,
+             "thread_id": row.thread_id, "created_at": row.created_at} for row in rows]
@@ -1,5 +1,5 @@
 from database.db import Base
-from sqlalchemy import Column, String, Boolean, Integer,TIMESTAMP,UUID
+from sqlalchemy import Column, String, Boolean, Integer,TIMESTAMP,UUID,LargeBinary,Index
 from datetime import datetime, timezone
 import uuid
 from sqlalchemy.sql import func
@@ -11,7 +11,82 @@ class AgentHistory(Base):
     response = Column(String)
     message_type = Column(String)
     thread_id = Column(String)
+    # part of the key because the table is range partitioned on it (see database/partitions.py)
+    created_at = Column(TIMESTAMP(timezone=True),primary_key=True,nullable=False, default=lambda:datetime.now(timezone.utc),server_default=func.now())
+
+    __table_args__ = (
+        # keyset pagination of a thread's messages, and the skip scan that lists threads
+        Index("ix_agent_history_thread_created_id", "thread_id", "created_at", "id"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+
+
+
+
+class CheckpointRecord(Base):
+    """One LangGraph checkpoint. channel_values are not stored here, see CheckpointBlob/CheckpointMessageDelta."""
+    __tablename__ = "graph_checkpoints"
+    thread_id = Column(String, primary_key=True)
+    checkpoint_ns = Column(String, primary_key=True, default="")
+    checkpoint_id = Column(String, primary_key=True)
+    parent_checkpoint_id = Column(String)
+    checkpoint_type = Column(String)
+    checkpoint = Column(LargeBinary)
+    metadata_type = Column(String)
+    checkpoint_metadata = Column(LargeBinary)
     created_at = Column(TIMESTAMP(timezone=True),nullable=False, default=lambda:datetime.now(timezone.utc),server_default=func.now())
 
 
+class CheckpointBlob(Base):
+    """Channel value, written only for the channels that changed in a step."""
+    __tablename__ = "graph_checkpoint_blobs"
+    thread_id = Column(String, primary_key=True)
+    checkpoint_ns = Column(String, primary_key=True, default="")
+    channel = Column(String, primary_key=True)
+    version = Column(String, primary_key=True)
+    blob_type = Column(String)
+    blob = Column(LargeBinary)
+
+
+class CheckpointMessageDelta(Base):
+    """messages channel stored as a delta: keep the first `keep` messages of base_version and append `tail`."""
+    __tablename__ = "graph_checkpoint_message_deltas"
+    thread_id = Column(String, primary_key=True)
+    checkpoint_ns = Column(String, primary_key=True, default="")
+    version = Column(String, primary_key=True)
+    base_version = Column(String)
+    keep = Column(Integer, nullable=False, default=0)
+    tail_type = Column(String)
+    tail = Column(LargeBinary)
 
+
+class CheckpointWrite(Base):
+    """Pending writes of a task (tool results, interrupts, resume values)."""
+    __tablename__ = "graph_checkpoint_writes"
+    thread_id = Column(String, primary_key=True)
+    checkpoint_ns = Column(String, primary_key=True, default="")
+    checkpoint_id = Column(String, primary_key=True)
+    task_id = Column(String, primary_key=True)
+    idx = Column(Integer, primary_key=True)
+    channel = Column(String)
+    blob_type = Column(String)
+    blob = Column(LargeBinary)
+    task_path = Column(String, default="")
+
+
+class ToolCacheEntry(Base):
+    """Shared tool result cache (see tool/cache.py), keyed on tool name + normalized args."""
+    __tablename__ = "tool_cache"
+    key = Column(String, primary_key=True)
+    value = Column(String)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+
+
+class ResponseCacheEntry(Base):
+    """Shared exact-match /generate-text cache (see llm/response_cache.py)."""
+    __tablename__ = "response_cache"
+    key = Column(String, primary_key=True)
+    model = Column(String)
+    response = Column(String)
+    created_at = Column(TIMESTAMP(timezone=True),nullable=False, default=lambda:datetime.now(timezone.utc),server_default=func.now())
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
@@ -0,0 +1,318 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+TABLE = "agent_history"
+DEFAULT_PARTITION = f"{TABLE}_default"
+ARCHIVE_COLUMNS = ("id", "thread_id", "message_type", "prompt", "response", "created_at")
+_BOUND = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def _parse_bound(value: str) -> Optional[datetime]:
+    """pg_get_expr bound literal: 'YYYY-MM-DD HH:MM:SS+00' or MINVALUE/MAXVALUE (None)."""
+    value = value.strip("'")
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.fromisoformat(value).astimezone(timezone.utc)
+
+
+class HistoryPartitionManager:
+    """Keeps agent_history as daily range partitions on created_at.
+
+    A background task creates partitions `premake_days` ahead, and a DEFAULT
+    partition catches anything outside them so inserts never fail; rows it caught
+    for a day are moved into that day's partition when it is created. Partitions
+    that ended more than `retention_days` ago are exported to
+    `<archive_dir>/<partition>.jsonl.gz` while still attached, then detached and
+    dropped in one transaction, so a failed export leaves them in place for the next
+    round. Expired rows of the DEFAULT partition are exported and deleted the same
+    way. Archives are read back on demand with `query_archive`. File I/O runs in
+    worker threads.
+    """
+
+    def __init__(self, engine: AsyncEngine, archive_dir: str, retention_days: int = 30, premake_days: int = 3,
+                 interval: float = 3600.0, batch_size: int = 5000, migrate_legacy: bool = False) -> None:
+        self.engine = engine
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.premake_days = premake_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.migrate_legacy = migrate_legacy
+        self.partitioned = False
+        self._task: Optional[asyncio.Task] = None
+
+        self.partitions_created = 0
+        self.partitions_archived = 0
+        self.rows_archived = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    @staticmethod
+    def partition_name(day: datetime) -> str:
+        return f"{TABLE}_p{day:%Y%m%d}"
+
+    async def _relkind(self, conn, name: str) -> Optional[str]:
+        return (await conn.execute(text("SELECT relkind FROM pg_class WHERE relname = :name AND relkind IN ('r', 'p')"),
+                                   {"name": name})).scalar()
+
+    async def partitions(self) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+        """(name, lower, upper) of every attached range partition; None stands for MINVALUE/MAXVALUE."""
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(text(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:table AS regclass)"),
+                {"table": TABLE})).all()
+        result = []
+        for name, bound in rows:
+            if match := _BOUND.search(bound or ""):
+                result.append((name, _parse_bound(match.group(1)), _parse_bound(match.group(2))))
+        return sorted(result, key=lambda partition: partition[2] or datetime.max.replace(tzinfo=timezone.utc))
+
+    async def bootstrap(self) -> None:
+        """Run after create_all_tables: convert a legacy plain table if asked to, create default and upcoming partitions."""
+        async with self.engine.begin() as conn:
+            kind = await self._relkind(conn, TABLE)
+        if kind == "r":
+            if not self.migrate_legacy:
+                logger.warning(f"{TABLE} is a plain table, partition management is off. "
+                               "Set HISTORY_MIGRATE_LEGACY=true to attach it as the first partition.")
+                return
+            await self._migrate_legacy()
+
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+        self.partitioned = True
+        await self.ensure_partitions()
+
+    async def _migrate_legacy(self) -> None:
+        """Rename the plain table and attach it below the first daily partition."""
+        from database.db import Base
+        import database.models as models
+
+        legacy = f"{TABLE}_legacy"
+        boundary = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        async with self.engine.begin() as conn:
+            await conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {legacy}"))
+            for index in (await conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = :table"),
+                                             {"table": legacy})).scalars():
+                await conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{legacy}_{index.removeprefix(TABLE + "_")}"'))
+            await conn.run_sync(Base.metadata.create_all, tables=[models.AgentHistory.__table__])
+            await conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {legacy} "
+                                    f"FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"))
+        logger.info(f"Attached legacy {TABLE} rows as partition {legacy} (< {boundary:%Y-%m-%d})")
+
+    async def ensure_partitions(self) -> None:
+        existing = await self.partitions()
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in range(self.premake_days + 1):
+            start, end = today + timedelta(days=offset), today + timedelta(days=offset + 1)
+            overlaps = any((lower is None or lower < end) and (upper is None or upper > start) for _, lower, upper in existing)
+            if overlaps:
+                continue
+            name = self.partition_name(start)
+            bounds = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            async with self.engine.begin() as conn:
+                await conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+                # creating the partition locks the default one anyway; holding it from here keeps rows out meanwhile
+                await conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE"))
+                moved = 0
+                if (await conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+                                            "WHERE created_at >= :start AND created_at < :end)"),
+                                       {"start": start, "end": end})).scalar():
+                    # maintenance fell behind: postgres refuses a partition whose range has rows in the
+                    # default one, so build it as a table, move those rows over and attach it
+                    await conn.execute(text(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+                    moved = (await conn.execute(text(
+                        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= :start AND created_at < :end "
+                        f"RETURNING *) INSERT INTO {name} SELECT * FROM moved"), {"start": start, "end": end})).rowcount
+                    await conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} {bounds}"))
+                else:
+                    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} {bounds}"))
+            self.partitions_created += 1
+            logger.info(f"Created partition {name}" + (f", moved {moved} rows from {DEFAULT_PARTITION}" if moved else ""))
+
+    async def _detached(self) -> List[str]:
+        """Partitions left detached by an export that did not finish (retention used to detach first)."""
+        async with self.engine.connect() as conn:
+            return list((await conn.execute(text(
+                "SELECT relname FROM pg_class c WHERE relkind = 'r' "
+                "AND (relname LIKE :daily OR relname = :legacy) "
+                "AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)"),
+                {"daily": f"{TABLE}\\_p%", "legacy": f"{TABLE}_legacy"})).scalars())
+
+    async def run_retention(self) -> None:
+        for name in await self._detached():
+            await self._reattach(name)
+
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        expired = [name for name, _, upper in await self.partitions() if upper is not None and upper <= cutoff]
+        for name in expired:
+            async with self.engine.connect() as conn:
+                rows = await self._export(conn, name, name) # still attached: a failure here leaves its rows queryable
+            async with self.engine.begin() as conn:
+                # brief lock on the parent; give up and retry next round instead of queueing writers behind it
+                await conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+                await conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+                await conn.execute(text(f"DROP TABLE {name}"))
+            self.partitions_archived += 1
+            self.rows_archived += rows
+            logger.info(f"Archived partition {name}: {rows} rows")
+        await self._archive_default(cutoff.replace(hour=0, minute=0, second=0, microsecond=0))
+
+    async def _archive_default(self, cutoff: datetime) -> None:
+        """Export and delete the DEFAULT partition's rows older than `cutoff` in one transaction."""
+        async with self.engine.begin() as conn:
+            await conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+            # rows routed to the default partition wait until the export is done, the daily ones do not
+            await conn.execute(text(f"LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE"))
+            if not (await conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff)"),
+                                       {"cutoff": cutoff})).scalar():
+                return
+            # one file per round, the default partition spans many days
+            archive_name = f"{DEFAULT_PARTITION}_{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}"
+            rows = await self._export(conn, DEFAULT_PARTITION, archive_name, "created_at < :cutoff", {"cutoff": cutoff})
+            await conn.execute(text(f"DELETE FROM {DEFAULT_PARTITION} WHERE created_at < :cutoff"), {"cutoff": cutoff})
+        self.rows_archived += rows
+        logger.info(f"Archived {rows} rows of {DEFAULT_PARTITION} older than {cutoff:%Y-%m-%d} to {archive_name}")
+
+    async def _reattach(self, name: str) -> None:
+        """Put a detached partition back under agent_history; it is archived like any expired partition."""
+        async with self.engine.begin() as conn:
+            if match := re.fullmatch(rf"{TABLE}_p(\d{{8}})", name):
+                start = datetime.strptime(match.group(1), "%Y%m%d").replace(tzinfo=timezone.utc)
+                lower, upper = f"'{start.isoformat()}'", f"'{(start + timedelta(days=1)).isoformat()}'"
+            else: # the legacy partition: everything below its newest row
+                newest = (await conn.execute(text(f"SELECT max(created_at) FROM {name}"))).scalar()
+                if newest is None:
+                    await conn.execute(text(f"DROP TABLE {name}"))
+                    return
+                lower, upper = "MINVALUE", f"'{(newest + timedelta(microseconds=1)).isoformat()}'"
+            await conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+            await conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ({lower}) TO ({upper})"))
+        logger.info(f"Re-attached detached partition {name}")
+
+    async def _export(self, conn, name: str, archive_name: str, where: str = "TRUE", params: Optional[Dict] = None) -> int:
+        """Stream a partition's rows (still attached) into gzip JSONL, written to a temp file and renamed when complete."""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{archive_name}.jsonl.gz")
+        tmp_path = path + ".tmp"
+        archive = await asyncio.to_thread(gzip.open, tmp_path, "wt", encoding="utf-8")
+        rows = 0
+        try:
+            try:
+                result = await conn.stream(text(f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {name} WHERE {where} "
+                                                "ORDER BY created_at, id"), params or {})
+                async for batch in result.partitions(self.batch_size):
+                    lines = "".join(json.dumps(dict(zip(ARCHIVE_COLUMNS, row)), default=str) + "\n" for row in batch)
+                    await asyncio.to_thread(archive.write, lines)
+                    rows += len(batch)
+            finally:
+                await asyncio.to_thread(archive.close)
+            await asyncio.to_thread(os.replace, tmp_path, path)
+        except BaseException:
+            await asyncio.to_thread(lambda: os.path.exists(tmp_path) and os.remove(tmp_path))
+            raise
+        return rows
+
+    def archives(self) -> List[Dict]:
+        """Archive files, oldest first. `day` is None for the legacy and default partitions, which span many days."""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        result = []
+        for filename in sorted(os.listdir(self.archive_dir)):
+            if not (filename.startswith(f"{TABLE}_") and filename.endswith(".jsonl.gz")):
+                continue
+            match = re.fullmatch(rf"{TABLE}_p(\d{{8}})\.jsonl\.gz", filename)
+            result.append({"partition": filename.removesuffix(".jsonl.gz"),
+                           "day": datetime.strptime(match.group(1), "%Y%m%d").date().isoformat() if match else None,
+                           "bytes": os.path.getsize(os.path.join(self.archive_dir, filename))})
+        return result
+
+    def _scan(self, filename: str, thread_id: Optional[str], limit: int) -> List[Dict]:
+        rows = []
+        with gzip.open(os.path.join(self.archive_dir, filename), "rt", encoding="utf-8") as archive:
+            for line in archive:
+                row = json.loads(line)
+                if thread_id is None or row["thread_id"] == thread_id:
+                    rows.append(row)
+                    if len(rows) >= limit:
+                        break
+        return rows
+
+    async def query_archive(self, thread_id: Optional[str] = None, start: Optional[str] = None, end: Optional[str] = None,
+                            limit: int = 1000):
+        """Yield archived rows of the days in [start, end] (YYYY-MM-DD), optionally of one thread."""
+        for archive in self.archives():
+            if archive["day"] and ((start and archive["day"] < start) or (end and archive["day"] > end)):
+                continue
+            for row in await asyncio.to_thread(self._scan, archive["partition"] + ".jsonl.gz", thread_id, limit):
+                yield row
+                limit -= 1
+            if limit <= 0:
+                return
+
+    async def maintain(self) -> None:
+        """One maintenance round, skipped when another app worker holds the advisory lock."""
+        async with self.engine.connect() as lock_conn:
+            if not (await lock_conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), {"key": TABLE})).scalar():
+                return
+            try:
+                try:
+                    await self.ensure_partitions()
+                except Exception as e: # a day that cannot be created must not stop archival
+                    self.failures += 1
+                    self.last_error = repr(e)
+                    logger.error(f"Creating history partitions failed: {e!r}")
+                await self.run_retention()
+            finally:
+                await lock_conn.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {"key": TABLE})
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.maintain()
+            except Exception as e:
+                self.failures += 1
+                self.last_error = repr(e)
+                logger.error(f"History partition maintenance failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        await self.bootstrap()
+        if self.partitioned:
+            self._task = asyncio.create_task(self._run(), name="history-partitions")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict:
+        return {"partitioned": self.partitioned, "created": self.partitions_created,
+                "archived": self.partitions_archived, "rows_archived": self.rows_archived,
+                "failures": self.failures, "last_error": self.last_error}
+
+
+def build_partition_manager(engine: AsyncEngine) -> HistoryPartitionManager:
+    """HISTORY_ARCHIVE_DIR, HISTORY_RETENTION_DAYS, HISTORY_PREMAKE_DAYS, HISTORY_MAINTENANCE_INTERVAL, HISTORY_MIGRATE_LEGACY."""
+    return HistoryPartitionManager(engine,
+                                   archive_dir=os.getenv("HISTORY_ARCHIVE_DIR", "./history_archive"),
+                                   retention_days=int(os.getenv("HISTORY_RETENTION_DAYS", 30)),
+                                   premake_days=int(os.getenv("HISTORY_PREMAKE_DAYS", 3)),
+                                   interval=float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", 3600)),
+                                   migrate_legacy=os.getenv("HISTORY_MIGRATE_LEGACY", "false").lower() == "true")
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from database.crud import async_db_save_many
+from database.db import AsyncSessionLocal
+from metrics import DB_ROWS_REJECTED
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """Write-behind buffer for agent_history rows.
+
+    Rows are queued in memory and flushed in bulk (one multi-row INSERT per flush)
+    once `batch_size` rows are pending or `flush_interval` seconds have elapsed,
+    whichever comes first. `stop()` drains the buffer so nothing is lost on shutdown.
+
+    A batch that fails `max_attempts` times in a row is written row by row. While the
+    database answers, rows that still fail (e.g. a text postgres rejects) are dropped
+    and logged, so one bad row does not hold back every row queued after it.
+    """
+
+    def __init__(self, session_factory, batch_size: int = 200, flush_interval: float = 0.5,
+                 max_buffer: int = 50_000, max_attempts: int = 3) -> None:
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer # rows kept when postgres is unreachable, oldest dropped first
+        self.max_attempts = max_attempts
+        self._failures = 0 # consecutive failed flushes of the batch at the head of the buffer
+
+        self._buffer: List[Dict] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._listeners: List[Callable[[List[Dict]], None]] = []
+
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.rows_rejected = 0
+        self.flush_count = 0
+
+    def add(self, prompt, response, message_type, thread_id) -> None:
+        """Queue a single row. Never blocks the caller."""
+        self.add_many([{"prompt": prompt, "response": response,
+                        "message_type": message_type, "thread_id": thread_id}])
+
+    def add_listener(self, listener: Callable[[List[Dict]], None]) -> None:
+        """Called with every batch of rows as it is queued, e.g. to index them (see tool/memory.py)."""
+        self._listeners.append(listener)
+
+    def add_many(self, rows: List[Dict]) -> None:
+        """Queue all rows of a turn at once."""
+        if not rows:
+            return
+        for row in rows:
+            if "created_at" not in row:
+                row["created_at"] = datetime.now(timezone.utc) # stamp at enqueue time, not at flush time
+            for column in ("prompt", "response"): # postgres text cannot hold NUL, e.g. in a scraped search result
+                if isinstance(row.get(column), str) and "\x00" in row[column]:
+                    row[column] = row[column].replace("\x00", "")
+        for listener in self._listeners:
+            try:
+                listener(rows)
+            except Exception as e:
+                logger.warning("History listener %r failed: %r", listener, e)
+        self._buffer.extend(rows)
+        self._trim()
+        if len(self._buffer) >= self.batch_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    async def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._closing = False
+        self._task = asyncio.create_task(self._run(), name="history-writer")
+
+    async def stop(self) -> None:
+        """Stop the background task and flush everything still buffered."""
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    async def flush(self) -> int:
+        """Write all buffered rows. Returns the number of rows written."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            written = 0
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                del self._buffer[:self.batch_size]
+                try:
+                    if self._failures >= self.max_attempts:
+                        batch_written = await self._write_isolated(batch)
+                    else:
+                        async with self.session_factory() as db:
+                            await async_db_save_many(db, batch)
+                        batch_written = len(batch)
+                except Exception as db_error:
+                    self._failures += 1
+                    logger.error("History flush failed (attempt %d), %d rows re-queued: %s", self._failures, len(batch), db_error)
+                    self._buffer[:0] = batch # keep ordering for the retry
+                    self._trim()
+                    break
+                self._failures = 0
+                written += batch_written
+                self.flush_count += 1
+
+            self.rows_written += written
+            return written
+
+    async def _write_isolated(self, batch: List[Dict]) -> int:
+        """Write a batch that keeps failing row by row and drop the rows postgres rejects.
+        Raises when the database itself is unreachable, the batch is then retried as a whole."""
+        failed = []
+        for row in batch:
+            try:
+                async with self.session_factory() as db:
+                    await async_db_save_many(db, [row])
+            except Exception as row_error:
+                failed.append((row, row_error))
+        if len(failed) == len(batch):
+            async with self.session_factory() as db: # nothing went through: an outage, or only bad rows?
+                await db.execute(text("SELECT 1"))
+        for row, row_error in failed:
+            logger.error("History row of thread %s rejected, dropped: %s", row.get("thread_id"), row_error)
+        self.rows_rejected += len(failed)
+        DB_ROWS_REJECTED.inc(len(failed))
+        return len(batch) - len(failed)
+
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._buffer:
+                await self.flush()
+
+    def _trim(self) -> None:
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.rows_dropped += overflow
+            logger.warning("History buffer full, dropped %d oldest rows", overflow)
+
+    def stats(self) -> Dict:
+        return {"pending": self.pending,
+                "rows_written": self.rows_written,
+                "rows_dropped": self.rows_dropped,
+                "rows_rejected": self.rows_rejected,
+                "flush_count": self.flush_count,
+                "timestamp": time.time()}
+
+
+history_writer = HistoryWriter(AsyncSessionLocal)
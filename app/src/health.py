@@ -0,0 +1,203 @@
+import asyncio
+import bisect
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from sqlalchemy import text
+
+from database.db import engine
+from llm.llm_services import get_llm_router
+from metrics import vllm_queue_scrape
+from profiler import LoopStallMonitor
+from sessions import sessions
+
+logger = logging.getLogger(__name__)
+
+TAVILY_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com")
+
+
+class LatencyHistogram:
+    """Cumulative latency histogram (ms buckets) plus a short window of recent samples."""
+
+    BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+    def __init__(self, window: int = 20) -> None:
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1) # last bucket is +Inf
+        self.total = 0
+        self.sum_ms = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, latency_ms: float) -> None:
+        self.counts[bisect.bisect_left(self.BUCKETS_MS, latency_ms)] += 1
+        self.total += 1
+        self.sum_ms += latency_ms
+        self.recent.append(latency_ms)
+
+    def recent_percentile(self, q: float) -> Optional[float]:
+        if not self.recent:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+    def snapshot(self) -> Dict:
+        buckets = {f"le_{bound}": count for bound, count in zip(self.BUCKETS_MS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {"count": self.total, "sum_ms": round(self.sum_ms, 3), "buckets": buckets,
+                "recent_p50_ms": self.recent_percentile(50), "recent_p95_ms": self.recent_percentile(95)}
+
+
+class DependencyStatus:
+    """"slow" only after `slow_after` probes in a row took longer than `slow_ms`; one slow probe is noise."""
+
+    def __init__(self, name: str, probe: Callable[[], Awaitable[None]], critical: bool, slow_ms: float,
+                 slow_after: int = 3) -> None:
+        self.name = name
+        self.probe = probe
+        self.critical = critical
+        self.slow_ms = slow_ms
+        self.slow_after = slow_after
+        self.histogram = LatencyHistogram()
+        self.up = False
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+        self.slow_streak = 0
+
+    def observe(self, latency_ms: float) -> None:
+        self.histogram.observe(latency_ms)
+        self.slow_streak = self.slow_streak + 1 if latency_ms > self.slow_ms else 0
+        self.checked_at = time.time()
+
+    @property
+    def state(self) -> str:
+        if self.checked_at is None or not self.up:
+            return "down"
+        return "slow" if self.slow_streak >= self.slow_after else "up"
+
+    def report(self) -> Dict:
+        return {"state": self.state, "critical": self.critical, "error": self.error,
+                "checked_at": self.checked_at, "latency": self.histogram.snapshot()}
+
+
+class HealthProber:
+    """Probes vLLM, the postgres pool and the search API in the background.
+
+    Endpoints only read the cached result, so /health and /ready never wait on a
+    dependency. The app is not ready while a critical dependency is down; a slow one
+    (several probes in a row over its threshold) only reports it as degraded.
+    """
+
+    def __init__(self, interval: float = 5.0, timeout: float = 2.0, lag_interval: float = 0.1,
+                 stall_threshold: float = 0.25) -> None:
+        self.interval = interval
+        self.timeout = timeout
+        self.lag_interval = lag_interval
+        self.loop_lag = LatencyHistogram(window=50)
+        # the lag monitor's wake-ups are its heartbeat; it captures the loop's stack when they stop
+        self.stall_monitor = LoopStallMonitor(threshold=stall_threshold, beat_interval=lag_interval)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lag_task: Optional[asyncio.Task] = None
+        self.started_at = time.time()
+        self.dependencies: List[DependencyStatus] = [
+            DependencyStatus("vllm", self._probe_vllm, critical=True, slow_ms=500),
+            DependencyStatus("postgres", self._probe_postgres, critical=True, slow_ms=200),
+            DependencyStatus("search", self._probe_search, critical=False, slow_ms=1500),
+        ]
+
+    async def _probe_vllm(self) -> None:
+        # ejects/restores replicas in the router; ready while at least one replica is up
+        llm_router = get_llm_router()
+        metrics_texts = await llm_router.check_health(self._client)
+        if not metrics_texts and not any(backend.available for backend in llm_router.backends):
+            raise RuntimeError("no vLLM replica is healthy")
+        # queue time / waiting requests summed over replicas for /metrics
+        if metrics_texts:
+            vllm_queue_scrape.update("\n".join(metrics_texts))
+
+    async def _probe_postgres(self) -> None:
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def _probe_search(self) -> None:
+        # reachability only, a real search would spend API quota
+        await self._client.head(TAVILY_URL)
+
+    async def _check(self, dependency: DependencyStatus) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(dependency.probe(), timeout=self.timeout)
+            dependency.up, dependency.error = True, None
+        except Exception as e:
+            dependency.up, dependency.error = False, repr(e) if not isinstance(e, asyncio.TimeoutError) else f"timeout after {self.timeout}s"
+        dependency.observe((time.perf_counter() - start) * 1000)
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self._check(dependency) for dependency in self.dependencies))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.warning(f"Health probe round failed: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    async def _monitor_loop_lag(self) -> None:
+        """Event-loop lag: how late a short sleep wakes up. Anything blocking the loop shows here."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.stall_monitor.beat()
+            self.loop_lag.observe(max(0.0, (time.perf_counter() - start - self.lag_interval) * 1000))
+
+    async def start(self) -> None:
+        self._client = httpx.AsyncClient(timeout=self.timeout)
+        self._task = asyncio.create_task(self._run(), name="health-prober")
+        self._lag_task = asyncio.create_task(self._monitor_loop_lag(), name="loop-lag-monitor")
+        self.stall_monitor.start()
+
+    async def stop(self) -> None:
+        self.stall_monitor.stop()
+        for task in (self._task, self._lag_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._lag_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def liveness(self) -> Dict:
+        return {"status": "alive", "uptime_s": round(time.time() - self.started_at, 1),
+                "prober_running": self._task is not None and not self._task.done(),
+                "loop_lag_ms": {"recent_p50": self.loop_lag.recent_percentile(50),
+                                "recent_p95": self.loop_lag.recent_percentile(95),
+                                "recent_max": max(self.loop_lag.recent, default=None)},
+                "loop_stalls": len(self.stall_monitor.stalls),
+                "last_loop_stall": {key: self.stall_monitor.stalls[-1][key] for key in ("detected_at", "duration_ms", "where")}
+                                   if self.stall_monitor.stalls else None}
+
+    def readiness(self) -> Dict:
+        states = {dependency.name: dependency.report() for dependency in self.dependencies}
+        critical_states = [dependency.state for dependency in self.dependencies if dependency.critical]
+        other_states = [dependency.state for dependency in self.dependencies if not dependency.critical]
+
+        if any(state != "up" for state in critical_states):
+            status = "not_ready" if "down" in critical_states else "degraded"
+        elif any(state != "up" for state in other_states):
+            status = "degraded"
+        else:
+            status = "ready"
+        # only a critical dependency that is down takes the app out of rotation, a slow one still serves
+        return {"status": status, "ready": "down" not in critical_states, "dependencies": states,
+                "llm_backends": get_llm_router().stats(), "sessions": sessions.stats()}
+
+
+health_prober = HealthProber(stall_threshold=float(os.getenv("LOOP_STALL_THRESHOLD_MS", 250)) / 1000)
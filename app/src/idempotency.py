@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from metrics import IDEMPOTENCY_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyConflict(ValueError):
+    """An Idempotency-Key reused with a different request body."""
+
+
+def body_hash(payload: Dict) -> str:
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def request_key(endpoint: str, idempotency_key: Optional[str], payload: Dict) -> Tuple[str, bool]:
+    """(key, explicit). Without an Idempotency-Key header the body is hashed; such keys only join in-flight runs,
+    since an identical "continue" later in the thread is a new decision, not a retry."""
+    if idempotency_key:
+        return f"{endpoint}:{idempotency_key}", True
+    return f"{endpoint}:body:{body_hash(payload)}", False
+
+
+class Execution:
+    """One graph run whose events are buffered, so any number of requests can read them from the start."""
+
+    def __init__(self, key: str, thread_id: str, body_hash: Optional[str] = None) -> None:
+        self.key = key
+        self.thread_id = thread_id
+        self.body_hash = body_hash
+        self.events: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self._changed = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.profile_id: Optional[str] = None # set when started with X-Profile, see profiler.py
+        self.size = 0 # encoded bytes of the buffered events, set when it is kept for replay
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, event: Any) -> None:
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.error = error
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    async def subscribe(self, start: int = 0) -> AsyncIterator[Any]:
+        """Replay buffered events, then follow the run until it ends. Re-raises the run's error."""
+        index = start
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.done:
+                break
+            await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+
+
+class IdempotencyManager:
+    """Runs at most one graph execution per thread_id and de-duplicates repeated requests.
+
+    A request whose key matches a running execution attaches to it instead of
+    re-running the graph. Executions with an explicit Idempotency-Key are kept for
+    `ttl` seconds after they finish and replayed to retries, failed ones included: a
+    retry gets the same error instead of applying the turn a second time. At most
+    `max_entries` of them and `max_bytes` of their buffered events are kept, oldest
+    dropped first. Reusing such a key with a different body raises IdempotencyConflict. Executions of the same
+    thread with different keys run one after another under a per-thread lock.
+    The run is detached from the request, so a client that disconnects does not
+    cancel it half way.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1000, max_bytes: int = 64 * 1024 * 1024) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._inflight: Dict[str, Execution] = {}
+        self._completed: "OrderedDict[str, Execution]" = OrderedDict() # in finish order
+        self._completed_bytes = 0
+        self._thread_locks: Dict[str, asyncio.Lock] = {}
+        self._lock_users: Dict[str, int] = {}
+
+    def _lookup_completed(self, key: str) -> Optional[Execution]:
+        execution = self._completed.get(key)
+        if execution is not None and time.monotonic() - execution.finished_at > self.ttl:
+            self._forget(key)
+            return None
+        return execution
+
+    def _forget(self, key: str) -> None:
+        execution = self._completed.pop(key, None)
+        if execution is not None:
+            self._completed_bytes -= execution.size
+
+    def _retain(self, execution: Execution) -> None:
+        """Keep a finished execution for replay, then drop expired ones and the oldest past the bounds."""
+        self._forget(execution.key)
+        execution.size = sum(len(json.dumps(event, default=str)) for event in execution.events)
+        if execution.size > self.max_bytes:
+            logger.warning(f"Execution {execution.key} is too large to keep for replay ({execution.size} bytes)")
+        else:
+            self._completed[execution.key] = execution
+            self._completed_bytes += execution.size
+        now = time.monotonic()
+        while self._completed:
+            oldest = next(iter(self._completed.values()))
+            if (len(self._completed) <= self.max_entries and self._completed_bytes <= self.max_bytes
+                    and now - oldest.finished_at <= self.ttl):
+                break
+            self._forget(oldest.key)
+
+    def get(self, key: str, body_hash: Optional[str] = None) -> Tuple[Optional[Execution], str]:
+        """Existing execution for the key: ("attached" to a running one, "replayed" from a finished one) or (None, "new")."""
+        execution, status = self._inflight.get(key), "attached"
+        if execution is None:
+            execution, status = self._lookup_completed(key), "replayed"
+        if execution is None:
+            return None, "new"
+        if body_hash is not None and execution.body_hash is not None and body_hash != execution.body_hash:
+            IDEMPOTENCY_REQUESTS.labels("conflict").inc()
+            raise IdempotencyConflict("Idempotency-Key was already used with a different request body")
+        IDEMPOTENCY_REQUESTS.labels(status).inc()
+        return execution, status
+
+    def start(self, key: str, thread_id: str, explicit: bool, events: Callable[[], AsyncIterator[Any]],
+              body_hash: Optional[str] = None) -> Execution:
+        """Start a new execution in the background. `events` is only called once the thread lock is held."""
+        IDEMPOTENCY_REQUESTS.labels("new").inc()
+        execution = Execution(key, thread_id, body_hash)
+        self._inflight[key] = execution
+        execution.task = asyncio.create_task(self._run(execution, explicit, events), name=f"execution-{thread_id}")
+        return execution
+
+    @asynccontextmanager
+    async def thread_lock(self, thread_id: str):
+        """Hold a thread's execution lock: no graph run of the thread starts meanwhile (see sessions.py)."""
+        lock = self._thread_locks.setdefault(thread_id, asyncio.Lock())
+        self._lock_users[thread_id] = self._lock_users.get(thread_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_users[thread_id] -= 1
+            if not self._lock_users[thread_id]:
+                del self._lock_users[thread_id], self._thread_locks[thread_id]
+
+    async def _run(self, execution: Execution, explicit: bool, events: Callable[[], AsyncIterator[Any]]) -> None:
+        try:
+            async with self.thread_lock(execution.thread_id):
+                async for event in events():
+                    execution.append(event)
+            execution.finish()
+        except BaseException as e: # also CancelledError at shutdown, subscribers must not hang
+            execution.finish(e)
+            if not isinstance(e, Exception):
+                raise
+            logger.warning(f"Execution {execution.key} failed: {e!r}")
+        finally:
+            del self._inflight[execution.key]
+            # failed runs are replayed too, only a cancelled one (shutdown) is not kept
+            if explicit and (execution.error is None or isinstance(execution.error, Exception)):
+                self._retain(execution)
+
+    def thread_busy(self, thread_id: str) -> bool:
+        return thread_id in self._thread_locks
+
+    async def stop(self) -> None:
+        """Cancel running executions at shutdown."""
+        tasks = [execution.task for execution in self._inflight.values() if execution.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": len(self._inflight), "completed": len(self._completed), "completed_bytes": self._completed_bytes,
+                "threads_locked": len(self._thread_locks)}
+
+
+idempotency = IdempotencyManager(ttl=float(os.getenv("IDEMPOTENCY_TTL", 300)),
+                                 max_entries=int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", 1000)),
+                                 max_bytes=int(os.getenv("IDEMPOTENCY_MAX_BYTES", 64 * 1024 * 1024)))
@@ -0,0 +1,191 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+
+logger = logging.getLogger(__name__)
+
+MAX_MODEL_LEN = int(os.getenv("MAX_MODEL_LEN", 4096)) # keep in sync with vllm --max-model-len
+GENERATION_RESERVE = int(os.getenv("GENERATION_RESERVE_TOKENS", 512))
+MESSAGE_OVERHEAD = 4 # role header and end-of-turn tokens added by the chat template
+MAX_OLD_TOOL_TOKENS = 256 # tool results outside the current turn are cut to this
+MAX_SUMMARY_TOKENS = 384
+
+
+_MISSING = object()
+
+
+def _load_encoder():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base") # close enough to the llama3 tokenizer for budgeting
+    except Exception as e:
+        logger.info(f"tiktoken unavailable ({e!r}), estimating 4 chars per token")
+        return None
+
+
+class TokenCounter:
+    """Token counts per message, cached by message id so each message is counted once."""
+
+    def __init__(self, max_entries: int = 50_000) -> None:
+        self._encoder = _MISSING # tiktoken loads (and may download) its BPE file, so on first count
+        self.max_entries = max_entries
+        self._counts: "OrderedDict[tuple, int]" = OrderedDict()
+
+    @property
+    def encoder(self):
+        if self._encoder is _MISSING:
+            self._encoder = _load_encoder()
+        return self._encoder
+
+    def count_text(self, text: str) -> int:
+        if self.encoder is not None:
+            return len(self.encoder.encode(text, disallowed_special=()))
+        return (len(text) + 3) // 4
+
+    def count(self, message: BaseMessage) -> int:
+        # the id alone is not enough: "update" reviews replace a message keeping its id
+        key = (message.id, len(str(message.content)), len(getattr(message, "tool_calls", None) or ()))
+        if message.id is not None and (cached := self._counts.get(key)) is not None:
+            return cached
+
+        text = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        if isinstance(message, AIMessage) and message.tool_calls:
+            text += json.dumps([{"name": call["name"], "args": call["args"]} for call in message.tool_calls])
+        tokens = self.count_text(text) + MESSAGE_OVERHEAD
+
+        if message.id is not None:
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+
+class _ThreadContext:
+    """What has already been folded out of a thread's window."""
+    __slots__ = ("dropped", "summary", "summary_tokens")
+
+    def __init__(self):
+        self.dropped = 0 # number of leading non-system messages no longer sent
+        self.summary: List[str] = []
+        self.summary_tokens = 0
+
+
+class ContextAssembler:
+    """Fits a thread's messages into the model window before each call_llm step.
+
+    Budget = max model length - generation reserve - tool schemas. System messages
+    and the current turn (from the last user message on) are always sent. Tool results
+    from earlier turns are truncated; if the thread still does not fit, the oldest
+    messages are dropped and folded into a rolling summary. The drop boundary and the
+    summary are kept per thread and only ever extended, so each step does work
+    proportional to the new messages rather than the whole thread.
+    """
+
+    def __init__(self, tool_schemas: Optional[list] = None, max_model_len: int = MAX_MODEL_LEN,
+                 generation_reserve: int = GENERATION_RESERVE, max_threads: int = 1024) -> None:
+        self.counter = TokenCounter()
+        self.max_model_len = max_model_len
+        self.generation_reserve = generation_reserve
+        self.set_tool_schemas(tool_schemas)
+        self.max_threads = max_threads
+        self._threads: "OrderedDict[str, _ThreadContext]" = OrderedDict()
+        self._truncated: "OrderedDict[str, ToolMessage]" = OrderedDict()
+
+    def set_tool_schemas(self, tool_schemas: Optional[list]) -> None:
+        """The tool schemas sent with every request count against the window."""
+        self.tool_tokens = self.counter.count_text(json.dumps(tool_schemas)) if tool_schemas else 0
+        self.budget = self.max_model_len - self.generation_reserve - self.tool_tokens
+
+    def _thread(self, thread_id: str) -> _ThreadContext:
+        context = self._threads.get(thread_id)
+        if context is None:
+            context = self._threads[thread_id] = _ThreadContext()
+            if len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        self._threads.move_to_end(thread_id)
+        return context
+
+    def forget(self, thread_id: str) -> None:
+        self._threads.pop(thread_id, None)
+
+    def _truncate_tool_message(self, message: ToolMessage) -> ToolMessage:
+        if self.counter.count(message) <= MAX_OLD_TOOL_TOKENS:
+            return message
+        if message.id is not None and (cached := self._truncated.get(message.id)) is not None:
+            return cached
+
+        keep_chars = MAX_OLD_TOOL_TOKENS * 4
+        truncated = message.model_copy(update={"content": str(message.content)[:keep_chars] + " ...[truncated]"})
+        if message.id is not None:
+            self._truncated[message.id] = truncated
+            if len(self._truncated) > 10_000:
+                self._truncated.popitem(last=False)
+        return truncated
+
+    def _summarize(self, message: BaseMessage) -> str:
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+        first_line = content.strip().split("\n", 1)[0][:200]
+        if isinstance(message, HumanMessage):
+            return f"user: {first_line}"
+        if isinstance(message, AIMessage):
+            if message.tool_calls:
+                return "assistant called " + ", ".join(f"{call['name']}({json.dumps(call['args'])[:80]})" for call in message.tool_calls)
+            return f"assistant: {first_line}"
+        if isinstance(message, ToolMessage):
+            return f"{message.name} returned: {first_line[:120]}"
+        return first_line
+
+    def _fold(self, context: _ThreadContext, message: BaseMessage) -> None:
+        """Adds a dropped message to the thread's rolling summary, oldest lines go first when it is full."""
+        line = self._summarize(message)
+        context.summary.append(line)
+        context.summary_tokens += self.counter.count_text(line) + 1
+        while context.summary_tokens > MAX_SUMMARY_TOKENS and len(context.summary) > 1:
+            context.summary_tokens -= self.counter.count_text(context.summary.pop(0)) + 1
+
+    def assemble(self, messages: Sequence[BaseMessage], thread_id: Optional[str] = None) -> List[BaseMessage]:
+        system = [message for message in messages if isinstance(message, SystemMessage)]
+        history = [message for message in messages if not isinstance(message, SystemMessage)]
+
+        # current turn starts at the last user message and is never cut
+        turn_start = max((i for i, message in enumerate(history) if isinstance(message, HumanMessage)), default=0)
+        context = self._thread(thread_id) if thread_id is not None else _ThreadContext()
+        start = min(context.dropped, turn_start)
+
+        window = [self._truncate_tool_message(message) if i < turn_start and isinstance(message, ToolMessage) else message
+                  for i, message in enumerate(history[start:], start=start)]
+        fixed = sum(self.counter.count(message) for message in system)
+        total = fixed + sum(self.counter.count(message) for message in window)
+        summary_cost = context.summary_tokens + MESSAGE_OVERHEAD if context.summary else 0
+
+        # drop from the front; tool results go together with the AI tool call they answer
+        while start < turn_start and (total + summary_cost > self.budget or isinstance(history[start], ToolMessage)):
+            total -= self.counter.count(window.pop(0))
+            self._fold(context, history[start])
+            start += 1
+            summary_cost = context.summary_tokens + MESSAGE_OVERHEAD
+
+        context.dropped = start
+        if total + summary_cost > self.budget:
+            # last resort: cut tool results of the current turn as well
+            window = [self._truncate_tool_message(message) if isinstance(message, ToolMessage) else message
+                      for message in window]
+            total = fixed + sum(self.counter.count(message) for message in window)
+        if total + summary_cost > self.budget:
+            logger.warning(f"thread_id {thread_id}: current turn alone needs {total + summary_cost} tokens, budget {self.budget}")
+
+        assembled = list(system)
+        if context.summary and start > 0:
+            assembled.append(SystemMessage(content="Summary of the earlier conversation:\n" + "\n".join(context.summary)))
+        assembled.extend(window)
+        return assembled
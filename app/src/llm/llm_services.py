@@ -1,14 +1,22 @@
-from langchain_openai import ChatOpenAI
-from typing import Dict, Any, Annotated,Optional,List
-import requests
+from typing import TYPE_CHECKING, Dict, Any, Annotated,Optional,List
+import httpx
 import gc
-import torch
-from tool.tools import AVAILABLE_TOOLS
 from langchain_core.runnables import RunnableConfig
 import os
+import logging
+from metrics import observe_llm, record_llm_usage, thread_id_of
+from llm.scheduler import build_llm_scheduler, LLMOverloaded
+from llm.router import build_llm_router, replica_urls, LLMRouter
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
 
 SERVED_MODEL_NAME = os.getenv("SERVED_MODEL_NAME")
-vLLM_SERVER_URL = "http://vllm:8000/v1"
+logger = logging.getLogger(__name__)
+
+vLLM_SERVER_URL = os.getenv("VLLM_SERVER_URL", "http://vllm:8000/v1")
+# first replica; with VLLM_SERVER_URLS set, health.py probes every replica through the router
+VLLM_HEALTH_URL = vLLM_SERVER_URL.removesuffix("/v1") + "/health"
 
 # for reasoning model
 reasoning = {
@@ -24,41 +32,81 @@ extra_body={"stop": ["<|eot_id|>"],
             "top_k":None
             }
 
-llm = ChatOpenAI(
-    model=SERVED_MODEL_NAME,
-    openai_api_base=vLLM_SERVER_URL,
-    openai_api_key="dummy-key",
-    #temperature=0, # Set to 0 for more deterministic tool use
-    # top_p= None,
-    # max_tokens=150, # Control output length if needed
-    extra_body=extra_body
-)
+def build_llm(base_url: str) -> "ChatOpenAI":
+    from langchain_openai import ChatOpenAI # ~1s of imports (openai SDK), paid when the first model is built
+    return ChatOpenAI(
+        model=SERVED_MODEL_NAME,
+        openai_api_base=base_url,
+        openai_api_key="dummy-key",
+        #temperature=0, # Set to 0 for more deterministic tool use
+        # top_p= None,
+        # max_tokens=150, # Control output length if needed
+        extra_body=extra_body,
+        stream_usage=True, # token counts also when the graph streams
+        max_retries=0, # the router retries on another replica
+    )
+
+
+_llm_router: Optional[LLMRouter] = None
 
-llm_with_tools = llm.bind_tools(AVAILABLE_TOOLS,tool_choice="auto")
+def get_llm_router() -> LLMRouter:
+    """One chat model per vLLM replica (VLLM_SERVER_URLS), requests spread by least outstanding + thread affinity.
+    Built on first use; the app lifespan calls this at startup so no request pays for it."""
+    global _llm_router
+    if _llm_router is None:
+        from tool.tools import available_tools
+        _llm_router = build_llm_router(build_llm, lambda model: model.bind_tools(available_tools(),tool_choice="auto"))
+    return _llm_router
+
+def get_llm() -> "ChatOpenAI":
+    return get_llm_router().primary.llm # sampling params are the same on every replica
+
+# every request to vLLM takes a slot: call_llm before think_step before /generate-text
+llm_scheduler = build_llm_scheduler(backends=len(replica_urls()))
 
 
 async def async_generate_text_response(prompt:str | List,
-                                  llm:Annotated[ChatOpenAI,"Must be ChatOpenAI class langchain wrapper"]=llm):
+                                  llm:Annotated[Optional["ChatOpenAI"],"ChatOpenAI to call directly, None routes across replicas"]=None,
+                                  config:Optional[RunnableConfig]=None,
+                                  caller:str="generate_text"):
 
-        return await llm.ainvoke(prompt)
+        thread_id = thread_id_of(config)
+        async with llm_scheduler.slot(caller, thread_id):
+            with observe_llm(caller, config):
+                if llm is None:
+                    response = await get_llm_router().ainvoke(prompt, config=config, thread_id=thread_id)
+                else:
+                    response = await llm.ainvoke(prompt,config=config)
+        record_llm_usage(caller, response)
+        return response
 
 
 async def async_generate_tool_response(prompt:str|List|Dict, config:RunnableConfig,
-                                       llm_with_tools=llm_with_tools):
+                                       llm_with_tools=None):
         
+        thread_id = thread_id_of(config)
+        async with llm_scheduler.slot("call_llm", thread_id):
+            with observe_llm("call_llm", config):
+                if llm_with_tools is None:
+                    response = await get_llm_router().ainvoke(prompt, config=config, thread_id=thread_id, tools=True)
+                else:
+                    response = await llm_with_tools.ainvoke(prompt,config=config)
+        record_llm_usage("call_llm", response)
+        return response
 
-        return await llm_with_tools.ainvoke(prompt,config=config)
-
-def check_server_status():
+async def check_server_status(timeout: float = 2.0):
+    """One-off vLLM health check. Endpoints should read health.health_prober instead."""
     try:
-        response = requests.get("http://vllm:8000/health")
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            response = await client.get(VLLM_HEALTH_URL)
         if response.status_code == 200:
-            print("vllm server is running")
+            logger.info("vllm server is running")
             return True
-    except requests.exceptions.ConnectionError:
-        print("vllm server is not running")
+        return False
+    except httpx.HTTPError:
+        logger.warning("vllm server is not running")
         return False
     
 def clear_memory():
+     # the agent-app runs on CPU, the GPU cache belongs to the vLLM process
      gc.collect()
-     torch.cuda.empty_cache()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from langchain_core.load import dumpd, load
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+import database.models as models
+from database.db import AsyncSessionLocal
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
+
+# vLLM falls back to generation_config.json when the request leaves temperature unset
+SERVER_DEFAULT_TEMPERATURE = float(os.getenv("SERVER_DEFAULT_TEMPERATURE", 0))
+
+
+def sampling_params(llm: "ChatOpenAI") -> Dict[str, Any]:
+    """Effective request parameters that change the completion."""
+    return {"model": llm.model_name,
+            "temperature": llm.temperature,
+            "top_p": llm.top_p,
+            "max_tokens": llm.max_tokens,
+            "seed": llm.seed,
+            "stop": llm.stop,
+            "extra_body": llm.extra_body}
+
+
+def is_deterministic(params: Dict[str, Any]) -> bool:
+    temperature = params["temperature"] if params["temperature"] is not None else SERVER_DEFAULT_TEMPERATURE
+    top_k = (params.get("extra_body") or {}).get("top_k")
+    return temperature == 0 or top_k == 1 or params.get("seed") is not None
+
+
+def response_cache_key(messages: List[Dict], params: Dict[str, Any]) -> str:
+    """Canonical hash: key order and whitespace of the JSON do not matter."""
+    payload = json.dumps({"messages": messages, "params": params}, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CacheControl:
+    """Request Cache-Control directives understood by the response cache.
+
+    no-store       neither read nor write the cache
+    no-cache       skip the lookup but store the fresh response
+    max-age=N      only accept entries younger than N seconds
+    only-if-cached answer from the cache or fail
+    X-Cache-Force  cache even when sampling is not deterministic
+    """
+
+    def __init__(self, header: Optional[str], force: Optional[str] = None) -> None:
+        directives = {}
+        for part in (header or "").lower().split(","):
+            name, _, value = part.strip().partition("=")
+            if name:
+                directives[name] = value
+        self.no_store = "no-store" in directives
+        self.no_cache = "no-cache" in directives
+        self.only_if_cached = "only-if-cached" in directives
+        self.max_age = float(directives["max-age"]) if directives.get("max-age", "").isdigit() else None
+        self.force = (force or "").lower() in ("1", "true", "yes")
+
+
+class PostgresResponseStore:
+    """response_cache table shared by all app workers."""
+
+    def __init__(self, session_factory) -> None:
+        self.session_factory = session_factory
+
+    async def get(self, key: str) -> Optional[Tuple[float, Dict]]:
+        async with self.session_factory() as db:
+            row = (await db.execute(select(models.ResponseCacheEntry).where(
+                models.ResponseCacheEntry.key == key,
+                models.ResponseCacheEntry.expires_at > datetime.now(timezone.utc)))).scalar()
+        if row is None:
+            return None
+        return row.created_at.timestamp(), json.loads(row.response)
+
+    async def set(self, key: str, model: str, response: Dict, ttl: float) -> None:
+        now = datetime.now(timezone.utc)
+        stmt = insert(models.ResponseCacheEntry).values(key=key, model=model, response=json.dumps(response),
+                                                        created_at=now, expires_at=now + timedelta(seconds=ttl))
+        stmt = stmt.on_conflict_do_update(index_elements=["key"], set_={"response": stmt.excluded.response,
+                                                                          "created_at": stmt.excluded.created_at,
+                                                                          "expires_at": stmt.excluded.expires_at})
+        async with self.session_factory() as db:
+            await db.execute(stmt)
+            await db.commit()
+
+
+class ResponseCache:
+    """Exact-match cache of /generate-text completions: in-memory LRU in front of an optional postgres store."""
+
+    def __init__(self, ttl: float = 3600.0, max_entries: int = 2048, store: Optional[PostgresResponseStore] = None) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store = store
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict() # key -> (created_at, message)
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def _fresh(self, created_at: float, max_age: Optional[float]) -> bool:
+        age = time.time() - created_at
+        return age <= self.ttl and (max_age is None or age <= max_age)
+
+    async def get(self, key: str, max_age: Optional[float] = None):
+        entry = self._entries.get(key)
+        if entry is not None and self._fresh(entry[0], max_age):
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        if self.store is not None:
+            try:
+                stored = await self.store.get(key)
+            except Exception as e:
+                logger.warning(f"Response cache lookup failed: {e!r}")
+                stored = None
+            if stored is not None and self._fresh(stored[0], max_age):
+                message = load(stored[1])
+                self._set_local(key, stored[0], message)
+                self.shared_hits += 1
+                return message
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, model: str, message) -> None:
+        self._set_local(key, time.time(), message)
+        if self.store is not None:
+            try:
+                await self.store.set(key, model, dumpd(message), self.ttl)
+            except Exception as e:
+                logger.warning(f"Response cache store failed: {e!r}")
+
+    def _set_local(self, key: str, created_at: float, message) -> None:
+        self._entries[key] = (created_at, message)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "shared_hits": self.shared_hits,
+                "misses": self.misses, "skipped": self.skipped}
+
+
+def build_response_cache() -> Optional[ResponseCache]:
+    """Opt-in through RESPONSE_CACHE=memory|postgres (default off), RESPONSE_CACHE_TTL, RESPONSE_CACHE_MAX_ENTRIES."""
+    mode = os.getenv("RESPONSE_CACHE", "off")
+    if mode == "off":
+        return None
+    store = PostgresResponseStore(AsyncSessionLocal) if mode == "postgres" else None
+    return ResponseCache(ttl=float(os.getenv("RESPONSE_CACHE_TTL", 3600)),
+                         max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2048)),
+                         store=store)
+
+
+response_cache = build_response_cache()
@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables.config import merge_configs
+
+from metrics import BACKEND_AFFINITY, BACKEND_HEALTHY, BACKEND_LATENCY, BACKEND_OUTSTANDING, BACKEND_REQUESTS
+
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def retryable_errors() -> Tuple[type, ...]:
+    """Failures worth trying on another replica; 4xx other than 429 would fail the same way everywhere.
+    openai is imported on first use, it is one of the slowest imports of the app."""
+    import openai
+    return (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError)
+
+
+def replica_urls() -> List[str]:
+    """VLLM_SERVER_URLS is a comma separated list of replicas (default: VLLM_SERVER_URL)."""
+    return [url.strip() for url in os.getenv("VLLM_SERVER_URLS", os.getenv("VLLM_SERVER_URL", "http://vllm:8000/v1")).split(",")
+            if url.strip()]
+
+
+class _StreamStarted(BaseCallbackHandler):
+    """Notes whether a model call has streamed a token (to astream_events, so to the client)."""
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        self.started = False
+
+    def on_llm_new_token(self, token, **kwargs) -> None:
+        self.started = True
+
+
+class Backend:
+    """One OpenAI-compatible vLLM replica and the chat models bound to it."""
+
+    def __init__(self, url: str, llm: "ChatOpenAI", llm_with_tools) -> None:
+        self.url = url
+        self.llm = llm
+        self.llm_with_tools = llm_with_tools
+        self.health_url = url.removesuffix("/v1") + "/health"
+        self.metrics_url = url.removesuffix("/v1") + "/metrics"
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def eject(self, seconds: float, reason: str) -> None:
+        if self.available:
+            logger.warning(f"Ejecting LLM backend {self.url} for {seconds}s: {reason}")
+        self.ejected_until = time.monotonic() + seconds
+        BACKEND_HEALTHY.labels(self.url).set(0)
+
+    def restore(self) -> None:
+        if self.ejected_until:
+            logger.info(f"LLM backend {self.url} is back")
+        self.ejected_until = 0.0
+        self.consecutive_failures = 0
+        BACKEND_HEALTHY.labels(self.url).set(1)
+
+
+class LLMRouter:
+    """Client-side load balancing over several vLLM replicas.
+
+    A thread sticks to the replica that served it last, so the conversation prefix
+    stays in that replica's prefix cache, unless the replica is ejected or has more
+    than `affinity_slack` requests above the least loaded one. New threads go to
+    the replica with the fewest outstanding requests. Connection errors, 5xx and
+    429 are retried on another replica, unless the failed call already streamed tokens
+    to the client. `max_failures` consecutive failures eject a replica for `ejection_s`
+    seconds; once they are over, the health prober restores it.
+    """
+
+    def __init__(self, backends: List[Backend], affinity_slack: int = 4, max_failures: int = 3,
+                 ejection_s: float = 30.0, max_threads: int = 10000) -> None:
+        self.backends = backends
+        self.affinity_slack = affinity_slack
+        self.max_failures = max_failures
+        self.ejection_s = ejection_s
+        self.max_threads = max_threads
+        self._affinity: "OrderedDict[str, Backend]" = OrderedDict() # thread_id -> backend, LRU bounded
+        for backend in backends:
+            BACKEND_HEALTHY.labels(backend.url).set(1)
+
+    @property
+    def primary(self) -> Backend:
+        return self.backends[0]
+
+    def pick(self, thread_id: Optional[str], exclude: Tuple[Backend, ...] = ()) -> Backend:
+        candidates = [backend for backend in self.backends if backend.available and backend not in exclude]
+        if not candidates: # everything ejected or already tried: least bad option rather than failing outright
+            candidates = [backend for backend in self.backends if backend not in exclude] or self.backends
+        least = min(backend.outstanding for backend in candidates)
+
+        sticky = self._affinity.get(thread_id) if thread_id is not None else None
+        if sticky in candidates and sticky.outstanding <= least + self.affinity_slack:
+            BACKEND_AFFINITY.labels("hit").inc()
+            self._affinity.move_to_end(thread_id)
+            return sticky
+        if sticky is not None:
+            BACKEND_AFFINITY.labels("moved").inc()
+
+        backend = random.choice([backend for backend in candidates if backend.outstanding == least])
+        if thread_id is not None:
+            self._affinity[thread_id] = backend
+            self._affinity.move_to_end(thread_id)
+            while len(self._affinity) > self.max_threads:
+                self._affinity.popitem(last=False)
+        return backend
+
+    def forget(self, thread_id: str) -> None:
+        self._affinity.pop(thread_id, None)
+
+    def _record_failure(self, backend: Backend, error: Exception) -> None:
+        import openai # already loaded by retryable_errors()
+        backend.consecutive_failures += 1
+        if isinstance(error, openai.APIConnectionError) or backend.consecutive_failures >= self.max_failures:
+            backend.eject(self.ejection_s, repr(error))
+
+    async def ainvoke(self, prompt, config=None, thread_id: Optional[str] = None, tools: bool = False):
+        """Invoke the plain or tool-bound model on a replica, retrying retryable failures elsewhere."""
+        tried: Tuple[Backend, ...] = ()
+        attempts = max(2, len(self.backends))
+        for attempt in range(attempts):
+            backend = self.pick(thread_id, exclude=tried if len(tried) < len(self.backends) else ())
+            tried += (backend,)
+            model = backend.llm_with_tools if tools else backend.llm
+            backend.outstanding += 1
+            BACKEND_OUTSTANDING.labels(backend.url).set(backend.outstanding)
+            start = time.perf_counter()
+            stream = _StreamStarted()
+            try:
+                response = await model.ainvoke(prompt, config=merge_configs(config or {}, {"callbacks": [stream]}))
+            except retryable_errors() as e:
+                BACKEND_REQUESTS.labels(backend.url, "error").inc()
+                self._record_failure(backend, e)
+                if attempt == attempts - 1 or stream.started: # a retry would stream a second answer after the partial one
+                    raise
+                logger.warning(f"LLM backend {backend.url} failed ({e!r}), retrying on another replica")
+                continue
+            finally:
+                backend.outstanding -= 1
+                BACKEND_OUTSTANDING.labels(backend.url).set(backend.outstanding)
+                BACKEND_LATENCY.labels(backend.url).observe(time.perf_counter() - start)
+
+            backend.consecutive_failures = 0
+            BACKEND_REQUESTS.labels(backend.url, "ok").inc()
+            return response
+
+    async def _check_backend(self, client: httpx.AsyncClient, backend: Backend) -> Optional[str]:
+        try:
+            response = await client.get(backend.health_url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            backend.eject(self.ejection_s, f"health check failed: {e!r}")
+            return None
+        if backend.available: # an ejection for failed requests runs its course, /health can be up meanwhile
+            backend.restore()
+        try:
+            metrics = await client.get(backend.metrics_url)
+            return metrics.text if metrics.status_code == 200 else None
+        except httpx.HTTPError as e:
+            logger.debug(f"vLLM metrics scrape of {backend.url} failed: {e!r}")
+            return None
+
+    async def check_health(self, client: httpx.AsyncClient) -> List[str]:
+        """Probe every replica's /health, eject or restore it. Returns /metrics text of the healthy ones."""
+        results = await asyncio.gather(*(self._check_backend(client, backend) for backend in self.backends))
+        return [text for text in results if text]
+
+    def stats(self) -> Dict[str, Dict]:
+        return {backend.url: {"available": backend.available, "outstanding": backend.outstanding,
+                              "consecutive_failures": backend.consecutive_failures} for backend in self.backends}
+
+
+def build_llm_router(build_llm: Callable[[str], "ChatOpenAI"], bind: Callable[["ChatOpenAI"], object]) -> LLMRouter:
+    """One backend per replica_urls() entry, LLM_AFFINITY_SLACK, LLM_MAX_FAILURES, LLM_EJECTION_SECONDS."""
+    backends = []
+    for url in replica_urls():
+        llm = build_llm(url)
+        backends.append(Backend(url, llm, bind(llm)))
+    return LLMRouter(backends,
+                     affinity_slack=int(os.getenv("LLM_AFFINITY_SLACK", 4)),
+                     max_failures=int(os.getenv("LLM_MAX_FAILURES", 3)),
+                     ejection_s=float(os.getenv("LLM_EJECTION_SECONDS", 30)))
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Hashable, List, Optional
+
+from metrics import LLM_INFLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_SHED
+
+logger = logging.getLogger(__name__)
+
+# lower value is served first: the interactive agent turn, its think_step sub-calls, then batch /generate-text
+PRIORITIES = {"call_llm": 0, "think_step": 1, "generate_text": 2}
+# share of max_queue a class may fill before it is shed, so batch work is refused first
+SHED_SHARE = {0: 1.0, 1: 0.75, 2: 0.5}
+
+
+class LLMOverloaded(Exception):
+    """Raised instead of queueing when vLLM is saturated. Maps to 429 + Retry-After."""
+
+    def __init__(self, caller: str, retry_after: int) -> None:
+        super().__init__(f"LLM queue full for {caller}, retry after {retry_after}s")
+        self.caller = caller
+        self.retry_after = retry_after
+
+
+class LLMScheduler:
+    """Admission control in front of vLLM.
+
+    At most `max_inflight` requests are sent to vLLM at once. The rest wait in one
+    queue per priority class; inside a class, threads are served round-robin and a
+    thread holds at most `max_inflight_per_thread` slots, so one looping agent cannot
+    starve the others. When the waiting queue is deeper than a class's share of
+    `max_queue`, or a request waited longer than `queue_timeout`, it is shed with a
+    Retry-After estimated from the recent service time.
+    """
+
+    def __init__(self, max_inflight: int = 8, max_queue: int = 64, max_inflight_per_thread: int = 2,
+                 queue_timeout: float = 30.0) -> None:
+        self.max_inflight = max_inflight
+        self.max_queue = max_queue
+        self.max_inflight_per_thread = max_inflight_per_thread
+        self.queue_timeout = queue_timeout
+
+        self.inflight = 0
+        self.waiting = 0
+        self._inflight_by_thread: Dict[Hashable, int] = defaultdict(int)
+        # per priority: thread_id -> waiters of that thread, in round-robin order
+        self._queues: List["OrderedDict[Hashable, Deque[asyncio.Future]]"] = [OrderedDict() for _ in SHED_SHARE]
+        self._service_time = 1.0 # EWMA of request duration (s), for Retry-After
+
+        self.admitted = 0
+        self.shed = 0
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil((self.waiting + 1) / self.max_inflight * self._service_time))
+
+    def admit(self, caller: str) -> None:
+        """Cheap pre-check for endpoints: raise LLMOverloaded now rather than mid-stream."""
+        priority = PRIORITIES.get(caller, PRIORITIES["generate_text"])
+        if self.waiting >= self.max_queue * SHED_SHARE[priority]:
+            self.shed += 1
+            LLM_SHED.labels(caller).inc()
+            raise LLMOverloaded(caller, self.retry_after())
+
+    def _grant(self, thread_id: Hashable, future: asyncio.Future) -> None:
+        self.inflight += 1
+        self.waiting -= 1
+        self._inflight_by_thread[thread_id] += 1
+        future.set_result(None)
+
+    def _dispatch(self) -> None:
+        progress = True
+        while progress and self.inflight < self.max_inflight:
+            progress = False
+            for queue in self._queues:
+                for thread_id in list(queue):
+                    if self.inflight >= self.max_inflight:
+                        break
+                    if self._inflight_by_thread.get(thread_id, 0) >= self.max_inflight_per_thread:
+                        continue
+                    waiters = queue.pop(thread_id)
+                    while waiters and waiters[0].done(): # cancelled while waiting
+                        waiters.popleft()
+                    if waiters:
+                        self._grant(thread_id, waiters.popleft())
+                        progress = True
+                    if waiters:
+                        queue[thread_id] = waiters # back of the round-robin
+                if progress:
+                    break # higher classes first again
+
+        for priority, queue in enumerate(self._queues):
+            LLM_QUEUE_DEPTH.labels(str(priority)).set(sum(len(waiters) for waiters in queue.values()))
+
+    def _release(self, thread_id: Hashable, duration: Optional[float]) -> None:
+        self.inflight -= 1
+        self._inflight_by_thread[thread_id] -= 1
+        if not self._inflight_by_thread[thread_id]:
+            del self._inflight_by_thread[thread_id]
+        if duration is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * duration
+        self._dispatch()
+        LLM_INFLIGHT.set(self.inflight)
+
+    @asynccontextmanager
+    async def slot(self, caller: str, thread_id: Optional[str] = None):
+        """Wait for an in-flight slot in the caller's priority class."""
+        self.admit(caller)
+        # a request without a thread is its own fairness bucket, not one shared by all of them
+        key: Hashable = thread_id if thread_id is not None else object()
+        priority = PRIORITIES.get(caller, PRIORITIES["generate_text"])
+        future = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(key, deque()).append(future)
+        self.waiting += 1
+        enqueued_at = time.perf_counter()
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled(): # granted at the same moment, give the slot back
+                self._release(key, None)
+            else:
+                self.waiting -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed += 1
+                LLM_SHED.labels(caller).inc()
+                logger.warning(f"{caller} waited {self.queue_timeout}s for an LLM slot, shedding")
+                raise LLMOverloaded(caller, self.retry_after()) from None
+            raise
+
+        LLM_QUEUE_WAIT.labels(caller).observe(time.perf_counter() - enqueued_at)
+        LLM_INFLIGHT.set(self.inflight)
+        self.admitted += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._release(key, time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, float]:
+        return {"inflight": self.inflight, "waiting": self.waiting, "admitted": self.admitted, "shed": self.shed,
+                "service_time_s": round(self._service_time, 3)}
+
+
+def build_llm_scheduler(backends: int = 1) -> LLMScheduler:
+    """LLM_MAX_INFLIGHT (default 8 per replica), LLM_MAX_QUEUE, LLM_MAX_INFLIGHT_PER_THREAD, LLM_QUEUE_TIMEOUT."""
+    return LLMScheduler(max_inflight=int(os.getenv("LLM_MAX_INFLIGHT", 8 * backends)),
+                        max_queue=int(os.getenv("LLM_MAX_QUEUE", 64)),
+                        max_inflight_per_thread=int(os.getenv("LLM_MAX_INFLIGHT_PER_THREAD", 2)),
+                        queue_timeout=float(os.getenv("LLM_QUEUE_TIMEOUT", 30)))
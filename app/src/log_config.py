@@ -0,0 +1,111 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from typing import Any, Dict, Optional
+
+# correlation id of the request being served, set once per endpoint call and inherited by graph tasks
+thread_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("thread_id", default=None)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json") # json | text
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", 500))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.1))
+
+# noisy libraries stay quiet unless LOG_LEVELS says otherwise
+DEFAULT_LEVELS = {
+    "sqlalchemy.engine": "WARNING",
+    "httpx": "WARNING",
+    "httpcore": "WARNING",
+    "openai": "WARNING",
+    "urllib3": "WARNING",
+    "asyncio": "WARNING",
+}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """'tool=DEBUG,sqlalchemy.engine=INFO' -> {'tool': 'DEBUG', 'sqlalchemy.engine': 'INFO'}"""
+    levels = {}
+    for part in spec.split(","):
+        name, _, level = part.strip().partition("=")
+        if name and level:
+            levels[name] = level.upper()
+    return levels
+
+
+def bind_thread_id(config) -> None:
+    """Use the request's thread_id as correlation id for every log record emitted while serving it."""
+    thread_id_var.set(((config or {}).get("configurable") or {}).get("thread_id"))
+
+
+class CorrelationFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.thread_id = thread_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": self.formatTime(record), "level": record.levelname, "logger": record.name,
+                 "thread_id": getattr(record, "thread_id", None), "msg": record.getMessage()}
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def truncate(payload: Any, limit: int = LOG_PAYLOAD_CHARS) -> str:
+    text = payload if isinstance(payload, str) else repr(payload)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def log_payload(logger: logging.Logger, label: str, payload: Any, sample_rate: float = LOG_PAYLOAD_SAMPLE_RATE) -> None:
+    """Sampled, truncated DEBUG log of a message body. Nothing is formatted unless it will be emitted."""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < sample_rate:
+        logger.debug(f"{label}: {truncate(payload)}")
+
+
+def configure_logging(level: str = LOG_LEVEL, levels: Optional[Dict[str, str]] = None) -> None:
+    """Route all records through a queue to a listener thread, so handlers never write on the event loop."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s [%(thread_id)s]: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter()) # read the contextvar on the emitting task, not the listener thread
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level.upper())
+
+    for name, logger_level in {**DEFAULT_LEVELS, **parse_levels(os.getenv("LOG_LEVELS", "")), **(levels or {})}.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Flush whatever is still queued."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
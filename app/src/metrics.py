@@ -0,0 +1,192 @@
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+NODE_DURATION = Histogram("agent_node_duration_seconds", "Time spent in a graph node", ["node"], buckets=LATENCY_BUCKETS)
+TOOL_DURATION = Histogram("agent_tool_duration_seconds", "Time spent in one tool call", ["tool", "status"], buckets=LATENCY_BUCKETS)
+LLM_DURATION = Histogram("agent_llm_request_duration_seconds", "LLM request duration by caller", ["caller"], buckets=LATENCY_BUCKETS)
+LLM_TOKENS = Counter("agent_llm_tokens_total", "Prompt/completion tokens reported by vLLM", ["caller", "kind"])
+HUMAN_REVIEW_WAIT = Histogram("agent_human_review_wait_seconds", "Time between an interrupt and its resume",
+                              buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600))
+DB_WRITE_DURATION = Histogram("agent_db_write_duration_seconds", "agent_history write latency", ["op"], buckets=LATENCY_BUCKETS)
+DB_ROWS_WRITTEN = Counter("agent_db_rows_written_total", "agent_history rows written")
+DB_ROWS_REJECTED = Counter("agent_db_rows_rejected_total", "agent_history rows dropped because postgres kept rejecting them")
+INFLIGHT_THREADS = Gauge("agent_inflight_threads", "Threads currently executing the graph")
+LLM_INFLIGHT = Gauge("agent_llm_inflight_requests", "Requests the scheduler has sent to vLLM")
+LLM_QUEUE_DEPTH = Gauge("agent_llm_queue_depth", "Requests waiting for an LLM slot", ["priority"])
+LLM_QUEUE_WAIT = Histogram("agent_llm_queue_wait_seconds", "Time waiting for an LLM slot", ["caller"], buckets=LATENCY_BUCKETS)
+LLM_SHED = Counter("agent_llm_shed_total", "LLM requests refused by load shedding", ["caller"])
+BACKEND_REQUESTS = Counter("agent_llm_backend_requests_total", "Requests per vLLM replica", ["backend", "status"])
+BACKEND_LATENCY = Histogram("agent_llm_backend_duration_seconds", "Request duration per vLLM replica", ["backend"], buckets=LATENCY_BUCKETS)
+BACKEND_OUTSTANDING = Gauge("agent_llm_backend_outstanding", "Outstanding requests per vLLM replica", ["backend"])
+BACKEND_HEALTHY = Gauge("agent_llm_backend_healthy", "1 when the replica takes traffic, 0 while ejected", ["backend"])
+BACKEND_AFFINITY = Counter("agent_llm_backend_affinity_total", "Thread affinity kept (hit) or moved to another replica", ["result"])
+IDEMPOTENCY_REQUESTS = Counter("agent_workflow_requests_total", "Workflow requests that started, attached to or replayed an execution, or reused a key (conflict)", ["result"])
+SPECULATION_RUNS = Counter("agent_speculative_tool_runs_total",
+                           "Tool calls run during human review: started/skipped, then hit/hit_pending/mismatch/discarded/failed/expired/evicted",
+                           ["tool", "result"])
+SPECULATION_SAVED = Histogram("agent_speculative_tool_saved_seconds", "Tool time already done when a speculative result was used",
+                              buckets=LATENCY_BUCKETS)
+SPECULATION_ENTRIES = Gauge("agent_speculative_tool_entries", "Speculative tool runs kept, running or finished")
+SPECULATION_BYTES = Gauge("agent_speculative_tool_bytes", "Content size of the finished speculative tool results kept")
+APPROVALS = Counter("agent_tool_auto_approvals_total", "Tool calls approved by the approval policy without a human", ["tool", "rule"])
+REVIEWS_AVOIDED = Counter("agent_review_round_trips_avoided_total", "Interrupt -> /resume-workflow round trips skipped by auto-approval")
+REVIEW_TIME_SAVED = Counter("agent_review_time_saved_seconds_total",
+                            "Estimated end-to-end time saved by auto-approvals (mean observed human review wait each)")
+SESSION_THREADS = Gauge("agent_session_threads", "Threads with per-thread state in this process (process_resident_memory_bytes has the RSS)")
+SESSION_EVICTIONS = Counter("agent_session_evictions_total", "Threads evicted from memory: idle/threads (count cap)/memory (RSS cap)", ["reason"])
+SESSION_RELOADS = Counter("agent_session_reloads_total", "Threads whose checkpoints were deleted, restarted from agent_history")
+MEMORY_DOCS = Gauge("agent_memory_index_docs", "agent_history messages in the recall_memory index", ["segment"])
+MEMORY_QUERY_DURATION = Histogram("agent_memory_query_duration_seconds", "recall_memory search latency", ["backend"], buckets=LATENCY_BUCKETS)
+MEMORY_MERGE_DURATION = Histogram("agent_memory_merge_duration_seconds", "Merging new rows into the memory index snapshot",
+                                  buckets=LATENCY_BUCKETS)
+LOOP_STALLS = Counter("agent_event_loop_stalls_total", "Times the event loop was blocked past LOOP_STALL_THRESHOLD_MS")
+LOOP_STALL_DURATION = Histogram("agent_event_loop_stall_duration_seconds", "How long a detected event loop stall lasted",
+                                buckets=LATENCY_BUCKETS)
+VLLM_QUEUE_TIME = Gauge("agent_vllm_request_queue_time_seconds", "Mean vLLM queue time since the previous scrape of vLLM /metrics")
+VLLM_REQUESTS_WAITING = Gauge("agent_vllm_requests_waiting", "Requests waiting in the vLLM scheduler")
+
+# interrupt time per thread_id, to measure how long call_human_feedback waits on a human
+_pending_reviews: Dict[str, float] = {}
+_review_wait_mean: Optional[float] = None # EWMA of the human review wait, prices an avoided round trip
+
+
+def _build_tracer():
+    if os.getenv("OTEL_ENABLED", "false").lower() != "true":
+        return None
+    try:
+        from opentelemetry import trace
+        return trace.get_tracer("agent-app")
+    except ImportError:
+        logger.warning("OTEL_ENABLED is set but opentelemetry is not installed")
+        return None
+
+
+tracer = _build_tracer()
+
+
+def thread_id_of(config) -> Optional[str]:
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+def span(name: str, thread_id: Optional[str] = None):
+    """OpenTelemetry span tagged with the thread_id, no-op unless OTEL_ENABLED=true."""
+    if tracer is None:
+        return nullcontext()
+    return tracer.start_as_current_span(name, attributes={"thread_id": thread_id or ""})
+
+
+@contextmanager
+def observe_node(node: str, config=None):
+    start = time.perf_counter()
+    with span(node, thread_id_of(config)):
+        try:
+            yield
+        finally:
+            NODE_DURATION.labels(node).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def observe_llm(caller: str, config=None):
+    start = time.perf_counter()
+    with span(f"llm:{caller}", thread_id_of(config)):
+        try:
+            yield
+        finally:
+            LLM_DURATION.labels(caller).observe(time.perf_counter() - start)
+
+
+def record_llm_usage(caller: str, message) -> None:
+    """Token counts from the AI message: usage_metadata (also set when streaming) or response_metadata."""
+    usage = getattr(message, "usage_metadata", None)
+    if usage:
+        prompt_tokens, completion_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    else:
+        token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0)
+    if prompt_tokens:
+        LLM_TOKENS.labels(caller, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(caller, "completion").inc(completion_tokens)
+
+
+def review_requested(thread_id: Optional[str]) -> None:
+    if thread_id is not None:
+        _pending_reviews[thread_id] = time.monotonic()
+
+
+def review_resumed(thread_id: Optional[str]) -> None:
+    global _review_wait_mean
+    if (requested_at := _pending_reviews.pop(thread_id, None)) is not None:
+        wait = time.monotonic() - requested_at
+        HUMAN_REVIEW_WAIT.observe(wait)
+        _review_wait_mean = wait if _review_wait_mean is None else 0.9 * _review_wait_mean + 0.1 * wait
+
+
+def review_abandoned(thread_id: str) -> None:
+    """The thread was evicted while waiting for its reviewer, stop timing it."""
+    _pending_reviews.pop(thread_id, None)
+
+
+def review_skipped(tools_and_rules) -> None:
+    """An approval policy let a tool call message through without interrupting."""
+    for tool, rule in tools_and_rules:
+        APPROVALS.labels(tool, rule or "default").inc()
+    REVIEWS_AVOIDED.inc()
+    if _review_wait_mean is not None:
+        REVIEW_TIME_SAVED.inc(_review_wait_mean)
+
+
+@contextmanager
+def track_thread(config, resumed: bool = False):
+    """In-flight gauge for one graph execution; a resumed run also closes the human review wait."""
+    if resumed:
+        review_resumed(thread_id_of(config))
+    INFLIGHT_THREADS.inc()
+    try:
+        yield
+    finally:
+        INFLIGHT_THREADS.dec()
+
+
+class _VllmQueueScrape:
+    """Turns vLLM's cumulative queue-time histogram into a mean over each scrape interval."""
+
+    def __init__(self) -> None:
+        self.last_sum = None
+        self.last_count = None
+
+    def update(self, metrics_text: str) -> None:
+        values = {}
+        for line in metrics_text.splitlines():
+            if line.startswith(("vllm:request_queue_time_seconds_sum", "vllm:request_queue_time_seconds_count",
+                                "vllm:num_requests_waiting")):
+                name, _, value = line.rpartition(" ")
+                metric = name.split("{", 1)[0]
+                values[metric] = values.get(metric, 0.0) + float(value)
+
+        if "vllm:num_requests_waiting" in values:
+            VLLM_REQUESTS_WAITING.set(values["vllm:num_requests_waiting"])
+        queue_sum = values.get("vllm:request_queue_time_seconds_sum")
+        queue_count = values.get("vllm:request_queue_time_seconds_count")
+        if queue_sum is None or queue_count is None:
+            return
+        if self.last_count is not None and queue_count > self.last_count:
+            VLLM_QUEUE_TIME.set((queue_sum - self.last_sum) / (queue_count - self.last_count))
+        self.last_sum, self.last_count = queue_sum, queue_count
+
+
+vllm_queue_scrape = _VllmQueueScrape()
+
+
+def render_metrics():
+    """Prometheus exposition (body, content type)."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,347 @@
+import asyncio
+import contextvars
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+from metrics import LOOP_STALLS, LOOP_STALL_DURATION
+
+logger = logging.getLogger(__name__)
+
+# set while serving a request with X-Profile; tasks created for it (the graph execution) inherit it
+profile_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("profile_id", default=None)
+
+# (component, module prefixes, function qualname prefixes). A sample goes to the innermost
+# matching frame's component, so dumpd() called from a tool is serialization, not tool_node.
+COMPONENTS = (
+    ("serialization", ("langchain_core.load", "wire", "tool.history"), ()),
+    ("checkpointer", ("database.checkpointer",), ()),
+    ("db", ("database.",), ()),
+    ("tool_node", ("tool.",), ("BasicToolNode.",)),
+    ("call_llm", ("llm.",), ("call_llm",)),
+)
+MAX_DEPTH = 128
+# frames of the event loop itself (asyncio or uvloop's caller); stacks start below the innermost one,
+# and a loop thread whose innermost frame is one of them, with no task running, is waiting for I/O
+_LOOP_FRAMES = ("selectors:", "asyncio.base_events:", "asyncio.runners:", "asyncio.events:")
+
+_labels: Dict[object, Tuple[str, Optional[str]]] = {} # code object -> (label, component)
+
+
+def _component(module: str, qualname: str) -> Optional[str]:
+    for name, modules, functions in COMPONENTS:
+        if module.startswith(modules) or (functions and qualname.startswith(functions)):
+            return name
+    return None
+
+
+def _label(frame) -> Tuple[str, Optional[str]]:
+    code = frame.f_code
+    cached = _labels.get(code)
+    if cached is None:
+        module = frame.f_globals.get("__name__", "?")
+        qualname = getattr(code, "co_qualname", code.co_name)
+        cached = _labels[code] = (f"{module}:{qualname}", _component(module, qualname))
+    return cached
+
+
+def collapse(frames: List) -> str:
+    """Root-first frames as one collapsed-stack line, prefixed with the component of the innermost matching frame."""
+    labels, component = [], None
+    for frame in frames[-MAX_DEPTH:]:
+        label, frame_component = _label(frame)
+        labels.append(label)
+        component = frame_component or component
+    return ";".join([component or "other"] + labels)
+
+
+def thread_frames(thread_id: int) -> List:
+    """Root-first frames currently executing in a thread."""
+    frame = sys._current_frames().get(thread_id)
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def task_frames(task: asyncio.Task) -> List:
+    """Root-first frames of a suspended task, following what each coroutine awaits."""
+    frames = []
+    awaitable = task.get_coro()
+    while awaitable is not None and len(frames) < MAX_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "ag_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "ag_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+    return frames
+
+
+def format_stack(frames: List) -> List[str]:
+    return [f"{frame.f_code.co_filename}:{frame.f_lineno} {getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)}"
+            for frame in frames]
+
+
+class Profile:
+    """Samples of one request (`profile_id_var` set) or of everything during a time window.
+
+    cpu: the event loop thread's stack while it runs Python code, "idle" while it waits for I/O.
+    wait: where each of the profile's tasks is suspended (awaiting vLLM, a tool, postgres, ...).
+    """
+
+    def __init__(self, kind: str, thread_id: Optional[str] = None) -> None:
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.thread_id = thread_id
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cpu: Counter = Counter()
+        self.wait: Counter = Counter()
+        self.samples = 0
+        self.lock = threading.Lock() # the sampler thread adds to the counters while requests read them
+
+    def add(self, cpu: Optional[str] = None, wait: Optional[str] = None) -> None:
+        with self.lock:
+            if cpu is not None:
+                self.cpu[cpu] += 1
+            if wait is not None:
+                self.wait[wait] += 1
+
+    def matches(self, task: Optional[asyncio.Task]) -> bool:
+        if self.kind == "window":
+            return True
+        return task is not None and task.get_context().get(profile_id_var) == self.id
+
+    def collapsed(self, mode: str = "cpu") -> str:
+        with self.lock:
+            counts = Counter(self.cpu if mode == "cpu" else self.wait)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+    def summary(self) -> Dict:
+        with self.lock:
+            cpu, wait = Counter(self.cpu), Counter(self.wait)
+        cpu_components = Counter()
+        for stack, count in cpu.items():
+            cpu_components[stack.split(";", 1)[0]] += count
+        busy = sum(count for component, count in cpu_components.items() if component != "idle")
+        return {"id": self.id, "kind": self.kind, "thread_id": self.thread_id, "started_at": self.started_at,
+                "duration_s": round((self.finished_at or time.time()) - self.started_at, 3), "samples": self.samples,
+                "cpu_samples": sum(cpu.values()), "wait_samples": sum(wait.values()),
+                "cpu_by_component": {component: round(count / busy, 3) for component, count in cpu_components.most_common()
+                                     if component != "idle"} if busy else {}}
+
+
+class SamplingProfiler:
+    """Stack sampler for the event loop, in a background thread that only runs while a profile is active.
+
+    Every `interval` seconds it reads the loop thread's stack (sys._current_frames) and,
+    every `wait_every` samples, the await chain of every task. Finished profiles are kept
+    in memory (`max_profiles`) and written to `output_dir` as collapsed stacks, the input
+    format of flamegraph.pl and speedscope. Work in worker threads (asyncio.to_thread) is
+    not sampled, and a request profile only sees tasks started for that request: the
+    history writer's flushes show up in window profiles.
+    """
+
+    def __init__(self, interval: float = 0.005, wait_every: int = 4, output_dir: str = "./profiles",
+                 max_profiles: int = 50, max_active: int = 4, token: Optional[str] = None,
+                 max_seconds: float = 60.0) -> None:
+        self.token = token
+        self.max_seconds = max_seconds
+        self.interval = interval
+        self.wait_every = wait_every
+        self.output_dir = output_dir
+        self.max_profiles = max_profiles
+        self.max_active = max_active
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._active: Dict[str, Profile] = {}
+        self._finished: "OrderedDict[str, Profile]" = OrderedDict()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._switch_interval: Optional[float] = None # the process' own, while profiles are active
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return self.enabled and token is not None and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def begin(self, kind: str = "window", thread_id: Optional[str] = None) -> Optional[Profile]:
+        """Start a profile from the event loop. None when `max_active` profiles already run."""
+        if len(self._active) >= self.max_active:
+            return None
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        profile = Profile(kind, thread_id)
+        with self._lock:
+            if not self._active:
+                # The sampler needs the GIL to read the loop's stack. With the default 5ms switch interval
+                # the loop thread mostly hands it over when it blocks in select(), so nearly every sample
+                # would land on an idle loop; a short interval while profiling makes samples land mid-code.
+                self._switch_interval = sys.getswitchinterval()
+                sys.setswitchinterval(min(self._switch_interval, self.interval / 10))
+            self._active[profile.id] = profile
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def end(self, profile: Profile) -> None:
+        with self._lock:
+            if self._active.pop(profile.id, None) is None:
+                return
+            if not self._active:
+                sys.setswitchinterval(self._switch_interval)
+            profile.finished_at = time.time()
+            self._finished[profile.id] = profile
+            while len(self._finished) > self.max_profiles:
+                self._finished.popitem(last=False)
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            for mode in ("cpu", "wait"):
+                with open(os.path.join(self.output_dir, f"{profile.id}-{mode}.collapsed"), "w", encoding="utf-8") as output:
+                    output.write(profile.collapsed(mode))
+        except OSError as e:
+            logger.warning(f"Could not write profile {profile.id}: {e!r}")
+        logger.info(f"Profile {profile.id} finished: {profile.summary()}")
+
+    async def window(self, seconds: float) -> Optional[Profile]:
+        profile = self.begin("window")
+        if profile is not None:
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                self.end(profile)
+        return profile
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self._finished.get(profile_id) or self._active.get(profile_id)
+
+    def profiles(self) -> List[Dict]:
+        return [profile.summary() for profile in [*self._active.values(), *reversed(self._finished.values())]]
+
+    def _sample(self, tick: int) -> None:
+        with self._lock:
+            profiles = list(self._active.values())
+        if not profiles:
+            return
+        frames = thread_frames(self._loop_thread)
+        running = getattr(asyncio.tasks, "_current_tasks", {}).get(self._loop)
+        loop_frames = [index for index, frame in enumerate(frames) if _label(frame)[0].startswith(_LOOP_FRAMES)]
+        if not frames or (running is None and loop_frames and loop_frames[-1] == len(frames) - 1):
+            stack = "idle"
+        else:
+            stack = collapse(frames[loop_frames[-1] + 1:] if loop_frames else frames)
+        for profile in profiles:
+            profile.samples += 1
+            if stack == "idle" and profile.kind != "window":
+                continue
+            if profile.matches(running) or stack == "idle":
+                profile.add(cpu=stack)
+
+        if tick % self.wait_every == 0:
+            try:
+                tasks = asyncio.all_tasks(self._loop)
+            except RuntimeError: # the task set changed while it was copied
+                return
+            for task in tasks:
+                if task is running or task.done():
+                    continue
+                matching = [profile for profile in profiles if profile.matches(task)]
+                if matching:
+                    stack = collapse(task_frames(task))
+                    for profile in matching:
+                        profile.add(wait=stack)
+
+    def _run(self) -> None:
+        tick = 0
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    break
+            try:
+                self._sample(tick)
+            except Exception as e: # frames and tasks change under the sampler, never let it die silently
+                logger.debug(f"Profiler sample failed: {e!r}")
+            tick += 1
+            time.sleep(self.interval)
+
+
+class LoopStallMonitor:
+    """Watchdog thread for the event loop.
+
+    The health prober's lag monitor calls beat() every `beat_interval` seconds. When no
+    beat came for `threshold` seconds beyond that, something is holding the loop (a
+    blocking call, a long CPU-bound step) and the loop thread's stack is captured while
+    it is still stuck. The stall is logged with that stack once the loop runs again.
+    """
+
+    def __init__(self, threshold: float = 0.25, beat_interval: float = 0.1, max_stalls: int = 50) -> None:
+        self.threshold = threshold
+        self.beat_interval = beat_interval
+        self.stalls: deque = deque(maxlen=max_stalls)
+        self._last_beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def beat(self) -> None:
+        self._last_beat = time.monotonic()
+
+    def _run(self) -> None:
+        stall = None
+        while not self._stop.wait(self.threshold / 4):
+            behind = time.monotonic() - self._last_beat - self.beat_interval
+            if stall is None and behind > self.threshold:
+                frames = thread_frames(self._loop_thread)
+                stack = format_stack(frames)
+                stall = {"detected_at": time.time(), "where": stack[-1] if stack else None, "stack": stack,
+                         "collapsed": collapse(frames), "last_beat": self._last_beat}
+            elif stall is not None and stall["last_beat"] != self._last_beat:
+                duration = self._last_beat - stall.pop("last_beat") - self.beat_interval
+                stall["duration_ms"] = round(duration * 1000, 1)
+                self.stalls.append(stall)
+                LOOP_STALLS.inc()
+                LOOP_STALL_DURATION.observe(duration)
+                logger.warning(f"Event loop blocked for {stall['duration_ms']} ms in:\n" + "\n".join(stall["stack"][-15:]))
+                stall = None
+
+    def start(self) -> None:
+        """Call from the event loop thread."""
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="loop-stall-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def recent(self) -> List[Dict]:
+        return list(reversed(self.stalls))
+
+
+def build_profiler() -> SamplingProfiler:
+    """PROFILER_TOKEN (without it profiling is off), PROFILER_INTERVAL_MS, PROFILER_OUTPUT_DIR,
+    PROFILER_MAX_PROFILES, PROFILER_MAX_SECONDS."""
+    return SamplingProfiler(interval=float(os.getenv("PROFILER_INTERVAL_MS", 5)) / 1000,
+                            output_dir=os.getenv("PROFILER_OUTPUT_DIR", "./profiles"),
+                            max_profiles=int(os.getenv("PROFILER_MAX_PROFILES", 50)),
+                            token=os.getenv("PROFILER_TOKEN") or None,
+                            max_seconds=float(os.getenv("PROFILER_MAX_SECONDS", 60)))
+
+
+profiler = build_profiler()
@@ -0,0 +1,179 @@
+import asyncio
+import gc
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Callable, Dict, List, Optional
+
+import psutil
+
+from metrics import SESSION_THREADS, SESSION_EVICTIONS, SESSION_RELOADS
+
+logger = logging.getLogger(__name__)
+
+
+class SessionManager:
+    """Tracks the last activity of every thread_id and bounds the per-thread state kept in memory.
+
+    Each module holding per-thread state (checkpointer hot cache, context assembler,
+    history serializer, router affinity, ...) registers a `forget(thread_id)` hook.
+    A background sweep evicts threads idle for more than `idle_timeout` seconds, the
+    least recently used ones above `max_threads`, and the oldest `pressure_fraction`
+    of threads while the process RSS is above `max_rss_bytes`. Threads running a
+    graph execution are never evicted.
+
+    The checkpoints stay in postgres unless `delete_checkpoints` is set; then idle
+    threads also lose them (pending reviews older than `idle_timeout` are abandoned)
+    and their next turn starts from the transcript in agent_history.
+    """
+
+    def __init__(self, max_threads: int = 10_000, idle_timeout: float = 1800.0, max_rss_bytes: Optional[int] = None,
+                 interval: float = 30.0, pressure_fraction: float = 0.1, delete_checkpoints: bool = False,
+                 reload_messages: int = 50) -> None:
+        self.max_threads = max_threads
+        self.idle_timeout = idle_timeout
+        self.max_rss_bytes = max_rss_bytes
+        self.interval = interval
+        self.pressure_fraction = pressure_fraction
+        self.delete_checkpoints = delete_checkpoints
+        self.reload_messages = reload_messages
+        self._last_active: "OrderedDict[str, float]" = OrderedDict() # thread_id -> monotonic time, LRU order
+        self._hooks: List[Callable[[str], None]] = []
+        self._delete: Optional[Callable] = None # async (thread_id) -> None
+        self._has_checkpoint: Optional[Callable] = None # async (thread_id) -> bool
+        self._transcript: Optional[Callable] = None # async (thread_id, limit) -> [{"role", "content"}]
+        self._is_busy: Callable[[str], bool] = lambda thread_id: False
+        self._thread_lock: Callable = lambda thread_id: nullcontext() # async context manager, no turn runs inside it
+        self._process = psutil.Process()
+        self._task: Optional[asyncio.Task] = None
+        self.counts = {"evicted_idle": 0, "evicted_threads": 0, "evicted_memory": 0, "deleted": 0, "reloaded": 0}
+
+    def register(self, *hooks: Callable[[str], None]) -> None:
+        """Per-thread in-memory state to drop when a thread is evicted."""
+        self._hooks.extend(hooks)
+
+    def configure(self, is_busy: Callable[[str], bool], has_checkpoint: Callable, transcript: Callable,
+                  delete: Callable, thread_lock: Optional[Callable] = None) -> None:
+        self._is_busy = is_busy
+        self._thread_lock = thread_lock or self._thread_lock
+        self._has_checkpoint = has_checkpoint
+        self._transcript = transcript
+        self._delete = delete
+
+    def touch(self, thread_id: str) -> None:
+        self._last_active[thread_id] = time.monotonic()
+        self._last_active.move_to_end(thread_id)
+        SESSION_THREADS.set(len(self._last_active))
+
+    async def restore(self, thread_id: str, messages: List[Dict]) -> List[Dict]:
+        """Input messages for a new turn: prefixed with the thread's transcript when its checkpoints were deleted."""
+        if not self.delete_checkpoints or self._has_checkpoint is None or await self._has_checkpoint(thread_id):
+            return messages
+        transcript = await self._transcript(thread_id, self.reload_messages)
+        if not transcript:
+            return messages
+        self.counts["reloaded"] += 1
+        SESSION_RELOADS.inc()
+        logger.info(f"Reloaded thread {thread_id} from {len(transcript)} agent_history rows")
+        return transcript + list(messages)
+
+    def rss_bytes(self) -> int:
+        return self._process.memory_info().rss
+
+    def _forget(self, thread_id: str) -> None:
+        self._last_active.pop(thread_id, None)
+        for hook in self._hooks:
+            try:
+                hook(thread_id)
+            except Exception as e:
+                logger.warning(f"Evicting {thread_id} from {hook!r} failed: {e!r}")
+
+    def _evictable(self, thread_ids) -> List[str]:
+        return [thread_id for thread_id in thread_ids if not self._is_busy(thread_id)]
+
+    async def sweep(self) -> Dict[str, int]:
+        """One eviction pass. Returns how many threads were evicted for which reason."""
+        evicted = {"idle": 0, "threads": 0, "memory": 0}
+        now = time.monotonic()
+
+        idle = [thread_id for thread_id, last in self._last_active.items() if now - last > self.idle_timeout]
+        for thread_id in idle:
+            # deletes below yield to the loop: a turn may have started on this thread since the list was made
+            last = self._last_active.get(thread_id)
+            if last is None or time.monotonic() - last <= self.idle_timeout or self._is_busy(thread_id):
+                continue
+            self._forget(thread_id)
+            evicted["idle"] += 1
+            if self.delete_checkpoints and self._delete is not None:
+                try:
+                    async with self._thread_lock(thread_id):
+                        if thread_id in self._last_active: # a request arrived while waiting, the thread lives on
+                            continue
+                        await self._delete(thread_id)
+                    self.counts["deleted"] += 1
+                except Exception as e:
+                    logger.warning(f"Deleting checkpoints of {thread_id} failed: {e!r}")
+
+        over = len(self._last_active) - self.max_threads
+        if over > 0:
+            for thread_id in self._evictable(list(self._last_active))[:over]:
+                self._forget(thread_id)
+                evicted["threads"] += 1
+
+        rss = self.rss_bytes()
+        if self.max_rss_bytes is not None and rss > self.max_rss_bytes and self._last_active:
+            count = max(1, int(len(self._last_active) * self.pressure_fraction))
+            for thread_id in self._evictable(list(self._last_active))[:count]:
+                self._forget(thread_id)
+                evicted["memory"] += 1
+        if evicted["memory"]:
+            gc.collect()
+            rss = self.rss_bytes()
+            logger.warning(f"RSS above {self.max_rss_bytes >> 20} MiB, evicted {evicted['memory']} threads, now {rss >> 20} MiB")
+
+        for reason, count in evicted.items():
+            if count:
+                self.counts[f"evicted_{reason}"] += count
+                SESSION_EVICTIONS.labels(reason).inc(count)
+        SESSION_THREADS.set(len(self._last_active))
+        return evicted
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                evicted = await self.sweep()
+                if any(evicted.values()):
+                    logger.info(f"Session sweep evicted {evicted}, {len(self._last_active)} threads active")
+            except Exception as e:
+                logger.warning(f"Session sweep failed: {e!r}")
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop(), name="session-sweep")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {"threads": len(self._last_active), "rss_bytes": self.rss_bytes(), **self.counts}
+
+
+def build_session_manager() -> SessionManager:
+    """SESSION_MAX_THREADS, SESSION_IDLE_TIMEOUT, SESSION_MAX_RSS_MB, SESSION_SWEEP_INTERVAL,
+    SESSION_DELETE_CHECKPOINTS, SESSION_RELOAD_MESSAGES."""
+    max_rss_mb = os.getenv("SESSION_MAX_RSS_MB")
+    return SessionManager(max_threads=int(os.getenv("SESSION_MAX_THREADS", 10_000)),
+                          idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", 1800)),
+                          max_rss_bytes=int(max_rss_mb) << 20 if max_rss_mb else None,
+                          interval=float(os.getenv("SESSION_SWEEP_INTERVAL", 30)),
+                          delete_checkpoints=os.getenv("SESSION_DELETE_CHECKPOINTS", "false").lower() == "true",
+                          reload_messages=int(os.getenv("SESSION_RELOAD_MESSAGES", 50)))
+
+
+sessions = build_session_manager()
@@ -0,0 +1,201 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from fnmatch import fnmatch
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+APPROVE = "approve"
+REVIEW = "review"
+
+
+class PolicyError(ValueError):
+    pass
+
+
+class _ArgCondition:
+    """Checks on one tool argument: match / not_match (regex), max_length, min / max, in."""
+
+    KEYS = {"match", "not_match", "max_length", "min", "max", "in"}
+
+    def __init__(self, name: str, spec: Dict[str, Any]) -> None:
+        unknown = set(spec) - self.KEYS
+        if unknown:
+            raise PolicyError(f"argument {name}: unknown checks {sorted(unknown)}")
+        self.name = name
+        self.match = re.compile(spec["match"]) if "match" in spec else None
+        self.not_match = re.compile(spec["not_match"]) if "not_match" in spec else None
+        self.max_length = spec.get("max_length")
+        self.min = spec.get("min")
+        self.max = spec.get("max")
+        self.allowed = spec.get("in")
+
+    def check(self, args: Dict[str, Any]) -> Optional[str]:
+        """None when the argument passes, else why not."""
+        if self.name not in args:
+            return None if self.match is None and self.allowed is None else f"{self.name} missing"
+        value = args[self.name]
+        text = value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+        if self.match is not None and not self.match.search(text):
+            return f"{self.name} does not match {self.match.pattern}"
+        if self.not_match is not None and self.not_match.search(text):
+            return f"{self.name} matches {self.not_match.pattern}"
+        if self.max_length is not None and len(text) > self.max_length:
+            return f"{self.name} longer than {self.max_length}"
+        if self.allowed is not None and value not in self.allowed:
+            return f"{self.name} not in allowed values"
+        if self.min is not None or self.max is not None:
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return f"{self.name} is not a number"
+            if (self.min is not None and value < self.min) or (self.max is not None and value > self.max):
+                return f"{self.name} out of range"
+        return None
+
+
+class ApprovalRule:
+    """One policy rule. All given conditions must hold; the first matching rule decides.
+
+    tools: tool name globs. args: {argument: checks}. threads: regexes on the thread_id,
+    which the client picks, so only in review rules. tenants: verified tenant ids (see
+    ApprovalPolicy). max_per_thread: auto-approvals of this rule per thread, after which
+    the next rules (or the default) apply.
+    """
+
+    KEYS = {"name", "tools", "args", "threads", "tenants", "action", "max_per_thread"}
+
+    def __init__(self, spec: Dict[str, Any], index: int) -> None:
+        unknown = set(spec) - self.KEYS
+        if unknown:
+            raise PolicyError(f"rule {index}: unknown keys {sorted(unknown)}")
+        self.name = spec.get("name") or f"rule-{index}"
+        self.tools = spec.get("tools") or ["*"]
+        self.args = [_ArgCondition(name, checks) for name, checks in (spec.get("args") or {}).items()]
+        self.threads = [re.compile(pattern) for pattern in spec.get("threads") or []]
+        self.tenants = set(spec.get("tenants") or [])
+        self.action = spec.get("action", APPROVE)
+        if self.action not in (APPROVE, REVIEW):
+            raise PolicyError(f"rule {self.name}: action must be {APPROVE} or {REVIEW}")
+        if self.threads and self.action == APPROVE:
+            raise PolicyError(f"rule {self.name}: threads can only select calls for {REVIEW}, any client can pick a thread_id")
+        self.max_per_thread = spec.get("max_per_thread")
+
+    def matches(self, tool_call: Dict[str, Any], thread_id: Optional[str], tenant: Optional[str]) -> bool:
+        if not any(fnmatch(tool_call.get("name", ""), pattern) for pattern in self.tools):
+            return False
+        if self.threads and not any(pattern.search(thread_id or "") for pattern in self.threads):
+            return False
+        if self.tenants and tenant not in self.tenants:
+            return False
+        args = tool_call.get("args") or {}
+        if isinstance(args.get("properties"), dict): # llama3_json sometimes nests the args
+            args = args["properties"]
+        return all(condition.check(args) is None for condition in self.args)
+
+
+class Decision:
+    __slots__ = ("action", "rule", "tool")
+
+    def __init__(self, action: str, rule: Optional[str], tool: str) -> None:
+        self.action = action
+        self.rule = rule
+        self.tool = tool
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"action": self.action, "rule": self.rule, "tool": self.tool}
+
+
+class ApprovalPolicy:
+    """Decides before interrupt() whether a tool call needs a human.
+
+    A message is auto-approved only when every one of its tool calls is, since the
+    tool node runs them all. Budgets are counted per process, which is where a
+    thread's turns run (see idempotency.py). The tenant rules match on is never read
+    from the request body: the authenticating proxy sends it in X-Tenant-Id, signed
+    with `tenant_secret` in X-Tenant-Signature (hex HMAC-SHA256). Without a secret no
+    request has a tenant and tenant rules never match.
+    """
+
+    def __init__(self, rules: List[ApprovalRule], default: str = REVIEW, max_threads: int = 10_000,
+                 tenant_secret: Optional[str] = None) -> None:
+        if default not in (APPROVE, REVIEW):
+            raise PolicyError(f"default must be {APPROVE} or {REVIEW}")
+        self.rules = rules
+        self.default = default
+        self.tenant_secret = tenant_secret
+        self.max_threads = max_threads
+        self._used: "OrderedDict[str, Dict[str, int]]" = OrderedDict() # thread_id -> rule -> auto-approvals
+
+    @classmethod
+    def from_dict(cls, spec: Dict[str, Any], tenant_secret: Optional[str] = None) -> "ApprovalPolicy":
+        return cls([ApprovalRule(rule, index) for index, rule in enumerate(spec.get("rules") or [])],
+                   default=spec.get("default", REVIEW), tenant_secret=tenant_secret)
+
+    @classmethod
+    def from_file(cls, path: str, tenant_secret: Optional[str] = None) -> "ApprovalPolicy":
+        with open(path, encoding="utf-8") as policy_file:
+            if path.endswith((".yaml", ".yml")):
+                import yaml
+                spec = yaml.safe_load(policy_file)
+            else:
+                spec = json.load(policy_file)
+        return cls.from_dict(spec or {}, tenant_secret)
+
+    def verified_tenant(self, tenant_id: Optional[str], signature: Optional[str]) -> Optional[str]:
+        """`tenant_id` when `signature` is its HMAC under `tenant_secret`, else None."""
+        if not self.tenant_secret or not tenant_id or not signature:
+            return None
+        expected = hmac.new(self.tenant_secret.encode(), tenant_id.encode(), hashlib.sha256).hexdigest()
+        return tenant_id if hmac.compare_digest(expected, signature.lower()) else None
+
+    def _used_by(self, thread_id: str) -> Dict[str, int]:
+        used = self._used.get(thread_id)
+        if used is None:
+            used = self._used[thread_id] = {}
+            while len(self._used) > self.max_threads:
+                self._used.popitem(last=False)
+        self._used.move_to_end(thread_id)
+        return used
+
+    def _decide_one(self, tool_call: Dict[str, Any], thread_id: Optional[str], tenant: Optional[str],
+                    used: Dict[str, int]) -> Decision:
+        for rule in self.rules:
+            if not rule.matches(tool_call, thread_id, tenant):
+                continue
+            if rule.action == APPROVE and rule.max_per_thread is not None and used.get(rule.name, 0) >= rule.max_per_thread:
+                continue # budget spent, fall through
+            if rule.action == APPROVE:
+                used[rule.name] = used.get(rule.name, 0) + 1
+            return Decision(rule.action, rule.name, tool_call.get("name"))
+        return Decision(self.default, None, tool_call.get("name"))
+
+    def decide(self, tool_calls: List[Dict[str, Any]], thread_id: Optional[str] = None,
+               tenant: Optional[str] = None) -> Tuple[bool, List[Decision]]:
+        """(approved, per-call decisions). Budgets are only charged when the whole message is approved."""
+        used = dict(self._used.get(thread_id, {})) if thread_id is not None else {}
+        decisions = [self._decide_one(tool_call, thread_id, tenant, used) for tool_call in tool_calls]
+        approved = bool(decisions) and all(decision.action == APPROVE for decision in decisions)
+        if approved and thread_id is not None:
+            self._used_by(thread_id).update(used)
+        return approved, decisions
+
+    def stats(self) -> Dict[str, int]:
+        return {"rules": len(self.rules), "threads_tracked": len(self._used)}
+
+
+def build_approval_policy() -> Optional[ApprovalPolicy]:
+    """APPROVAL_POLICY_FILE (JSON or YAML), APPROVAL_TENANT_SECRET (tenant rules off without it).
+    Without a policy file every tool call goes to human review."""
+    path = os.getenv("APPROVAL_POLICY_FILE")
+    if not path:
+        return None
+    policy = ApprovalPolicy.from_file(path, tenant_secret=os.getenv("APPROVAL_TENANT_SECRET") or None)
+    logger.info(f"Loaded approval policy {path}: {len(policy.rules)} rules, default {policy.default}")
+    return policy
+
+
+approval_policy = build_approval_policy()
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+
+import database.models as models
+from database.db import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+def normalize_query(query: str) -> str:
+    """Case, whitespace and trailing punctuation do not change a search."""
+    return re.sub(r"\s+", " ", query).strip().strip("?!.").strip().lower()
+
+
+def cache_key(tool_name: str, args: Dict[str, Any]) -> str:
+    normalized = {key: normalize_query(value) if key == "query" and isinstance(value, str) else value
+                  for key, value in args.items()}
+    payload = json.dumps([tool_name, normalized], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class PostgresCacheBackend:
+    """Shared cache table so several app workers reuse each other's results.
+    Expired rows are deleted by the writes, at most once per `purge_interval` seconds."""
+
+    def __init__(self, session_factory, purge_interval: float = 600.0) -> None:
+        self.session_factory = session_factory
+        self.purge_interval = purge_interval
+        self._next_purge = 0.0
+
+    async def get(self, key: str) -> Any:
+        async with self.session_factory() as db:
+            row = (await db.execute(select(models.ToolCacheEntry.value).where(
+                models.ToolCacheEntry.key == key,
+                models.ToolCacheEntry.expires_at > datetime.now(timezone.utc)))).scalar()
+        return _MISSING if row is None else json.loads(row)
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        expires_at = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        stmt = insert(models.ToolCacheEntry).values(key=key, value=json.dumps(value), expires_at=expires_at)
+        stmt = stmt.on_conflict_do_update(index_elements=["key"],
+                                          set_={"value": stmt.excluded.value, "expires_at": stmt.excluded.expires_at})
+        async with self.session_factory() as db:
+            await db.execute(stmt)
+            await db.commit()
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + self.purge_interval
+            await self.purge_expired()
+
+    async def purge_expired(self) -> int:
+        async with self.session_factory() as db:
+            result = await db.execute(delete(models.ToolCacheEntry).where(
+                models.ToolCacheEntry.expires_at <= datetime.now(timezone.utc)))
+            await db.commit()
+        if result.rowcount:
+            logger.info(f"Purged {result.rowcount} expired tool_cache rows")
+        return result.rowcount
+
+
+class ToolResultCache:
+    """TTL + size bounded LRU of tool results with single-flight de-duplication.
+
+    Concurrent calls with the same key share one in-flight request. An optional
+    shared backend is consulted on local misses and filled on computes.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1024, backend: Optional[PostgresCacheBackend] = None) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _get_local(self, key: str) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return _MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: Any) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_compute(self, tool_name: str, args: Dict[str, Any], compute: Callable[[], Awaitable[Any]]) -> Any:
+        key = cache_key(tool_name, args)
+
+        value = self._get_local(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            # the cache owns the computation: a caller cancelled by its timeout (or a discarded
+            # speculative run) only stops waiting, the other callers still get the result
+            future = self._inflight[key] = asyncio.get_running_loop().create_future()
+            task = asyncio.create_task(self._fill(key, future, compute), name=f"tool-cache-{tool_name}")
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(future)
+
+    async def _fill(self, key: str, future: asyncio.Future, compute: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            value = await self._lookup_shared(key)
+            if value is not _MISSING:
+                self.shared_hits += 1
+            else:
+                self.misses += 1
+                value = await compute()
+                await self._store_shared(key, value)
+            self._set_local(key, value)
+            future.set_result(value)
+        except BaseException as e: # never cancel the shared future, waiters would see a CancelledError
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("tool call cancelled"))
+            future.exception() # no "never retrieved" warning when nobody waits any more
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            del self._inflight[key]
+
+    async def _lookup_shared(self, key: str) -> Any:
+        if self.backend is None:
+            return _MISSING
+        try:
+            return await self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"Shared tool cache lookup failed: {e!r}")
+            return _MISSING
+
+    async def _store_shared(self, key: str, value: Any) -> None:
+        if self.backend is None:
+            return
+        try:
+            await self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"Shared tool cache store failed: {e!r}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "hits": self.hits, "shared_hits": self.shared_hits,
+                "misses": self.misses, "coalesced": self.coalesced, "evictions": self.evictions}
+
+
+def build_tool_cache() -> ToolResultCache:
+    """Configured from TOOL_CACHE_TTL, TOOL_CACHE_MAX_ENTRIES and TOOL_CACHE_BACKEND (memory|postgres)."""
+    backend = None
+    if os.getenv("TOOL_CACHE_BACKEND", "memory") == "postgres":
+        backend = PostgresCacheBackend(AsyncSessionLocal)
+    return ToolResultCache(ttl=float(os.getenv("TOOL_CACHE_TTL", 300)),
+                           max_entries=int(os.getenv("TOOL_CACHE_MAX_ENTRIES", 1024)),
+                           backend=backend)
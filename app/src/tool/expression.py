@@ -0,0 +1,192 @@
+import ast
+import math
+import operator
+from functools import lru_cache, reduce
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+MAX_EXPRESSION_CHARS = 2000
+MAX_NODES = 300
+MAX_DEPTH = 40
+MAX_EXPONENT = 10_000
+MAX_RESULT_BITS = 13_000 # integer results above ~3900 digits are refused (json/str() stop at 4300 digits)
+MAX_ARRAY_SIZE = 1_000_000
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+def _min(*args):
+    return np.min(args[0]) if len(args) == 1 else reduce(np.minimum, args)
+
+
+def _max(*args):
+    return np.max(args[0]) if len(args) == 1 else reduce(np.maximum, args)
+
+
+def _pow(base, exponent):
+    """Exponentiation with a cost bound: no 9**9**9 or 2**10**8."""
+    if isinstance(base, int) and isinstance(exponent, int):
+        if abs(exponent) > MAX_EXPONENT and abs(base) > 1:
+            raise ExpressionError(f"exponent {exponent} is too large")
+        if exponent > 0 and abs(base) > 1 and exponent * math.log2(abs(base)) > MAX_RESULT_BITS:
+            raise ExpressionError("result is too large")
+        return base ** exponent
+    if np.max(np.abs(exponent)) > MAX_EXPONENT:
+        raise ExpressionError("exponent is too large")
+    return np.power(np.asarray(base, dtype=float), exponent)
+
+
+# whitelisted names; numpy ufuncs work on scalars and arrays alike
+FUNCTIONS = {
+    "abs": np.abs, "sqrt": np.sqrt, "exp": np.exp, "log": np.log, "log10": np.log10, "log2": np.log2,
+    "sin": np.sin, "cos": np.cos, "tan": np.tan, "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan,
+    "floor": np.floor, "ceil": np.ceil, "round": np.round,
+    "min": _min, "max": _max, "sum": np.sum, "mean": np.mean, "median": np.median, "std": np.std, "var": np.var,
+    "pow": _pow,
+}
+CONSTANTS = {"pi": math.pi, "e": math.e}
+
+_BINARY = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+           ast.FloorDiv: operator.floordiv, ast.Mod: operator.mod, ast.Pow: _pow}
+_UNARY = (ast.UAdd, ast.USub)
+
+
+class _Validator(ast.NodeVisitor):
+    """Rejects anything that is not arithmetic on numbers, known names and whitelisted calls."""
+
+    def __init__(self) -> None:
+        self.nodes = 0
+        self.depth = 0
+        self.names = set()
+
+    def visit(self, node):
+        self.nodes += 1
+        self.depth += 1
+        if self.nodes > MAX_NODES or self.depth > MAX_DEPTH:
+            raise ExpressionError("expression is too complex")
+        try:
+            return super().visit(node)
+        finally:
+            self.depth -= 1
+
+    def visit_Expression(self, node):
+        self.visit(node.body)
+
+    def visit_BinOp(self, node):
+        if type(node.op) not in _BINARY:
+            raise ExpressionError(f"operator {type(node.op).__name__} is not allowed")
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_UnaryOp(self, node):
+        if not isinstance(node.op, _UNARY):
+            raise ExpressionError(f"operator {type(node.op).__name__} is not allowed")
+        self.visit(node.operand)
+
+    def visit_Constant(self, node):
+        if type(node.value) not in (int, float):
+            raise ExpressionError("only numeric literals are allowed")
+
+    def visit_Name(self, node):
+        if node.id.startswith("_"):
+            raise ExpressionError(f"name {node.id} is not allowed")
+        if node.id in FUNCTIONS:
+            raise ExpressionError(f"{node.id} must be called")
+        self.names.add(node.id)
+
+    def visit_Call(self, node):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS or node.keywords:
+            raise ExpressionError("only calls to whitelisted functions are allowed")
+        for arg in node.args:
+            self.visit(arg)
+
+    def generic_visit(self, node):
+        raise ExpressionError(f"{type(node).__name__} is not allowed")
+
+
+class _PowToCall(ast.NodeTransformer):
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if isinstance(node.op, ast.Pow):
+            return ast.copy_location(ast.Call(func=ast.Name("_pow", ast.Load()), args=[node.left, node.right], keywords=[]), node)
+        return node
+
+
+@lru_cache(maxsize=4096)
+def compile_expression(expression: str) -> Tuple[Any, frozenset]:
+    """Validate once, keep the code object. Returns (code, free variable names)."""
+    if len(expression) > MAX_EXPRESSION_CHARS:
+        raise ExpressionError("expression is too long")
+    try:
+        tree = ast.parse(expression.strip().replace("^", "**"), mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"invalid expression: {e.msg}") from None
+    except (RecursionError, MemoryError):
+        raise ExpressionError("expression is too complex") from None
+    validator = _Validator()
+    validator.visit(tree)
+    tree = ast.fix_missing_locations(_PowToCall().visit(tree))
+    variables = frozenset(name for name in validator.names if name not in FUNCTIONS and name not in CONSTANTS)
+    return compile(tree, "<expression>", "eval"), variables
+
+
+def _to_python(value):
+    if isinstance(value, np.ndarray):
+        return [_to_python(item) for item in value.tolist()] if value.ndim else _to_python(value.item())
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, int) and value.bit_length() > MAX_RESULT_BITS: # e.g. 10**3000 * 10**3000
+        raise ExpressionError("result is too large")
+    return value
+
+
+def _namespace(variables: Dict[str, Any]) -> Dict[str, Any]:
+    return {"__builtins__": {}, "_pow": _pow, **FUNCTIONS, **CONSTANTS, **variables}
+
+
+def evaluate(expression: str, variables: Optional[Dict[str, Any]] = None):
+    """Evaluate one expression. Array-valued variables evaluate element-wise through NumPy in one pass."""
+    code, names = compile_expression(expression)
+    variables = variables or {}
+    missing = names - variables.keys()
+    if missing:
+        raise ExpressionError(f"unknown names: {', '.join(sorted(missing))}")
+
+    arrays = {}
+    for name in names:
+        value = variables[name]
+        if isinstance(value, (list, tuple)):
+            value = np.asarray(value, dtype=float)
+            if value.size > MAX_ARRAY_SIZE:
+                raise ExpressionError(f"{name} has more than {MAX_ARRAY_SIZE} values")
+        elif not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ExpressionError(f"{name} must be a number or a list of numbers")
+        arrays[name] = value
+
+    vectorized = any(isinstance(value, np.ndarray) for value in arrays.values())
+    # element-wise errors (1/0, log(-1)) become null in vector mode instead of failing the whole batch
+    with np.errstate(all="ignore" if vectorized else "raise"):
+        try:
+            result = eval(code, _namespace(arrays))
+        except ExpressionError:
+            raise
+        # ArithmeticError: 1/0, overflow; TypeError / IndexError: wrong arity such as min() or sqrt(1, 2)
+        except (ArithmeticError, ValueError, TypeError, IndexError) as e:
+            raise ExpressionError(str(e) or type(e).__name__) from None
+    return _to_python(result)
+
+
+def evaluate_many(expressions: Sequence[str], variables: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Evaluate a batch; one failing expression does not fail the others."""
+    results = []
+    for expression in expressions:
+        try:
+            results.append({"expression": expression, "result": evaluate(expression, variables)})
+        except ExpressionError as e:
+            results.append({"expression": expression, "error": str(e)})
+    return results
@@ -0,0 +1,96 @@
+import json
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import (
+    HumanMessage,
+    AIMessage,
+    SystemMessage,
+    ToolMessage,
+    BaseMessage,
+)
+
+
+def compact_message(msg: BaseMessage) -> Optional[Dict]:
+    """Wire form sent to think_step: role and content only, no additional_kwargs/response_metadata."""
+    if isinstance(msg, SystemMessage):
+        return {"role": "system", "content": msg.content}
+    elif isinstance(msg, HumanMessage):
+        return {"role": "user", "content": msg.content}
+    elif isinstance(msg, AIMessage):
+        compact = {"role": "assistant", "content": msg.content}
+        if msg.tool_calls:
+            compact["tool_calls"] = [{"name": call["name"], "args": call["args"]} for call in msg.tool_calls]
+        return compact
+    elif isinstance(msg, ToolMessage):
+        return {"role": "tool", "content": msg.content, "name": msg.name, "tool_call_id": msg.tool_call_id}
+    return None
+
+
+class HistorySerializer:
+    """JSON encoding of a thread's history, built incrementally.
+
+    Each message is encoded once (cached by message id) and the encoded history of a
+    thread is kept as a prefix string, so a new step only encodes and appends the
+    messages added since the previous one.
+    """
+
+    def __init__(self, max_messages: int = 100_000, max_threads: int = 1024) -> None:
+        self.max_messages = max_messages
+        self.max_threads = max_threads
+        self._fragments: "OrderedDict[str, Tuple[BaseMessage, str]]" = OrderedDict()
+        # thread_id -> (messages already encoded, fragments, "[frag,frag,...")
+        self._threads: "OrderedDict[str, Tuple[List[BaseMessage], List[str], str]]" = OrderedDict()
+
+    def forget(self, thread_id: str) -> None:
+        self._threads.pop(thread_id, None)
+
+    def _fragment(self, msg: BaseMessage) -> Optional[str]:
+        if msg.id is not None and (cached := self._fragments.get(msg.id)) is not None:
+            cached_msg, fragment = cached
+            if cached_msg is msg or cached_msg == msg: # "update" reviews replace a message keeping its id
+                return fragment
+
+        compact = compact_message(msg)
+        fragment = json.dumps(compact) if compact is not None else None
+        if msg.id is not None and fragment is not None:
+            self._fragments[msg.id] = (msg, fragment)
+            if len(self._fragments) > self.max_messages:
+                self._fragments.popitem(last=False)
+        return fragment
+
+    def encode_prefix(self, messages: Sequence[BaseMessage], thread_id: Optional[str] = None) -> str:
+        """Returns the history as an unterminated JSON array ("[a,b,c") ready to be extended."""
+        cached = self._threads.get(thread_id) if thread_id is not None else None
+        if cached is not None:
+            encoded, fragments, prefix = cached
+            keep = 0
+            limit = min(len(encoded), len(messages))
+            while keep < limit and (encoded[keep] is messages[keep] or encoded[keep] == messages[keep]):
+                keep += 1
+            if keep < len(encoded): # history was rewritten, rebuild from the common part
+                fragments = fragments[:keep]
+                prefix = "[" + ",".join(fragment for fragment in fragments if fragment is not None)
+        else:
+            keep, fragments, prefix = 0, [], "["
+
+        new_fragments = [self._fragment(msg) for msg in messages[keep:]]
+        appended = ",".join(fragment for fragment in new_fragments if fragment is not None)
+        if appended:
+            prefix = prefix + ("," if len(prefix) > 1 else "") + appended
+        fragments = fragments + new_fragments
+
+        if thread_id is not None:
+            self._threads[thread_id] = (list(messages), fragments, prefix)
+            self._threads.move_to_end(thread_id)
+            if len(self._threads) > self.max_threads:
+                self._threads.popitem(last=False)
+        return prefix
+
+    @staticmethod
+    def extend(prefix: str, *messages: Dict) -> str:
+        """Closes an encoded prefix with extra (already compact) messages appended."""
+        extra = ",".join(json.dumps(message) for message in messages)
+        if extra:
+            return prefix + ("," if len(prefix) > 1 else "") + extra + "]"
+        return prefix + "]"
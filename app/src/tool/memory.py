@@ -0,0 +1,536 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from database.crud import async_db_history_since, async_db_search_history, ensure_history_fts_index
+from metrics import MEMORY_DOCS, MEMORY_QUERY_DURATION, MEMORY_MERGE_DURATION
+
+logger = logging.getLogger(__name__)
+
+INDEXED_TYPES = ("user", "assistant", "tool") # not system prompts, interrupts or approval audit rows
+MAX_TERM_BYTES = 24 # longer tokens are truncated, on both the index and the query side
+TERM_DTYPE = f"S{MAX_TERM_BYTES}"
+SNAPSHOT_VERSION = 1
+
+_TOKEN = re.compile(r"\w+")
+STOPWORDS = frozenset("""a an and are as at be but by can did do does for from had has have he her his how i if in into is it
+its me my no not of on or our she so than that the their them then there these they this to was we were what when where which
+who why will with would you your""".split())
+
+
+def tokenize(text: str) -> List[bytes]:
+    return [token.encode()[:MAX_TERM_BYTES] for token in _TOKEN.findall(text.lower())
+            if token not in STOPWORDS and (len(token) > 1 or token.isdigit())]
+
+
+def _counts(tokens: Sequence[bytes]) -> Dict[bytes, int]:
+    counts: Dict[bytes, int] = {}
+    for token in tokens:
+        counts[token] = counts.get(token, 0) + 1
+    return counts
+
+
+class _Delta:
+    """In-memory segment new rows are added to. Doc ids are local to the segment; once frozen it is never changed."""
+
+    def __init__(self) -> None:
+        self.postings: Dict[bytes, Tuple[array, array]] = {} # term -> (doc ids, term frequencies)
+        self.lengths = array("I")
+        self.threads = array("I")
+        self.times = array("d")
+        self.types = array("B")
+        self.texts: List[bytes] = []
+        self.total_length = 0
+        self._meta: Optional[Dict[str, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, tokens: List[bytes], thread: int, created: float, type_code: int, text: bytes) -> None:
+        doc = len(self.lengths)
+        for term, tf in _counts(tokens).items():
+            entry = self.postings.get(term)
+            if entry is None:
+                entry = self.postings[term] = (array("I"), array("H"))
+            entry[0].append(doc)
+            entry[1].append(min(tf, 65535))
+        self.lengths.append(len(tokens))
+        self.threads.append(thread)
+        self.times.append(created)
+        self.types.append(type_code)
+        self.texts.append(text)
+        self.total_length += len(tokens)
+        self._meta = None
+
+    def lookup(self, term: bytes) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        entry = self.postings.get(term)
+        if entry is None:
+            return None
+        return np.array(entry[0], dtype=np.uint32), np.array(entry[1], dtype=np.uint16)
+
+    def meta(self) -> Dict[str, np.ndarray]:
+        if self._meta is None:
+            self._meta = {"lengths": np.array(self.lengths, dtype=np.uint32), "threads": np.array(self.threads, dtype=np.uint32),
+                          "times": np.array(self.times, dtype=np.float64), "types": np.array(self.types, dtype=np.uint8)}
+        return self._meta
+
+    def text_of(self, doc: int) -> str:
+        return self.texts[doc].decode(errors="replace")
+
+    def to_base(self) -> "_Base":
+        terms = sorted(self.postings)
+        counts = np.fromiter((len(self.postings[term][0]) for term in terms), dtype=np.int64, count=len(terms))
+        docs = [np.frombuffer(self.postings[term][0], dtype=np.uint32) for term in terms]
+        tfs = [np.frombuffer(self.postings[term][1], dtype=np.uint16) for term in terms]
+        text_lengths = np.fromiter((len(text) for text in self.texts), dtype=np.int64, count=len(self.texts))
+        return _Base({"vocab": np.array(terms, dtype=TERM_DTYPE), "offsets": _offsets(counts),
+                      "docs": np.concatenate(docs) if docs else np.zeros(0, np.uint32),
+                      "tfs": np.concatenate(tfs) if tfs else np.zeros(0, np.uint16),
+                      **self.meta(),
+                      "text": np.frombuffer(b"".join(self.texts), dtype=np.uint8), "text_offsets": _offsets(text_lengths)})
+
+
+def _offsets(counts: np.ndarray) -> np.ndarray:
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+class _Base:
+    """Immutable segment: sorted vocabulary with CSR postings, per-doc arrays and the doc texts.
+    Loaded from a snapshot the arrays are memory-mapped, so startup does not read the index."""
+
+    FILES = ("vocab", "offsets", "docs", "tfs", "lengths", "threads", "times", "types", "text", "text_offsets")
+
+    def __init__(self, arrays: Dict[str, np.ndarray]) -> None:
+        self.arrays = arrays
+        for name in self.FILES:
+            setattr(self, name, arrays[name])
+        self.total_length = int(self.lengths.sum())
+
+    @classmethod
+    def empty(cls) -> "_Base":
+        return _Delta().to_base()
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def lookup(self, term: bytes) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        index = int(np.searchsorted(self.vocab, term))
+        if index >= len(self.vocab) or self.vocab[index] != term:
+            return None
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.docs[start:end], self.tfs[start:end]
+
+    def meta(self) -> Dict[str, np.ndarray]:
+        return {"lengths": self.lengths, "threads": self.threads, "times": self.times, "types": self.types}
+
+    def text_of(self, doc: int) -> str:
+        return bytes(self.text[self.text_offsets[doc]:self.text_offsets[doc + 1]]).decode(errors="replace")
+
+    def save(self, path: str) -> None:
+        os.makedirs(path)
+        for name in self.FILES:
+            np.save(os.path.join(path, f"{name}.npy"), self.arrays[name])
+
+    @classmethod
+    def load(cls, path: str) -> "_Base":
+        arrays = {}
+        for name in cls.FILES:
+            filename = os.path.join(path, f"{name}.npy")
+            try:
+                arrays[name] = np.load(filename, mmap_mode="r")
+            except ValueError: # empty arrays cannot be mapped
+                arrays[name] = np.load(filename)
+        return cls(arrays)
+
+
+def _kept_text(base: _Base, keep: np.ndarray) -> Tuple[bytes, np.ndarray]:
+    """Texts of the kept docs, copied run by run (expired docs are mostly one prefix of old rows)."""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], keep.view(np.int8), [0]))))
+    parts = [bytes(base.text[base.text_offsets[start]:base.text_offsets[stop]]) for start, stop in zip(edges[0::2], edges[1::2])]
+    return b"".join(parts), np.diff(base.text_offsets)[keep]
+
+
+def merge_segments(segments: List[_Base], cutoff: float) -> _Base:
+    """One segment of the docs of `segments` created after `cutoff`, doc ids renumbered in order."""
+    keeps = [segment.times >= cutoff for segment in segments]
+    vocab = np.unique(np.concatenate([segment.vocab for segment in segments]))
+    terms, docs, tfs, meta, texts, text_lengths = [], [], [], {name: [] for name in ("lengths", "threads", "times", "types")}, [], []
+    first_doc = 0
+    for segment, keep in zip(segments, keeps):
+        new_ids = np.cumsum(keep, dtype=np.int64) - 1 + first_doc
+        first_doc += int(keep.sum())
+        term_of = np.repeat(np.searchsorted(vocab, segment.vocab), np.diff(segment.offsets))
+        alive = keep[segment.docs]
+        terms.append(term_of[alive])
+        docs.append(new_ids[segment.docs[alive]])
+        tfs.append(np.asarray(segment.tfs)[alive])
+        for name, values in segment.meta().items():
+            meta[name].append(np.asarray(values)[keep])
+        text, lengths = _kept_text(segment, keep)
+        texts.append(text)
+        text_lengths.append(lengths)
+
+    terms = np.concatenate(terms)
+    order = np.argsort(terms, kind="stable") # docs of a term stay in id order: segments are in doc order
+    counts = np.bincount(terms, minlength=len(vocab))
+    used = counts > 0
+    return _Base({"vocab": vocab[used], "offsets": _offsets(counts[used]),
+                  "docs": np.concatenate(docs)[order].astype(np.uint32), "tfs": np.concatenate(tfs)[order],
+                  **{name: np.concatenate(values) for name, values in meta.items()},
+                  "text": np.frombuffer(b"".join(texts), dtype=np.uint8), "text_offsets": _offsets(np.concatenate(text_lengths))})
+
+
+class MemoryIndex:
+    """BM25 index over past agent_history messages, searched by the recall_memory tool.
+
+    Rows are added as the history writer queues them (`add_rows`) into an in-memory
+    delta segment. Every `merge_docs` rows, or every `snapshot_interval` seconds, the
+    deltas are merged off the event loop into one immutable segment that is written to
+    `index_dir` and memory-mapped back. At startup the latest snapshot is mapped and the
+    rows written since its watermark are read from postgres in the background. Rows
+    older than `retention_days` (the agent_history retention) are dropped at merges.
+
+    Searches are scoped to the calling thread. They cover all threads of its user only
+    when the request proved who the user is: X-User-Id signed with `user_secret` in
+    X-User-Signature (hex HMAC-SHA256), set by the authenticating proxy. Without a
+    secret no thread is bound to a user. With `pg_fallback` a postgres full-text
+    index answers while the in-process index is still catching up.
+    """
+
+    def __init__(self, index_dir: str, merge_docs: int = 50_000, snapshot_interval: float = 300.0,
+                 retention_days: float = 30.0, max_doc_chars: int = 2000, pg_fallback: bool = False,
+                 catch_up_batch: int = 5000, k1: float = 1.2, b: float = 0.75, user_secret: Optional[str] = None,
+                 max_retry_delay: float = 300.0) -> None:
+        self.index_dir = index_dir
+        self.user_secret = user_secret
+        self.max_retry_delay = max_retry_delay
+        self.merge_docs = merge_docs
+        self.snapshot_interval = snapshot_interval
+        self.retention_days = retention_days
+        self.max_doc_chars = max_doc_chars
+        self.pg_fallback = pg_fallback
+        self.catch_up_batch = catch_up_batch
+        self.k1 = k1
+        self.b = b
+
+        self._base = _Base.empty()
+        self._frozen: List[_Delta] = [] # waiting to be merged into the base
+        self._live = _Delta()
+        self._thread_names: List[str] = []
+        self._thread_ids: Dict[str, int] = {}
+        self._users: Dict[str, str] = {} # thread_id -> user_id
+        self._user_threads: Dict[str, set] = {}
+        self.watermark = 0.0 # created_at (epoch) of the newest row in the snapshot
+        self.snapshot: Optional[str] = None
+        self.ready = False # caught up with postgres
+        self._merge_lock = asyncio.Lock()
+        self._session_factory = None
+        self._tasks: List[asyncio.Task] = []
+
+    # ------------------------------------------------------------------ write path
+    def _thread(self, thread_id: str) -> int:
+        index = self._thread_ids.get(thread_id)
+        if index is None:
+            index = self._thread_ids[thread_id] = len(self._thread_names)
+            self._thread_names.append(thread_id)
+        return index
+
+    def verified_user(self, user_id: Optional[str], signature: Optional[str]) -> Optional[str]:
+        """`user_id` when `signature` is its HMAC under `user_secret`, else None."""
+        if not self.user_secret or not user_id or not signature:
+            return None
+        expected = hmac.new(self.user_secret.encode(), user_id.encode(), hashlib.sha256).hexdigest()
+        return user_id if hmac.compare_digest(expected, signature.lower()) else None
+
+    def bind_user(self, thread_id: str, user_id: Optional[str]) -> None:
+        """Record which (verified) user a thread belongs to, for searches across the user's threads."""
+        previous = self._users.get(thread_id)
+        if user_id is None or previous == user_id:
+            return
+        if previous is not None: # the thread moved to another user, the old one no longer sees it
+            self._user_threads[previous].discard(thread_id)
+            if not self._user_threads[previous]:
+                del self._user_threads[previous]
+        self._users[thread_id] = user_id
+        self._user_threads.setdefault(user_id, set()).add(thread_id)
+
+    def _add(self, segment: _Delta, row: Dict[str, Any], thread: int) -> bool:
+        text = row.get("response")
+        if row.get("message_type") not in INDEXED_TYPES or not isinstance(text, str):
+            return False
+        tokens = tokenize(text)
+        if not tokens:
+            return False
+        segment.add(tokens, thread, row["created_at"].timestamp(), INDEXED_TYPES.index(row["message_type"]),
+                    text[:self.max_doc_chars].encode())
+        return True
+
+    def add_rows(self, rows: List[Dict[str, Any]]) -> None:
+        """HistoryWriter listener: index rows as they are queued."""
+        for row in rows:
+            if row.get("thread_id") is not None:
+                self._add(self._live, row, self._thread(row["thread_id"]))
+        MEMORY_DOCS.labels("delta").set(len(self._live) + sum(len(delta) for delta in self._frozen))
+        if self.ready and len(self._live) >= self.merge_docs and not self._merge_lock.locked():
+            self._tasks.append(asyncio.create_task(self.merge(), name="memory-merge"))
+
+    # ------------------------------------------------------------------ merges and snapshots
+    def _save(self, base: _Base, meta: Dict[str, Any]) -> str:
+        os.makedirs(self.index_dir, exist_ok=True)
+        name = f"snapshot-{time.time_ns()}"
+        path = os.path.join(self.index_dir, name)
+        base.save(path)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as meta_file:
+            json.dump({"version": SNAPSHOT_VERSION, **meta}, meta_file)
+        current = os.path.join(self.index_dir, "CURRENT")
+        with open(current + ".tmp", "w", encoding="utf-8") as current_file:
+            current_file.write(name)
+        os.replace(current + ".tmp", current) # the switch is atomic; older snapshots are removed after it
+        for old in os.listdir(self.index_dir):
+            if old.startswith("snapshot-") and old != name:
+                shutil.rmtree(os.path.join(self.index_dir, old), ignore_errors=True) # still mapped files stay readable
+        return path
+
+    def load_snapshot(self) -> bool:
+        try:
+            with open(os.path.join(self.index_dir, "CURRENT"), encoding="utf-8") as current_file:
+                path = os.path.join(self.index_dir, current_file.read().strip())
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+                meta = json.load(meta_file)
+            if meta.get("version") != SNAPSHOT_VERSION:
+                logger.warning(f"Ignoring memory snapshot {path} of version {meta.get('version')}")
+                return False
+            base = _Base.load(path)
+        except FileNotFoundError:
+            return False
+        self._base, self.snapshot, self.watermark = base, path, meta["watermark"]
+        self._thread_names = meta["threads"]
+        self._thread_ids = {thread_id: index for index, thread_id in enumerate(self._thread_names)}
+        for thread_id, user_id in meta["users"].items():
+            self.bind_user(thread_id, user_id)
+        MEMORY_DOCS.labels("base").set(len(base))
+        logger.info(f"Mapped memory snapshot {path}: {len(base)} messages, {len(base.vocab)} terms")
+        return True
+
+    async def merge(self, include_live: bool = True, persist: bool = True) -> None:
+        """Merge the delta segments into the base off the event loop, then snapshot it."""
+        async with self._merge_lock:
+            if include_live and len(self._live):
+                self._frozen.append(self._live)
+                self._live = _Delta()
+            frozen = list(self._frozen)
+            if not frozen:
+                return
+            start = time.perf_counter()
+            cutoff = time.time() - self.retention_days * 86400
+            watermark = max([self.watermark] + [max(delta.times) for delta in frozen if len(delta)])
+            # copied here, the event loop keeps adding threads and users while the worker thread writes
+            meta = {"watermark": watermark, "threads": list(self._thread_names), "users": dict(self._users)}
+
+            def build() -> Tuple[_Base, Optional[str]]:
+                merged = merge_segments([self._base] + [delta.to_base() for delta in frozen], cutoff)
+                if not persist:
+                    return merged, None
+                path = self._save(merged, meta)
+                return _Base.load(path), path
+
+            base, path = await asyncio.to_thread(build)
+            self._base, self.watermark = base, watermark
+            self.snapshot = path or self.snapshot
+            del self._frozen[:len(frozen)]
+            MEMORY_MERGE_DURATION.observe(time.perf_counter() - start)
+            MEMORY_DOCS.labels("base").set(len(base))
+            MEMORY_DOCS.labels("delta").set(len(self._live) + sum(len(delta) for delta in self._frozen))
+            logger.info(f"Memory index merged {sum(len(delta) for delta in frozen)} messages in "
+                        f"{time.perf_counter() - start:.2f}s: {len(base)} messages, {len(base.vocab)} terms")
+
+    # ------------------------------------------------------------------ startup
+    async def _catch_up(self) -> None:
+        """Index the rows written since the snapshot. Newer rows come through add_rows."""
+        until = datetime.now(timezone.utc)
+        position = (datetime.fromtimestamp(self.watermark, tz=timezone.utc), None)
+        total = 0
+        failures = 0
+        while True:
+            try:
+                async with self._session_factory() as db:
+                    rows = await async_db_history_since(db, position, until, list(INDEXED_TYPES), self.catch_up_batch)
+                if not rows:
+                    await self.merge()
+                    break
+                last = (rows[-1]["created_at"], rows[-1]["id"])
+                threads = [self._thread(row["thread_id"]) for row in rows if row["thread_id"] is not None]
+                rows = [row for row in rows if row["thread_id"] is not None]
+
+                def build() -> _Delta:
+                    segment = _Delta()
+                    for row, thread in zip(rows, threads):
+                        self._add(segment, row, thread)
+                    return segment
+
+                self._frozen.append(await asyncio.to_thread(build))
+                position = last # a failed batch is read again
+                total += len(rows)
+                if sum(len(delta) for delta in self._frozen) >= self.merge_docs:
+                    await self.merge(include_live=False) # the live delta is newer than `until`, it waits
+                failures = 0
+            except Exception as e:
+                # until caught up no merge runs (the watermark would skip the missing rows), so keep trying
+                delay = min(self.max_retry_delay, 2.0 ** failures)
+                failures += 1
+                logger.warning(f"Memory index catch-up failed after {total} rows, retrying in {delay:.0f}s: {e!r}")
+                await asyncio.sleep(delay)
+        self.ready = True
+        logger.info(f"Memory index caught up: {total} rows since the snapshot, {len(self._base)} messages")
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if self.ready and (len(self._live) or self._frozen):
+                try:
+                    await self.merge()
+                except Exception as e:
+                    logger.warning(f"Memory index merge failed: {e!r}")
+
+    async def start(self, session_factory, engine=None) -> None:
+        self._session_factory = session_factory
+        await asyncio.to_thread(self.load_snapshot)
+        if self.pg_fallback and engine is not None:
+            await ensure_history_fts_index(engine)
+        self._tasks = [asyncio.create_task(self._catch_up(), name="memory-catch-up"),
+                       asyncio.create_task(self._snapshot_loop(), name="memory-snapshot")]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.ready and len(self._live):
+            await self.merge()
+
+    # ------------------------------------------------------------------ read path
+    def scope(self, thread_id: Optional[str], scope: str = "thread") -> Tuple[str, List[str]]:
+        """("user" | "thread", thread_ids searched). Without a verified user, only the thread itself."""
+        user_id = self._users.get(thread_id) if thread_id is not None else None
+        if scope == "user" and user_id is not None:
+            return "user", sorted(self._user_threads[user_id])
+        return "thread", [thread_id] if thread_id is not None else []
+
+    def _segments(self) -> List[Tuple[int, Any]]:
+        segments, first_doc = [], 0
+        for segment in [self._base, *self._frozen, self._live]:
+            segments.append((first_doc, segment))
+            first_doc += len(segment)
+        return segments
+
+    def search(self, query: str, thread_ids: List[str], limit: int = 5) -> List[Dict[str, Any]]:
+        """BM25 top `limit` messages of the given threads."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        allowed = np.array([self._thread_ids[thread_id] for thread_id in thread_ids if thread_id in self._thread_ids], dtype=np.uint32)
+        if not terms or not len(allowed):
+            return []
+        segments = self._segments()
+        metas = [segment.meta() for _, segment in segments]
+        n_docs = sum(len(segment) for _, segment in segments)
+        avgdl = max(1.0, sum(segment.total_length for _, segment in segments) / max(1, n_docs))
+        cutoff = time.time() - self.retention_days * 86400
+
+        candidates, scores = [], []
+        for term in terms:
+            postings = [(first_doc, meta, segment.lookup(term)) for (first_doc, segment), meta in zip(segments, metas)]
+            postings = [(first_doc, meta, found) for first_doc, meta, found in postings if found is not None]
+            df = sum(len(found[0]) for _, _, found in postings)
+            if not df:
+                continue
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for first_doc, meta, (docs, tfs) in postings:
+                threads = meta["threads"][docs]
+                mask = (threads == allowed[0]) if len(allowed) == 1 else np.isin(threads, allowed)
+                mask &= meta["times"][docs] >= cutoff
+                docs = docs[mask]
+                if not len(docs):
+                    continue
+                tf = tfs[mask].astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b * meta["lengths"][docs] / avgdl)
+                candidates.append(docs.astype(np.int64) + first_doc)
+                scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+        if not candidates:
+            return []
+
+        docs, inverse = np.unique(np.concatenate(candidates), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        top = np.argpartition(-totals, limit - 1)[:limit] if len(totals) > limit else np.arange(len(totals))
+        top = top[np.argsort(-totals[top])]
+
+        firsts = [first_doc for first_doc, _ in segments]
+        results = []
+        for doc, score in zip(docs[top], totals[top]):
+            index = int(np.searchsorted(firsts, doc, side="right")) - 1
+            first_doc, segment = segments[index]
+            meta = metas[index]
+            local = int(doc - first_doc)
+            results.append({"thread_id": self._thread_names[int(meta["threads"][local])],
+                            "role": INDEXED_TYPES[int(meta["types"][local])],
+                            "created_at": datetime.fromtimestamp(float(meta["times"][local]), tz=timezone.utc).isoformat(timespec="seconds"),
+                            "score": round(float(score), 3),
+                            "text": snippet(segment.text_of(local), terms)})
+        return results
+
+    async def _search_postgres(self, query: str, thread_ids: List[str], limit: int) -> List[Dict[str, Any]]:
+        terms = [term.decode(errors="ignore") for term in dict.fromkeys(tokenize(query))]
+        after = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+        async with self._session_factory() as db:
+            rows = await async_db_search_history(db, terms, thread_ids, list(INDEXED_TYPES), after, limit)
+        return [{"thread_id": row["thread_id"], "role": row["message_type"], "created_at": row["created_at"].isoformat(timespec="seconds"),
+                 "score": round(row["score"], 3), "text": snippet(row["response"][:self.max_doc_chars], [term.encode() for term in terms])}
+                for row in rows]
+
+    async def asearch(self, query: str, thread_id: Optional[str], scope: str = "thread", limit: int = 5) -> Dict[str, Any]:
+        scope, thread_ids = self.scope(thread_id, scope)
+        backend = "postgres" if self.pg_fallback and not self.ready and self._session_factory is not None else "index"
+        start = time.perf_counter()
+        if backend == "postgres":
+            results = await self._search_postgres(query, thread_ids, limit)
+        else:
+            results = self.search(query, thread_ids, limit)
+        MEMORY_QUERY_DURATION.labels(backend).observe(time.perf_counter() - start)
+        return {"scope": scope, "complete": self.ready or backend == "postgres", "results": results}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"ready": self.ready, "base_docs": len(self._base), "delta_docs": len(self._live) + sum(len(delta) for delta in self._frozen),
+                "terms": len(self._base.vocab), "threads": len(self._thread_names), "users": len(self._user_threads),
+                "snapshot": self.snapshot}
+
+
+def snippet(text: str, terms: List[bytes], width: int = 300) -> str:
+    """`width` characters around the first query term found in the text."""
+    lowered = text.lower()
+    positions = [position for position in (lowered.find(term.decode(errors="ignore")) for term in terms) if position >= 0]
+    start = max(0, min(positions, default=0) - width // 3)
+    return ("..." if start else "") + text[start:start + width] + ("..." if start + width < len(text) else "")
+
+
+def build_memory_index() -> MemoryIndex:
+    """MEMORY_INDEX_DIR, MEMORY_MERGE_DOCS, MEMORY_SNAPSHOT_INTERVAL, MEMORY_MAX_DOC_CHARS, MEMORY_PG_FTS,
+    MEMORY_USER_SECRET (user scope off without it); retention follows HISTORY_RETENTION_DAYS."""
+    return MemoryIndex(index_dir=os.getenv("MEMORY_INDEX_DIR", "./memory_index"),
+                       merge_docs=int(os.getenv("MEMORY_MERGE_DOCS", 50_000)),
+                       snapshot_interval=float(os.getenv("MEMORY_SNAPSHOT_INTERVAL", 300)),
+                       retention_days=float(os.getenv("HISTORY_RETENTION_DAYS", 30)),
+                       max_doc_chars=int(os.getenv("MEMORY_MAX_DOC_CHARS", 2000)),
+                       pg_fallback=os.getenv("MEMORY_PG_FTS", "false").lower() == "true",
+                       user_secret=os.getenv("MEMORY_USER_SECRET") or None)
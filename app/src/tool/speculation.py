@@ -0,0 +1,163 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from langchain_core.messages import ToolMessage
+
+from metrics import SPECULATION_RUNS, SPECULATION_SAVED, SPECULATION_ENTRIES, SPECULATION_BYTES
+
+logger = logging.getLogger(__name__)
+
+# side-effect free tools: running one that the reviewer then rejects costs nothing but the call itself
+SPECULATIVE_TOOLS = {"tavily_search", "calculator", "recall_memory"}
+
+
+def args_key(args: Dict[str, Any]) -> str:
+    return json.dumps(args, sort_keys=True, default=str)
+
+
+class _Speculation:
+    __slots__ = ("tool", "args_key", "task", "started_at", "finished_at", "size")
+
+    def __init__(self, tool: str, args_key: str, task: asyncio.Task) -> None:
+        self.tool = tool
+        self.args_key = args_key
+        self.task = task
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.size = 0
+
+
+class SpeculativeToolRuns:
+    """Runs read-only tool calls while call_human_feedback waits for the reviewer.
+
+    When the graph stops on an interrupt, the reviewed tool call is started in the
+    background and its ToolMessage kept under (thread_id, tool_call_id). The tool
+    node then takes it instead of running the tool: "continue" uses it as is, "update"
+    uses it only if the edited args are the same, "feedback" discards it. Results
+    expire after `ttl` seconds; at most `max_entries` runs and `max_bytes` of result
+    content are kept (oldest evicted first) and `max_inflight` run at once.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024,
+                 max_inflight: int = 16, tools: set = SPECULATIVE_TOOLS) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_inflight = max_inflight
+        self.tools = tools
+        self._entries: "OrderedDict[Tuple[str, str], _Speculation]" = OrderedDict()
+        self._bytes = 0
+        self._inflight = 0
+
+    def _record(self, tool: str, result: str) -> None:
+        SPECULATION_RUNS.labels(tool, result).inc()
+
+    def _pop(self, key: Tuple[str, str]) -> Optional[_Speculation]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            SPECULATION_ENTRIES.set(len(self._entries))
+            SPECULATION_BYTES.set(self._bytes)
+        return entry
+
+    def _drop(self, key: Tuple[str, str], result: str) -> None:
+        if (entry := self._pop(key)) is not None:
+            entry.task.cancel() # no-op once finished
+            self._record(entry.tool, result)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.started_at <= self.ttl:
+                break
+            self._drop(key, "expired")
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._drop(next(iter(self._entries)), "evicted")
+
+    def start(self, thread_id: Optional[str], tool_call: Dict[str, Any], run: Callable[[], Awaitable[ToolMessage]]) -> bool:
+        """Start `run()` for a reviewed tool call if the tool is side-effect free. Returns whether it started."""
+        name, tool_call_id = tool_call.get("name"), tool_call.get("id")
+        if thread_id is None or tool_call_id is None or name not in self.tools:
+            return False
+        key = (thread_id, tool_call_id)
+        if key in self._entries:
+            return False
+        self._expire()
+        if self._inflight >= self.max_inflight:
+            self._record(name, "skipped")
+            return False
+
+        self._inflight += 1
+        task = asyncio.create_task(run(), name=f"speculate-{name}-{tool_call_id}")
+        entry = self._entries[key] = _Speculation(name, args_key(tool_call.get("args") or {}), task)
+        task.add_done_callback(lambda task: self._finished(key, entry, task))
+        self._record(name, "started")
+        SPECULATION_ENTRIES.set(len(self._entries))
+        self._evict()
+        logger.debug(f"Speculatively running {name} for {thread_id}/{tool_call_id}")
+        return True
+
+    def _finished(self, key: Tuple[str, str], entry: _Speculation, task: asyncio.Task) -> None:
+        self._inflight -= 1
+        entry.finished_at = time.monotonic()
+        if self._entries.get(key) is not entry or task.cancelled():
+            return
+        if task.exception() is not None or task.result().status == "error":
+            self._drop(key, "failed") # the tool node runs it again for real
+            return
+        entry.size = len(str(task.result().content))
+        self._bytes += entry.size
+        SPECULATION_BYTES.set(self._bytes)
+        self._evict()
+
+    async def take(self, thread_id: Optional[str], tool_call: Dict[str, Any]) -> Optional[ToolMessage]:
+        """The speculative result for this tool call if its args still match, else None (and it is dropped)."""
+        entry = self._pop((thread_id, tool_call.get("id"))) if thread_id is not None else None
+        if entry is None:
+            return None
+        taken_at = time.monotonic()
+        if taken_at - entry.started_at > self.ttl or entry.args_key != args_key(tool_call.get("args") or {}):
+            entry.task.cancel()
+            self._record(entry.tool, "expired" if taken_at - entry.started_at > self.ttl else "mismatch")
+            return None
+
+        pending = not entry.task.done() # reviewer was quicker than the tool, still saves the time it already ran
+        try:
+            message = await entry.task
+        except Exception:
+            message = None
+        if message is None or message.status == "error":
+            self._record(entry.tool, "failed")
+            return None
+        self._record(entry.tool, "hit_pending" if pending else "hit")
+        SPECULATION_SAVED.observe(min(entry.finished_at or taken_at, taken_at) - entry.started_at)
+        return message
+
+    def discard(self, thread_id: Optional[str], tool_call_id: Optional[str]) -> None:
+        """The reviewer answered with feedback, the tool will not run."""
+        if thread_id is not None:
+            self._drop((thread_id, tool_call_id), "discarded")
+
+    def stats(self) -> Dict[str, int]:
+        return {"entries": len(self._entries), "bytes": self._bytes, "inflight": self._inflight}
+
+
+def build_speculation() -> Optional[SpeculativeToolRuns]:
+    """SPECULATIVE_TOOLS_ENABLED, SPECULATION_TTL, SPECULATION_MAX_ENTRIES, SPECULATION_MAX_BYTES, SPECULATION_MAX_INFLIGHT."""
+    if os.getenv("SPECULATIVE_TOOLS_ENABLED", "true").lower() != "true":
+        return None
+    return SpeculativeToolRuns(ttl=float(os.getenv("SPECULATION_TTL", 300)),
+                               max_entries=int(os.getenv("SPECULATION_MAX_ENTRIES", 1000)),
+                               max_bytes=int(os.getenv("SPECULATION_MAX_BYTES", 32 * 1024 * 1024)),
+                               max_inflight=int(os.getenv("SPECULATION_MAX_INFLIGHT", 16)))
+
+
+speculation = build_speculation()
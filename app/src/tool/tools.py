@@ -1,9 +1,14 @@
-from typing import Optional, Annotated
+from typing import Optional, Annotated, Literal
 from pydantic import BaseModel, Field
 from langchain_core.tools import tool
 from typing import List, Dict, Any
 
 import json
+import os
+import asyncio
+import logging
+import time
+from functools import lru_cache
 from langchain_core.messages import (
     HumanMessage,
     AIMessage,
@@ -11,130 +16,172 @@ from langchain_core.messages import (
     ToolMessage,
     BaseMessage,
 )
-from langchain_tavily import TavilySearch
 from langgraph.prebuilt import InjectedState,ToolNode
 from langchain_core.runnables import RunnableConfig
 from dotenv import load_dotenv
 import llm.llm_services
 
 from state import AgentState
+from tool.cache import build_tool_cache, ToolResultCache
+from tool.history import HistorySerializer
+from tool.speculation import SpeculativeToolRuns, speculation
+from metrics import observe_node, TOOL_DURATION
+from log_config import log_payload, truncate
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-class BasicToolNode:
-    """A node that runs the tools requested in the last AIMessage."""
 
-    def __init__(self, tools: list) -> None:
-        self.tools_by_name = {tool.name: tool for tool in tools}
+# Per-tool concurrency caps and timeouts (seconds), tools not listed use the defaults
+TOOL_LIMITS = {
+    "tavily_search": {"max_concurrency": 4, "timeout": 20.0},
+    "think_step": {"max_concurrency": 2, "timeout": 60.0},
+    "calculator": {"max_concurrency": 8, "timeout": 5.0},
+    "recall_memory": {"max_concurrency": 8, "timeout": 10.0},
+}
+DEFAULT_TOOL_MAX_CONCURRENCY = 4
+DEFAULT_TOOL_TIMEOUT = 30.0
 
-    async def __call__(self, inputs: dict):
+# Read-only tools whose results are cached and shared between threads
+CACHEABLE_TOOLS = {"tavily_search"}
 
-        # Handle think_step
+
+class BasicToolNode:
+    """A node that runs the tools requested in the last AIMessage.
+
+    All tool calls of the message are dispatched concurrently, each tool under its own
+    concurrency cap and timeout. Results come back in tool_call order, a failing or
+    timed out call becomes an error ToolMessage instead of aborting the node. A call
+    already run speculatively during human review (see tool/speculation.py) is not run again.
+    """
+
+    def __init__(self, tools: list, tool_limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 cache: Optional[ToolResultCache] = None, cacheable_tools: set = CACHEABLE_TOOLS,
+                 speculation: Optional[SpeculativeToolRuns] = None) -> None:
+        self.tools_by_name = {tool.name: tool for tool in tools}
+        self.cache = cache
+        self.speculation = speculation
+        self.cacheable_tools = cacheable_tools
+        self.history_serializer = HistorySerializer()
+        self.tool_limits = {name: {"max_concurrency": DEFAULT_TOOL_MAX_CONCURRENCY, "timeout": DEFAULT_TOOL_TIMEOUT,
+                                   **(tool_limits or TOOL_LIMITS).get(name, {})}
+                            for name in self.tools_by_name}
+        self._semaphores = {name: asyncio.Semaphore(int(limits["max_concurrency"]))
+                            for name, limits in self.tool_limits.items()}
+
+    async def __call__(self, inputs: dict, config: Optional[RunnableConfig] = None):
+
+        with observe_node("tool_node", config):
+            return await self._call(inputs, config)
+
+    async def _call(self, inputs: dict, config: Optional[RunnableConfig]):
         if messages := inputs.get("messages", []):
             message = messages[-1]# AI message
-            outputs=[]
-            print("messages:",messages)
-            # No parallel tool_call enabled. Sequential tool call
-            if (tool_name:= message.tool_calls[0]["name"])=="think_step":
-               formatted_messages = self._convert_state_messages_format(messages)
-               #formatted_messages = ",".join(messages)
-               print("----formated_messages----\n",formatted_messages)
-
-               for tool_call in message.tool_calls:
-                    formatted_messages.append({"role":"user","content":tool_call["args"]["properties"]["thought"]})# extract thought args
-                    tool_call["args"]["thought"] = json.dumps(formatted_messages)
-                    print("----tool_call thought----\n",formatted_messages)
-                    tool_result =  await self.tools_by_name[tool_call["name"]].ainvoke(
-                        tool_call["args"]
-                    )
-                    outputs.append(
-                        ToolMessage(
-                            content=json.dumps(tool_result),
-                            name=tool_call["name"],
-                            tool_call_id=tool_call["id"],
-                        )
-                    )
-
-            else:
-
-                for tool_call in message.tool_calls:
-                    tool_result =  await self.tools_by_name[tool_call["name"]].ainvoke(
-                        tool_call["args"]
-                    )
-                    outputs.append(
-                        ToolMessage(
-                            content=json.dumps(tool_result),
-                            name=tool_call["name"],
-                            tool_call_id=tool_call["id"],
-                        )
-                    )
-                    
-            return {"messages": outputs}
+            log_payload(logger, "tool_node messages", messages)
+
+            # Handle think_step: it reasons over the whole conversation.
+            # The history is encoded once per step (incrementally per thread) and tool_call args in state are left untouched.
+            history_prefix = None
+            tool_args = []
+            for tool_call in message.tool_calls:
+                args = tool_call["args"]
+                if tool_call["name"]=="think_step":
+                    if history_prefix is None:
+                        thread_id = (config or {}).get("configurable", {}).get("thread_id")
+                        history_prefix = self.history_serializer.encode_prefix(messages, thread_id=thread_id)
+                    thought = args.get("properties", {}).get("thought", args.get("thought"))# extract thought args
+                    args = {**args, "thought": self.history_serializer.extend(history_prefix, {"role":"user","content":thought})}
+                tool_args.append(args)
+
+            thread_id = (config or {}).get("configurable", {}).get("thread_id")
+            outputs = await asyncio.gather(*(self._run_or_take(tool_call, args, thread_id, config)
+                                             for tool_call, args in zip(message.tool_calls, tool_args)))
+            return {"messages": list(outputs)}
             
         else:
             raise ValueError("No message found in input")
 
-
-    def _convert_state_messages_format(self,messages:List[BaseMessage]):
-        """
-        Converts a list of LangChain BaseMessage objects to a list of dictionaries
-        """
-        formatted_messages = []
-
-        for msg in messages:
-            if isinstance(msg, SystemMessage): # if provided one
-                formatted_messages.append({"role":"system",
-                                            "content":msg.content,
-                                            "additional_kwargs":msg.additional_kwargs,
-                                            "response_metadata":msg.response_metadata,
-                                            "id":msg.id})
-                
-            elif isinstance(msg, HumanMessage):
-                formatted_messages.append({"role":"user",
-                                            "content":msg.content,
-                                            "additional_kwargs":msg.additional_kwargs,
-                                            "response_metadata":msg.response_metadata,
-                                            "id":msg.id})
-                
-            elif isinstance(msg, AIMessage):
-                formatted_messages.append({"role":"assistant",
-                                            "content":msg.content,
-                                            "additional_kwargs":msg.additional_kwargs,
-                                            "response_metadata":msg.response_metadata,
-                                            "id":msg.id,
-                                            "tool_calls":msg.tool_calls})
-            
-            elif isinstance(msg, ToolMessage):
-                formatted_messages.append({"role":"tool",
-                                            "content":msg.content,
-                                            "name":msg.name,
-                                            "id":msg.id,
-                                            "tool_call_id":msg.tool_call_id})
-            
-        return formatted_messages
+    def speculate(self, thread_id: Optional[str], tool_call: Dict[str, Any]) -> bool:
+        """Start a reviewed, side-effect free tool call before the human approves it."""
+        if self.speculation is None or tool_call.get("name") not in self.tools_by_name:
+            return False
+        config = {"configurable": {"thread_id": thread_id}} # outside the graph run, no callbacks to report to
+        return self.speculation.start(thread_id, tool_call, lambda: self._run_tool(tool_call, tool_call.get("args") or {}, config))
+
+    async def _run_or_take(self, tool_call: Dict[str, Any], args: Dict[str, Any], thread_id: Optional[str],
+                           config: Optional[RunnableConfig]) -> ToolMessage:
+        if self.speculation is not None and (message := await self.speculation.take(thread_id, tool_call)) is not None:
+            return message
+        return await self._run_tool(tool_call, args, config)
+
+    async def _run_tool(self, tool_call: Dict[str, Any], args: Dict[str, Any], config: Optional[RunnableConfig]) -> ToolMessage:
+        """Runs one tool call under its tool's semaphore and timeout."""
+        name = tool_call["name"]
+        if name not in self.tools_by_name:
+            return ToolMessage(content=f"Error: unknown tool {name}", name=name, tool_call_id=tool_call["id"], status="error")
+
+        timeout = self.tool_limits[name]["timeout"]
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            async with self._semaphores[name]:
+                tool_result = await asyncio.wait_for(self._invoke(name, args, config), timeout=timeout)
+            content = json.dumps(tool_result) # may fail too, e.g. on an int above 4300 digits
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.warning(f"Tool {name} timed out after {timeout}s")
+            return ToolMessage(content=f"Error: {name} timed out after {timeout}s", name=name, tool_call_id=tool_call["id"], status="error")
+        except Exception as e:
+            status = "error"
+            logger.warning(f"Tool {name} failed: {e!r}")
+            return ToolMessage(content=f"Error: {name} failed: {e!r}", name=name, tool_call_id=tool_call["id"], status="error")
+        finally:
+            TOOL_DURATION.labels(name, status).observe(time.perf_counter() - start)
+
+        return ToolMessage(
+            content=content,
+            name=name,
+            tool_call_id=tool_call["id"],
+        )
+
+    async def _invoke(self, name: str, args: Dict[str, Any], config: Optional[RunnableConfig]):
+        if self.cache is not None and name in self.cacheable_tools:
+            return await self.cache.get_or_compute(name, args, lambda: self.tools_by_name[name].ainvoke(args, config=config))
+        return await self.tools_by_name[name].ainvoke(args, config=config)
 
 
 
 
 # Define calculator tool
 class CalculatorInput(BaseModel):
-    expression: str = Field(description="The mathematical expression to evaluate.")
+    expression: Optional[str] = Field(default=None, description="Arithmetic expression, e.g. '(3.5 * 12) / 7' or 'mean(x) * 2'.")
+    expressions: Optional[List[str]] = Field(default=None, description="Several expressions to evaluate in one call.")
+    variables: Optional[Dict[str, float | List[float]]] = Field(
+        default=None, description="Named numbers or lists of numbers; lists are evaluated element-wise.")
+
+# arrays above this size are evaluated off the event loop
+CALCULATOR_THREAD_THRESHOLD = 10_000
 
 @tool("calculator", args_schema=CalculatorInput)
-async def calculator(expression: str) -> float:
-    """Evaluates a simple mathematical expression."""
-    print(f"--- Executing calculator with expression: {expression} ---")
-    try:
-        # WARNING: Using eval() is dangerous in production code due to security risks.
-        # Use a safer expression evaluator library in a real application (e.g., asteval, numexpr).
-        result = eval(expression)
-        print(f"--- Calculator result: {result} ---")
-        return float(result)
-    except Exception as e:
-        print(f"--- Calculator error: {e} ---")
-        # Return error message as string
-        return f"Error evaluating expression: {e}"
+async def calculator(expression: Optional[str] = None, expressions: Optional[List[str]] = None,
+                     variables: Optional[Dict[str, float | List[float]]] = None) -> Dict[str, Any]:
+    """Evaluates arithmetic safely: + - * / // % ** and functions sqrt, log, exp, sin, cos, abs, round, min, max, sum, mean, median, std.
+    Pass one expression, a list of expressions, and/or variables holding lists of numbers to compute over whole columns at once."""
+    from tool.expression import evaluate_many # numpy, loaded on the first calculation
+
+    batch = ([expression] if expression else []) + list(expressions or [])
+    if not batch:
+        return {"error": "expression or expressions is required"}
+    logger.debug(f"Executing calculator with {len(batch)} expression(s): {truncate(batch)}")
+
+    size = sum(len(value) for value in (variables or {}).values() if isinstance(value, list))
+    if size > CALCULATOR_THREAD_THRESHOLD:
+        results = await asyncio.to_thread(evaluate_many, batch, variables)
+    else:
+        results = evaluate_many(batch, variables)
+    logger.debug(f"Calculator results: {truncate(results)}")
+    return results[0] if len(results) == 1 else {"results": results}
 
 
 # think tool
@@ -145,7 +192,7 @@ class ThinkStepInput(BaseModel):
 async def think_step(thought:str|Dict, config:RunnableConfig) -> Dict[str,Any]:
     """to add a step to stop and think about whether it has all the information it needs to move forward."""
 
-    print(f"--- Thinking steps: ---")
+    logger.debug("Thinking steps")
 
     think_step_prompt = f'''
     ## Using the think tool
@@ -164,18 +211,56 @@ async def think_step(thought:str|Dict, config:RunnableConfig) -> Dict[str,Any]:
     
     ## Thought (to think about): {thought}'''
 
-    print("---think_step_prompt---:\n",think_step_prompt)
-    response = await llm.llm_services.async_generate_text_response(think_step_prompt,config=config)
-    print("---think_step_response---\n",response)
+    log_payload(logger, "think_step prompt", think_step_prompt)
+    response = await llm.llm_services.async_generate_text_response(think_step_prompt,config=config,caller="think_step")
+    log_payload(logger, "think_step response", response.content)
 
     return response.content
 
     
-web_search_tool = TavilySearch(max_search=2)
-
-
-# List of available tools
-AVAILABLE_TOOLS = [think_step,web_search_tool]
+def build_web_search_tool():
+    from langchain_tavily import TavilySearch # imports aiohttp and validates TAVILY_API_KEY, so only on first use
+    import langchain_tavily._utilities
+
+    # TAVILY_API_URL points the search tool at a stand-in (see benchmarks/fake_services.py)
+    if tavily_api_url := os.getenv("TAVILY_API_URL"):
+        langchain_tavily._utilities.TAVILY_API_URL = tavily_api_url
+    return TavilySearch(max_search=2)
+
+
+# recall_memory tool
+class RecallMemoryInput(BaseModel):
+    query: str = Field(description="What to look for in earlier conversations, e.g. 'hotel booked for the Lisbon trip'.")
+    scope: Literal["user", "thread"] = Field(default="thread", description="'thread': only this conversation, 'user': all of this user's conversations.")
+    limit: int = Field(default=5, ge=1, le=20, description="Number of messages to return.")
+
+@tool("recall_memory", args_schema=RecallMemoryInput)
+async def recall_memory(query: str, config: RunnableConfig, scope: str = "thread", limit: int = 5) -> Dict[str, Any]:
+    """Searches messages of earlier conversations with this user (questions, answers and tool results).
+    Use it before searching the web for something the user may have asked or been told before."""
+    index = memory_index()
+    if index is None:
+        return {"error": "memory is disabled"}
+    thread_id = (config or {}).get("configurable", {}).get("thread_id")
+    result = await index.asearch(query, thread_id, scope=scope, limit=limit)
+    logger.debug(f"recall_memory found {len(result['results'])} messages in scope {result['scope']}")
+    return result
+
+
+@lru_cache(maxsize=None)
+def memory_index():
+    """The recall_memory index (tool/memory.py, loads numpy), None when MEMORY_ENABLED is false."""
+    if os.getenv("MEMORY_ENABLED", "true").lower() != "true":
+        return None
+    from tool.memory import build_memory_index
+    return build_memory_index()
+
+
+# List of available tools, instantiated the first time the router or the graph needs them
+@lru_cache(maxsize=None)
+def available_tools() -> tuple:
+    tools = (think_step, build_web_search_tool(), calculator)
+    return tools + (recall_memory,) if memory_index() is not None else tools
 
 
 # Prepare tools for the LLM prompt (OpenAI function calling like format to embed in prompt) for llama > 8b
@@ -198,9 +283,13 @@ def format_tools_for_llm(tools):
 
 
 
-tool_node = BasicToolNode(tools=AVAILABLE_TOOLS)
+def build_tool_node() -> BasicToolNode:
+    return BasicToolNode(tools=available_tools(), cache=build_tool_cache(), speculation=speculation)
+
 
 # to create list of tools for chat template
-TOOLS_FOR_LLM = format_tools_for_llm(AVAILABLE_TOOLS)
+@lru_cache(maxsize=None)
+def tools_for_llm() -> list:
+    return format_tools_for_llm(available_tools())
 
 
@@ -0,0 +1,160 @@
+import struct
+from typing import Any, Dict, List, Literal, Optional, TypedDict, Union
+
+import orjson
+import ormsgpack
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.types import Interrupt
+
+# Event protocol of the streaming workflow endpoints. One event per graph update
+# (never the whole message list), plain fields instead of dumpd()'s constructor
+# dicts, so a client reads it without langchain and without eval.
+PROTOCOL_VERSION = 1
+
+
+class ToolCall(TypedDict):
+    id: Optional[str]
+    name: str
+    args: Dict[str, Any]
+
+
+class TokenEvent(TypedDict):
+    event: Literal["token"]
+    id: Optional[str]
+    content: str
+
+
+class MessageEvent(TypedDict, total=False):
+    event: Literal["message"]
+    id: Optional[str]
+    role: Literal["user", "assistant", "tool", "system"]
+    content: Union[str, List]
+    name: str            # tool messages
+    tool_call_id: str    # tool messages
+    status: str          # tool messages, only when "error"
+
+
+class ToolCallEvent(TypedDict):
+    event: Literal["tool_call"]
+    message_id: Optional[str]
+    tool_calls: List[ToolCall]
+
+
+class InterruptEvent(TypedDict):
+    event: Literal["interrupt"]
+    id: str
+    question: Optional[str]
+    tool_call: Optional[ToolCall]
+
+
+class ErrorEvent(TypedDict):
+    event: Literal["error"]
+    status: int
+    detail: str
+    retry_after: Optional[int]
+
+
+class EndEvent(TypedDict):
+    event: Literal["end"]
+    ttft_ms: Optional[float]
+    total_ms: float
+    tokens: int
+
+
+Event = Union[TokenEvent, MessageEvent, ToolCallEvent, InterruptEvent, ErrorEvent, EndEvent]
+
+_ROLES = ((AIMessage, "assistant"), (ToolMessage, "tool"), (HumanMessage, "user"), (SystemMessage, "system"))
+
+
+def token_event(chunk: AIMessageChunk) -> TokenEvent:
+    return {"event": "token", "id": chunk.id, "content": chunk.content}
+
+
+def message_event(message: BaseMessage) -> MessageEvent:
+    role = next((role for cls, role in _ROLES if isinstance(message, cls)), message.type)
+    event: MessageEvent = {"event": "message", "id": message.id, "role": role, "content": message.content}
+    if isinstance(message, ToolMessage):
+        event["name"] = message.name
+        event["tool_call_id"] = message.tool_call_id
+        if message.status == "error":
+            event["status"] = "error"
+    return event
+
+
+def _tool_call(tool_call: Dict[str, Any]) -> ToolCall:
+    return {"id": tool_call.get("id"), "name": tool_call.get("name"), "args": tool_call.get("args") or {}}
+
+
+def tool_call_event(message: AIMessage) -> ToolCallEvent:
+    return {"event": "tool_call", "message_id": message.id, "tool_calls": [_tool_call(call) for call in message.tool_calls]}
+
+
+def interrupt_event(item: Interrupt) -> InterruptEvent:
+    value = item.value if isinstance(item.value, dict) else {"question": str(item.value)}
+    tool_call = value.get("tool_call")
+    return {"event": "interrupt", "id": item.interrupt_id, "question": value.get("question"),
+            "tool_call": _tool_call(tool_call) if tool_call else None}
+
+
+def error_event(status: int, detail: str, retry_after: Optional[int] = None) -> ErrorEvent:
+    return {"event": "error", "status": status, "detail": detail, "retry_after": retry_after}
+
+
+def end_event(ttft_ms: Optional[float], total_ms: float, tokens: int) -> EndEvent:
+    return {"event": "end", "ttft_ms": ttft_ms, "total_ms": total_ms, "tokens": tokens}
+
+
+# ------------------------------------------------------------------ encodings
+NDJSON, SSE, MSGPACK = "ndjson", "sse", "msgpack"
+MEDIA_TYPES = {NDJSON: "application/x-ndjson", SSE: "text/event-stream", MSGPACK: "application/x-msgpack"}
+_LENGTH = struct.Struct(">I")
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Encoding for an Accept header: msgpack or SSE when asked for, NDJSON otherwise."""
+    accept = accept or ""
+    if MEDIA_TYPES[MSGPACK] in accept or "application/msgpack" in accept:
+        return MSGPACK
+    if MEDIA_TYPES[SSE] in accept:
+        return SSE
+    return NDJSON
+
+
+def encode(event: Event, encoding: str = NDJSON) -> bytes:
+    """One event as a frame: a JSON line, an SSE `data:` frame, or a 4-byte big-endian length + msgpack body."""
+    if encoding == MSGPACK:
+        body = ormsgpack.packb(event, default=str)
+        return _LENGTH.pack(len(body)) + body
+    body = orjson.dumps(event, default=str)
+    return b"data: " + body + b"\n\n" if encoding == SSE else body + b"\n"
+
+
+class Decoder:
+    """Incremental decoder for a response body in any of the encodings; feed() returns the complete events."""
+
+    def __init__(self, encoding: str = NDJSON) -> None:
+        self.encoding = encoding
+        self._buffer = b""
+
+    def feed(self, data: bytes) -> List[Event]:
+        self._buffer += data
+        events = []
+        if self.encoding == MSGPACK:
+            offset = 0
+            while len(self._buffer) - offset >= _LENGTH.size:
+                (size,) = _LENGTH.unpack_from(self._buffer, offset)
+                if len(self._buffer) - offset - _LENGTH.size < size:
+                    break
+                start = offset + _LENGTH.size
+                events.append(ormsgpack.unpackb(self._buffer[start:start + size]))
+                offset = start + size
+            self._buffer = self._buffer[offset:]
+            return events
+
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            if line.startswith(b"data: "):
+                line = line[6:]
+            if line.strip():
+                events.append(orjson.loads(line))
+        return events
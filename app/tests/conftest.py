@@ -0,0 +1,14 @@
+"""Tests import the app's modules the way it runs them, from app/src.
+
+Run from app:
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+# settings read at import time; nothing here connects to them
+os.environ.setdefault("TAVILY_API_KEY", "test")
+os.environ.setdefault("SERVED_MODEL_NAME", "test-model")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
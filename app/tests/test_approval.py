@@ -0,0 +1,64 @@
+import hashlib
+import hmac
+
+import pytest
+
+from tool.approval import APPROVE, REVIEW, ApprovalPolicy, PolicyError
+
+SECRET = "s3cret"
+
+
+def sign(value, secret=SECRET):
+    return hmac.new(secret.encode(), value.encode(), hashlib.sha256).hexdigest()
+
+
+def policy(rules, tenant_secret=SECRET):
+    return ApprovalPolicy.from_dict({"default": REVIEW, "rules": rules}, tenant_secret=tenant_secret)
+
+
+SEARCH = {"name": "tavily_search", "args": {"query": "weather"}, "id": "1"}
+
+
+def test_verified_tenant():
+    tenants = policy([])
+    assert tenants.verified_tenant("acme", sign("acme")) == "acme"
+    assert tenants.verified_tenant("acme", sign("acme").upper()) == "acme"
+    assert tenants.verified_tenant("acme", sign("other")) is None
+    assert tenants.verified_tenant("acme", sign("acme", "wrong")) is None
+    assert tenants.verified_tenant("acme", None) is None
+    assert policy([], tenant_secret=None).verified_tenant("acme", sign("acme")) is None
+
+
+def test_tenant_rule_only_matches_the_given_tenant():
+    tenants = policy([{"tools": ["tavily_search"], "tenants": ["acme"]}])
+    assert tenants.decide([SEARCH], "thread", "acme")[0]
+    assert not tenants.decide([SEARCH], "thread", None)[0]
+    assert not tenants.decide([SEARCH], "thread", "other")[0]
+
+
+def test_threads_only_in_review_rules():
+    with pytest.raises(PolicyError, match="threads"):
+        policy([{"tools": ["*"], "threads": ["^trusted-"], "action": APPROVE}])
+    reviewed = policy([{"threads": ["^audit-"], "action": REVIEW}, {"tools": ["tavily_search"]}])
+    assert not reviewed.decide([SEARCH], "audit-1")[0]
+    assert reviewed.decide([SEARCH], "chat-1")[0]
+
+
+class _Request:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_app_replaces_the_body_tenant_with_the_signed_header(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "approval_policy", policy([]))
+    config = {"configurable": {"thread_id": "t", "tenant_id": "acme"}}
+    app.bind_tenant(config, _Request({}))
+    assert "tenant_id" not in config["configurable"]
+
+    app.bind_tenant(config, _Request({"x-tenant-id": "acme", "x-tenant-signature": sign("acme")}))
+    assert config["configurable"]["tenant_id"] == "acme"
+
+    app.bind_tenant(config, _Request({"x-tenant-id": "other", "x-tenant-signature": sign("acme")}))
+    assert "tenant_id" not in config["configurable"]
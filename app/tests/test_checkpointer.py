@@ -0,0 +1,174 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from sqlalchemy.dialects import postgresql
+
+from database.checkpointer import DeltaPostgresSaver
+
+
+class FakeResult(list):
+    def first(self):
+        return self[0] if self else None
+
+
+class FakeEngine:
+    """Stands in for the async engine: statements succeed, reads return the queued `results` in order,
+    and a test can hold the next transaction's commit."""
+
+    def __init__(self):
+        self.statements = []
+        self.results = []
+        self.gates = []
+
+    @asynccontextmanager
+    async def begin(self):
+        gate = self.gates.pop(0) if self.gates else None
+        yield self
+        if gate is not None:
+            await gate.wait()
+
+    @asynccontextmanager
+    async def connect(self):
+        yield self
+
+    async def execute(self, statement, *args):
+        self.statements.append(statement)
+        return FakeResult(self.results.pop(0) if self.results else [])
+
+    def deltas(self):
+        """Parameters of the message deltas inserted so far."""
+        return [statement.compile(dialect=postgresql.dialect()).params for statement in self.statements
+                if getattr(statement, "table", None) is not None and statement.table.name.endswith("message_deltas")]
+
+
+def config(checkpoint_id=None):
+    configurable = {"thread_id": "thread", "checkpoint_ns": ""}
+    if checkpoint_id is not None:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def checkpoint(checkpoint_id, step):
+    value = empty_checkpoint()
+    value["id"] = checkpoint_id
+    value["channel_values"] = {"step": step}
+    value["channel_versions"] = {"step": str(step)}
+    return value
+
+
+async def put(saver, parent_id, checkpoint_id, step):
+    return await saver.aput(config(parent_id), checkpoint(checkpoint_id, step), {"step": step}, {"step": str(step)})
+
+
+def test_writes_that_finish_before_their_checkpoint_are_kept():
+    async def scenario():
+        engine = FakeEngine()
+        saver = DeltaPostgresSaver(engine)
+        await put(saver, None, "0001", 1)
+
+        commit = asyncio.Event()
+        engine.gates.append(commit)
+        pending_put = asyncio.create_task(put(saver, "0001", "0002", 2))
+        await asyncio.sleep(0) # aput(0002) is waiting for its commit
+        await saver.aput_writes(config("0002"), [("__interrupt__", "approve?")], "task-1")
+        await saver.aput_writes(config("0002"), [("answer", 42)], "task-2")
+        commit.set()
+        await pending_put
+        return await saver.aget_tuple(config())
+
+    hot = asyncio.run(scenario())
+    assert hot.config["configurable"]["checkpoint_id"] == "0002"
+    assert sorted(hot.pending_writes) == [("task-1", "__interrupt__", "approve?"), ("task-2", "answer", 42)]
+
+
+def test_writes_of_an_older_checkpoint_do_not_leak_into_the_hot_one():
+    async def scenario():
+        saver = DeltaPostgresSaver(FakeEngine())
+        await put(saver, None, "0001", 1)
+        await put(saver, "0001", "0002", 2)
+        await saver.aput_writes(config("0001"), [("answer", 1)], "late")
+        await saver.aput_writes(config("0002"), [("answer", 2)], "task")
+        await put(saver, "0002", "0003", 3)
+        return saver._entry("thread", ""), await saver.aget_tuple(config("0003"))
+
+    entry, hot = asyncio.run(scenario())
+    assert hot.pending_writes == []
+    assert entry.early_writes == {}
+
+
+def delta(saver, version, base_version, keep, tail):
+    tail_type, tail_blob = saver.serde.dumps_typed(tail)
+    return SimpleNamespace(version=version, base_version=base_version, keep=keep, tail_type=tail_type, tail=tail_blob)
+
+
+def messages_checkpoint(checkpoint_id, version, messages):
+    value = empty_checkpoint()
+    value["id"] = checkpoint_id
+    value["channel_values"] = {"messages": messages}
+    value["channel_versions"] = {"messages": version}
+    return value
+
+
+async def put_messages(saver, parent_id, checkpoint_id, version, messages):
+    await saver.aput(config(parent_id), messages_checkpoint(checkpoint_id, version, messages), {}, {"messages": version})
+
+
+HI, HELLO, AGAIN, FORKED = HumanMessage("hi"), AIMessage("hello"), HumanMessage("again"), HumanMessage("instead")
+
+
+def test_delta_is_based_on_the_hot_parent():
+    async def scenario():
+        engine = FakeEngine()
+        saver = DeltaPostgresSaver(engine)
+        await put_messages(saver, None, "0001", "v1", [HI])
+        await put_messages(saver, "0001", "0002", "v2", [HI, HELLO])
+        return engine.deltas()
+
+    first, second = asyncio.run(scenario())
+    assert (first["base_version"], first["keep"]) == (None, 0)
+    assert (second["base_version"], second["keep"]) == ("v1", 1)
+
+
+def test_fork_from_an_older_checkpoint_is_based_on_that_checkpoint():
+    async def scenario():
+        engine = FakeEngine()
+        saver = DeltaPostgresSaver(engine)
+        await put_messages(saver, None, "0001", "v1", [HI])
+        await put_messages(saver, "0001", "0002", "v2", [HI, HELLO])
+        await put_messages(saver, "0002", "0003", "v3", [HI, HELLO, AGAIN])
+        # update_state from 0001 while 0003 is hot: the base comes from postgres, not the hot entry
+        parent_type, parent_blob = saver.serde.dumps_typed({**messages_checkpoint("0001", "v1", []), "channel_values": {}})
+        engine.results = [[SimpleNamespace(checkpoint_type=parent_type, checkpoint=parent_blob)],
+                          [delta(saver, "v1", None, 0, [HI])]]
+        await put_messages(saver, "0001", "0004", "v2.fork", [HI, FORKED])
+        return engine.deltas()[-1]
+
+    fork = asyncio.run(scenario())
+    assert (fork["base_version"], fork["keep"]) == ("v1", 1)
+
+
+def test_load_messages_follows_base_versions():
+    async def scenario():
+        engine = FakeEngine()
+        saver = DeltaPostgresSaver(engine)
+        # a base that sorts after its delta, as written by forks before base versions followed the parent
+        engine.results = [[delta(saver, "v1", None, 0, [HI]), delta(saver, "v9", "v1", 1, [HELLO]),
+                           delta(saver, "v2", "v9", 2, [AGAIN])]]
+        return await saver._load_messages(engine, "thread", "", "v2")
+
+    assert asyncio.run(scenario()) == [HI, HELLO, AGAIN]
+
+
+def test_load_messages_with_a_missing_base_fails_clearly():
+    async def scenario():
+        engine = FakeEngine()
+        saver = DeltaPostgresSaver(engine)
+        engine.results = [[delta(saver, "v2", "v1", 1, [HELLO])]]
+        return await saver._load_messages(engine, "thread", "", "v2")
+
+    with pytest.raises(RuntimeError, match="delta v1 is missing"):
+        asyncio.run(scenario())
@@ -0,0 +1,33 @@
+import asyncio
+
+import pytest
+
+from database.crud import async_db_list_threads, async_db_thread_messages, decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("values", [
+    ("thread-1",),
+    ("a|b|c",),
+    ("2025-05-01T10:00:00+00:00", "6f1c2b9e-8d0c-4c61-9a53-4b8e9f6a1d20"),
+    ('quote " and , comma', "ünïcödé"),
+])
+def test_cursor_round_trip(values):
+    assert decode_cursor(encode_cursor(*values), len(values)) == list(values)
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "e30=", "WzFd", "bm90IGpzb24=", "W10="])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor, 1)
+
+
+@pytest.mark.parametrize("values", [(), ("a", "b")])
+def test_list_threads_rejects_a_cursor_of_the_wrong_size(values):
+    # raised before the query, so no database is needed
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        asyncio.run(async_db_list_threads(None, cursor=encode_cursor(*values)))
+
+
+def test_thread_messages_rejects_a_cursor_of_the_wrong_size():
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        asyncio.run(async_db_thread_messages(None, "thread", cursor=encode_cursor("2025-05-01T10:00:00")))
@@ -0,0 +1,54 @@
+import math
+
+import pytest
+
+from tool.expression import MAX_RESULT_BITS, ExpressionError, evaluate, evaluate_many
+
+
+def test_arithmetic_and_functions():
+    assert evaluate("(2 + 3) * 4") == 20
+    assert evaluate("2 ^ 10") == 1024
+    assert evaluate("sqrt(x) + max(1, 2, 3)", {"x": 16}) == 7.0
+
+
+def test_vector_mode_turns_elementwise_errors_into_null():
+    assert evaluate("1 / x", {"x": [1, 0, 4]}) == [1.0, None, 0.25]
+
+
+@pytest.mark.parametrize("expression", [
+    "9 ^ 9 ^ 9",                 # exponent bound
+    f"2 ^ {MAX_RESULT_BITS + 1}",  # result bound checked before computing the power
+    "10 ^ 3000 * 10 ^ 3000",      # result bound on the final value, over str()'s 4300 digit limit
+])
+def test_results_too_large_are_refused(expression):
+    with pytest.raises(ExpressionError):
+        evaluate(expression)
+
+
+def test_large_result_below_the_limit_is_returned():
+    value = evaluate("10 ^ 3000")
+    assert len(str(value)) == 3001
+
+
+@pytest.mark.parametrize("expression", ["1 / 0", "min()", "sqrt(1, 2)", "log(-1) + 1 % 0"])
+def test_runtime_errors_become_expression_errors(expression):
+    with pytest.raises(ExpressionError):
+        evaluate(expression)
+
+
+@pytest.mark.parametrize("expression", ["__import__('os')", "x.real", "[1, 2][0]", "lambda: 1"])
+def test_disallowed_syntax_is_rejected(expression):
+    with pytest.raises(ExpressionError):
+        evaluate(expression, {"x": 1})
+
+
+def test_unknown_names():
+    with pytest.raises(ExpressionError, match="unknown names: y"):
+        evaluate("x + y", {"x": 1})
+
+
+def test_evaluate_many_isolates_failures():
+    results = evaluate_many(["1 + 1", "1 / 0", "pi"])
+    assert results[0]["result"] == 2
+    assert "error" in results[1]
+    assert math.isclose(results[2]["result"], math.pi)
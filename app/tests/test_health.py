@@ -0,0 +1,51 @@
+import asyncio
+
+from health import HealthProber
+
+
+def prober_with(latencies_ms):
+    """A prober whose vllm probe takes the given latencies in turn; the other dependencies answer at once."""
+    prober = HealthProber(timeout=5.0)
+    latencies = iter(latencies_ms)
+
+    async def vllm():
+        await asyncio.sleep(next(latencies) / 1000)
+
+    async def instant():
+        pass
+
+    for dependency in prober.dependencies:
+        dependency.probe = vllm if dependency.name == "vllm" else instant
+    prober.dependencies[0].slow_ms = 20 # vllm
+    return prober
+
+
+def run_rounds(prober, rounds):
+    async def scenario():
+        for _ in range(rounds):
+            await prober.probe_all()
+        return prober.readiness()
+    return asyncio.run(scenario())
+
+
+def test_one_slow_probe_does_not_degrade():
+    readiness = run_rounds(prober_with([40, 1, 1]), 3)
+    assert readiness["status"] == "ready" and readiness["ready"]
+    assert readiness["dependencies"]["vllm"]["state"] == "up"
+
+
+def test_sustained_slowness_degrades_but_stays_ready():
+    readiness = run_rounds(prober_with([40, 40, 40]), 3)
+    assert readiness["dependencies"]["vllm"]["state"] == "slow"
+    assert readiness["status"] == "degraded" and readiness["ready"]
+
+
+def test_critical_dependency_down_is_not_ready():
+    prober = prober_with([1])
+
+    async def down():
+        raise ConnectionError("refused")
+
+    prober.dependencies[1].probe = down # postgres
+    readiness = run_rounds(prober, 1)
+    assert readiness["status"] == "not_ready" and not readiness["ready"]
@@ -0,0 +1,159 @@
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyConflict, IdempotencyManager, body_hash, request_key
+
+
+def collect(execution, start=0):
+    async def run():
+        return [event async for event in execution.subscribe(start)]
+    return run()
+
+
+def test_request_key():
+    payload = {"prompt": "hi"}
+    assert request_key("/stream", "abc", payload) == ("/stream:abc", True)
+    key, explicit = request_key("/stream", None, payload)
+    assert not explicit and key == f"/stream:body:{body_hash(payload)}"
+
+
+def test_retry_attaches_to_the_running_execution():
+    async def scenario():
+        manager = IdempotencyManager()
+        runs = 0
+        release = asyncio.Event()
+
+        async def events():
+            nonlocal runs
+            runs += 1
+            yield 1
+            await release.wait()
+            yield 2
+
+        first = manager.start("k", "thread", True, events, body_hash="h")
+        await asyncio.sleep(0)
+        retry, status = manager.get("k", "h")
+        release.set()
+        return runs, status, retry is first, await collect(retry)
+
+    assert asyncio.run(scenario()) == (1, "attached", True, [1, 2])
+
+
+def test_finished_execution_is_replayed_from_the_resume_position():
+    async def scenario():
+        manager = IdempotencyManager()
+
+        async def events():
+            for event in range(4):
+                yield event
+
+        await manager.start("k", "thread", True, events).task
+        execution, status = manager.get("k")
+        return status, await collect(execution, start=2)
+
+    assert asyncio.run(scenario()) == ("replayed", [2, 3])
+
+
+def test_failed_explicit_execution_replays_its_error():
+    async def scenario():
+        manager = IdempotencyManager()
+        runs = 0
+
+        async def events():
+            nonlocal runs
+            runs += 1
+            yield "token"
+            raise RuntimeError("llm failed")
+
+        await manager.start("k", "thread", True, events).task
+        execution, status = manager.get("k")
+        received = []
+        with pytest.raises(RuntimeError, match="llm failed"):
+            async for event in execution.subscribe():
+                received.append(event)
+        return runs, status, received
+
+    assert asyncio.run(scenario()) == (1, "replayed", ["token"])
+
+
+def test_implicit_keys_are_not_kept_after_the_run():
+    async def scenario():
+        manager = IdempotencyManager()
+
+        async def events():
+            yield "done"
+
+        await manager.start("k", "thread", False, events).task
+        return manager.get("k")
+
+    assert asyncio.run(scenario()) == (None, "new")
+
+
+def test_key_reused_with_a_different_body_is_a_conflict():
+    async def scenario():
+        manager = IdempotencyManager()
+
+        async def events():
+            yield "done"
+
+        await manager.start("k", "thread", True, events, body_hash="a").task
+        with pytest.raises(IdempotencyConflict):
+            manager.get("k", "b")
+
+    asyncio.run(scenario())
+
+
+def test_executions_of_a_thread_run_one_after_another():
+    async def scenario():
+        manager = IdempotencyManager()
+        order = []
+
+        def run(name):
+            async def events():
+                order.append(f"{name} start")
+                await asyncio.sleep(0.01)
+                order.append(f"{name} end")
+                yield name
+            return events
+
+        first = manager.start("a", "thread", False, run("a"))
+        second = manager.start("b", "thread", False, run("b"))
+        await asyncio.sleep(0)
+        assert manager.thread_busy("thread")
+        await asyncio.gather(first.task, second.task)
+        return order, manager.thread_busy("thread")
+
+    assert asyncio.run(scenario()) == (["a start", "a end", "b start", "b end"], False)
+
+
+def run_keyed(manager, key, events):
+    async def gen():
+        for event in events:
+            yield event
+    return manager.start(key, "thread", True, gen).task
+
+
+def test_kept_executions_are_bounded_in_bytes():
+    async def scenario():
+        manager = IdempotencyManager(max_bytes=300)
+        for key in "abc":
+            await run_keyed(manager, key, ["x" * 50, "y" * 50])
+        await run_keyed(manager, "huge", ["z" * 400])
+        return [manager.get(key)[1] for key in ("a", "b", "c", "huge")], manager.stats()
+
+    statuses, stats = asyncio.run(scenario())
+    # each run is 104 bytes: the oldest goes when the third is kept, one over the whole bound is never kept
+    assert statuses == ["new", "replayed", "replayed", "new"]
+    assert stats["completed"] == 2 and stats["completed_bytes"] == 208
+
+
+def test_expired_executions_are_pruned_when_another_finishes():
+    async def scenario():
+        manager = IdempotencyManager(ttl=0.01)
+        await run_keyed(manager, "old", ["event"])
+        await asyncio.sleep(0.02)
+        await run_keyed(manager, "new", ["event"])
+        return manager.stats()["completed"]
+
+    assert asyncio.run(scenario()) == 1
@@ -0,0 +1,49 @@
+import asyncio
+
+import pytest
+
+from llm.scheduler import LLMOverloaded, LLMScheduler
+
+
+async def peak_concurrency(scheduler, caller, thread_ids):
+    current = peak = 0
+
+    async def call(thread_id):
+        nonlocal current, peak
+        async with scheduler.slot(caller, thread_id):
+            current += 1
+            peak = max(peak, current)
+            await asyncio.sleep(0.01)
+            current -= 1
+
+    await asyncio.gather(*(call(thread_id) for thread_id in thread_ids))
+    return peak
+
+
+def test_one_thread_is_capped_per_thread():
+    scheduler = LLMScheduler(max_inflight=8, max_inflight_per_thread=2)
+    assert asyncio.run(peak_concurrency(scheduler, "call_llm", ["t"] * 6)) == 2
+
+
+def test_requests_without_a_thread_are_not_grouped_together():
+    scheduler = LLMScheduler(max_inflight=8, max_inflight_per_thread=2)
+    assert asyncio.run(peak_concurrency(scheduler, "generate_text", [None] * 6)) == 6
+
+
+def test_global_inflight_limit():
+    scheduler = LLMScheduler(max_inflight=3, max_inflight_per_thread=2)
+    assert asyncio.run(peak_concurrency(scheduler, "call_llm", [f"t{i}" for i in range(6)])) == 3
+    assert scheduler.stats()["inflight"] == 0
+
+
+def test_queue_timeout_sheds():
+    async def scenario():
+        scheduler = LLMScheduler(max_inflight=1, queue_timeout=0.01)
+        async with scheduler.slot("call_llm", "a"):
+            with pytest.raises(LLMOverloaded):
+                async with scheduler.slot("call_llm", "b"):
+                    pass
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed"] == 1 and stats["waiting"] == 0 and stats["inflight"] == 0
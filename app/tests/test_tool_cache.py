@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from tool.cache import ToolResultCache
+
+
+def test_concurrent_calls_share_one_computation():
+    async def scenario():
+        cache = ToolResultCache()
+        calls = 0
+
+        async def compute():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"answer": 42}
+
+        results = await asyncio.gather(*(cache.get_or_compute("search", {"query": "q"}, compute) for _ in range(5)))
+        return cache, calls, results
+
+    cache, calls, results = asyncio.run(scenario())
+    assert calls == 1
+    assert results == [{"answer": 42}] * 5
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def scenario():
+        cache = ToolResultCache()
+        release = asyncio.Event()
+
+        async def compute():
+            await release.wait()
+            return 42
+
+        leader = asyncio.create_task(cache.get_or_compute("search", {"query": "q"}, compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.get_or_compute("search", {"query": "q"}, compute))
+        await asyncio.sleep(0)
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(leader, 0.01)
+        release.set()
+        return await follower, await cache.get_or_compute("search", {"query": "q"}, compute)
+
+    assert asyncio.run(scenario()) == (42, 42)
+
+
+def test_failure_is_shared_and_not_cached():
+    async def scenario():
+        cache = ToolResultCache()
+        attempts = 0
+
+        async def compute():
+            nonlocal attempts
+            attempts += 1
+            await asyncio.sleep(0.01)
+            if attempts == 1:
+                raise RuntimeError("search backend down")
+            return "ok"
+
+        first = await asyncio.gather(*(cache.get_or_compute("search", {"query": "q"}, compute) for _ in range(3)),
+                                     return_exceptions=True)
+        return first, await cache.get_or_compute("search", {"query": "q"}, compute)
+
+    first, retry = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in first)
+    assert retry == "ok"
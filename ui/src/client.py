@@ -6,20 +6,100 @@ from gradio import ChatMessage
 from langchain_core.load import dumpd, dumps, load, loads
 from langchain_core.runnables import RunnableConfig
 import uuid
+import json
 import logging
 import sys
+import os
+import queue
+import struct
+import logging.handlers
+import orjson
+import ormsgpack
 
 
-logging.basicConfig(
-    level=logging.DEBUG,  # Can be DEBUG, INFO, WARNING, ERROR, CRITICAL
-    stream=sys.stdout,
-    format="%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-)
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", 300))
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, same fields as the agent-app's log_config.JsonFormatter."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {"ts": self.formatTime(record), "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging():
+    """Log records go through a queue to a listener thread so gradio's event loop never blocks on stdout."""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), handlers=[logging.handlers.QueueHandler(log_queue)], force=True)
+    for name in ("httpx", "httpcore", "gradio", "urllib3", "asyncio"):
+        logging.getLogger(name).setLevel(os.getenv("LOG_LEVEL_LIBS", "WARNING"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+def truncate(payload, limit=LOG_PAYLOAD_CHARS):
+    text = payload if isinstance(payload, str) else repr(payload)
+    return text if len(text) <= limit else f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+log_listener = configure_logging()
+logger = logging.getLogger("ui")
 
 BASE_API_URL = "http://agent-app:8050"
 TEXT_RESPONSE_URL= f"{BASE_API_URL}/generate-text"
 INITIATE_WORKFLOW = f"{BASE_API_URL}/initiate-workflow"
 RESUME_WORKFLOW = f"{BASE_API_URL}/resume-workflow"
+INITIATE_WORKFLOW_STREAM = f"{BASE_API_URL}/initiate-workflow-stream"
+RESUME_WORKFLOW_STREAM = f"{BASE_API_URL}/resume-workflow-stream"
+# agent runs of different browser sessions in parallel; the app still runs one turn at a time per thread
+UI_CONCURRENCY = int(os.getenv("UI_CONCURRENCY", 16))
+
+# event encoding asked from the agent-app: msgpack (default) or ndjson
+WIRE_FORMAT = os.getenv("UI_WIRE_FORMAT", "msgpack")
+WIRE_MEDIA_TYPES = {"msgpack": "application/x-msgpack", "ndjson": "application/x-ndjson"}
+
+
+class EventDecoder:
+    """Incremental decoder of the agent-app's event stream (app/src/wire.py).
+
+    msgpack frames are a 4-byte big-endian length followed by the body, NDJSON is one
+    event per line. Events are plain dicts, nothing is evaluated or deserialized into objects.
+    """
+
+    _LENGTH = struct.Struct(">I")
+
+    def __init__(self, media_type: str) -> None:
+        self.msgpack = "msgpack" in media_type
+        self.buffer = b""
+
+    def feed(self, data: bytes) -> list:
+        self.buffer += data
+        events = []
+        if self.msgpack:
+            offset = 0
+            while len(self.buffer) - offset >= self._LENGTH.size:
+                (size,) = self._LENGTH.unpack_from(self.buffer, offset)
+                start = offset + self._LENGTH.size
+                if len(self.buffer) - start < size:
+                    break
+                events.append(ormsgpack.unpackb(self.buffer[start:start + size]))
+                offset = start + size
+            self.buffer = self.buffer[offset:]
+        else:
+            *lines, self.buffer = self.buffer.split(b"\n")
+            events = [orjson.loads(line) for line in lines if line.strip()]
+        return events
+
+
+def new_session() -> RunnableConfig:
+    """One LangGraph thread per browser session, and a fresh one after Clear."""
+    return {"configurable": {"thread_id": str(uuid.uuid4())}}
 
 
 
@@ -32,6 +112,7 @@ with gr.Blocks() as ui:
     
     tool_state = gr.State({})
     input_state = gr.State({})
+    session_state = gr.State(new_session) # called on every page load
 
     # Feedback UI (initially hidden)
     with gr.Row(visible=False) as feedback_ui:
@@ -41,79 +122,114 @@ with gr.Blocks() as ui:
 
     
 
-
-    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
-
-    def formatted_prompt(messages:list, config:RunnableConfig=config):
+    def formatted_prompt(messages:list, config:RunnableConfig):
         """extract user and prompt key value"""
-        print(messages)
+        logger.debug(f"[{config['configurable']['thread_id']}] prompt: {truncate(messages[-1].content)}")
         formatted_prompt = {"prompt":[{"role":messages[-1].role,"content":messages[-1].content}],"config":config}
 
         return formatted_prompt
 
 
-    async def agent_response(prompt, messages,input_state,tool_state):
-        
-        messages.append(ChatMessage(role="user", content=prompt))
-        input_state["input_prompt"] = formatted_prompt(messages)["prompt"]
-
-        yield messages, gr.update(visible=False), input_state,None 
+    async def stream_workflow(url:str, payload:dict, retries:int=2):
+        """POST to a streaming endpoint and yield its events as they arrive.
 
+        One Idempotency-Key per user action: a retry after a timeout or dropped connection
+        joins the run the server already has instead of starting the graph again, and
+        X-Resume-From skips the events rendered before the failure.
+        """
+        headers = {"Idempotency-Key": str(uuid.uuid4()), "Accept": WIRE_MEDIA_TYPES[WIRE_FORMAT]}
+        received = 0
         async with httpx.AsyncClient() as client:
-            try:
-                json_response = await client.post(
-                    INITIATE_WORKFLOW,
-                    json=formatted_prompt(messages),
-                    timeout=60.0
-                )
-                json_response.raise_for_status()
-    
-            except httpx.HTTPError as e:
-                raise HTTPException(status_code=422, detail=str(e))
-
-
-        print("ori_json_response:", json_response.json())
-        print("ori_response:", json_response.json()["response"])
-        response = json_response.json()["response"]# deserialize to lc format
-        print("response:", response)
-        for chunk in response:
-            
-            if "AIMessage" in chunk["id"]:
-                #if chunk["kwargs"]["content"]:
-                messages.append(ChatMessage(role="assistant", content=chunk["kwargs"]["content"]))
-                yield messages, gr.update(visible=False), input_state, None
-
-                if chunk['kwargs']["tool_calls"]:
-                    print("chunk:",chunk)
-                    print("tool_state:",tool_state)
-                    tool_state["tool_name"]= chunk['kwargs']["tool_calls"][0]["name"]
-                    messages.append(ChatMessage(role="assistant", content=f"Invoking with args {tool_state["tool_name"]}",
-                                  metadata={"title": f"🛠️ Used tool {chunk['kwargs']["tool_calls"][0]["name"]}"})) # 
-                    
-                    
-
-                    yield messages, gr.update(visible=False), input_state, tool_state
-
-                
-                    
-            
-            elif "Interrupt" in chunk["id"]:
-                print("chunk:",chunk)
-                print("tool_state:",tool_state)
-                tool_state["tool_name"] =  eval(chunk["repr"]).value["tool_call"]["name"]
+            for attempt in range(retries + 1):
+                try:
+                    async with client.stream("POST", url, json=payload, timeout=60.0,
+                                             headers={**headers, "X-Resume-From": str(received)}) as stream_response:
+                        if stream_response.status_code == 429: # agent-app is shedding load
+                            yield {"event": "error", "status": 429, "retry_after": stream_response.headers.get("retry-after")}
+                            return
+                        if stream_response.status_code == 409: # the run to resume is gone, it is not re-run
+                            yield {"event": "error", "status": 409, "detail": "The connection was lost and the answer could not be recovered."}
+                            return
+                        stream_response.raise_for_status()
+                        decoder = EventDecoder(stream_response.headers.get("content-type", ""))
+                        async for chunk in stream_response.aiter_bytes():
+                            for event in decoder.feed(chunk):
+                                received += 1
+                                yield event
+                    return
+                except httpx.TransportError as e:
+                    if attempt == retries:
+                        raise HTTPException(status_code=422, detail=str(e))
+                    logger.warning(f"[{payload['config']['configurable']['thread_id']}] stream interrupted ({e!r}), retrying from event {received}")
+                except httpx.HTTPError as e:
+                    raise HTTPException(status_code=422, detail=str(e))
+
+
+    async def render_events(events, messages, tool_state, config):
+        """Apply streamed events to the chat as they arrive. Yields (messages, show_feedback_ui)."""
+        streaming_message = None # assistant bubble currently receiving tokens
+
+        async for event in events:
+            if event["event"] == "token":
+                if streaming_message is None:
+                    streaming_message = ChatMessage(role="assistant", content="")
+                    messages.append(streaming_message)
+                streaming_message.content += event["content"]
+                yield messages, False
+
+            elif event["event"] == "message" and event["role"] == "assistant":
+                # tokens already rendered the content; only show it when nothing was streamed
+                if streaming_message is None and event["content"]:
+                    messages.append(ChatMessage(role="assistant", content=event["content"]))
+                streaming_message = None
+                yield messages, False
+
+            elif event["event"] == "tool_call":
+                tool_call = event["tool_calls"][0]
+                tool_state["tool_name"] = tool_call["name"]
+                messages.append(ChatMessage(role="assistant", content=f"Invoking with args {tool_call["args"]}",
+                                            metadata={"title": f"🛠️ Used tool {tool_state["tool_name"]}"}))
+                yield messages, False
+
+            elif event["event"] == "interrupt":
+                streaming_message = None
+                tool_state["tool_name"] = event["tool_call"]["name"] if event["tool_call"] else None
                 messages.append(ChatMessage(role="assistant",
-                                            content=f"{eval(chunk["repr"]).value["question"]}",
+                                            content=f"{event["question"]}",
                                             metadata={"title": f"🛠️ Interrupt triggered"}))
-                    
-                yield messages, gr.update(visible=True), input_state, tool_state
+                yield messages, True
+
+            elif event["event"] == "error":
+                streaming_message = None
+                if event.get("status") == 429:
+                    content = f"The agent is busy, please try again in {event.get("retry_after") or "a few"} seconds."
+                else:
+                    content = f"Something went wrong: {event.get("detail") or "unknown error"}. Please try again."
+                messages.append(ChatMessage(role="assistant", content=content))
+                yield messages, False
+
+            elif event["event"] == "end":
+                logger.info(f"[{config['configurable']['thread_id']}] time to first token: {event["ttft_ms"]} ms, total: {event["total_ms"]:.1f} ms, tokens: {event["tokens"]}")
+
+
+    async def agent_response(prompt, messages,input_state,tool_state,config):
+        
+        messages.append(ChatMessage(role="user", content=prompt))
+        input_state["input_prompt"] = formatted_prompt(messages, config)["prompt"]
+
+        yield messages, gr.update(visible=False), input_state, tool_state
+
+        events = stream_workflow(INITIATE_WORKFLOW_STREAM, formatted_prompt(messages, config))
+        async for messages, show_feedback in render_events(events, messages, tool_state, config):
+            yield messages, gr.update(visible=show_feedback), input_state, tool_state
 
 
     
-    async def handle_feedback(action, data, messages,input_state, tool_state):
+    async def handle_feedback(action, data, messages,input_state, tool_state, config):
         tool_request = tool_state["tool_name"] if tool_state["tool_name"] else None
         input_prompt = input_state["input_prompt"]
 
-        print("tool_request:",tool_request)
+        logger.info(f"[{config['configurable']['thread_id']}] feedback {action} on tool {tool_request}")
 
         # From Command to resume
         if action == "continue":
@@ -124,6 +240,10 @@ with gr.Blocks() as ui:
                 args = "thought" 
             elif tool_request == "tavily_search":
                 args = "query"
+            elif tool_request == "calculator":
+                args = "expression"
+            elif tool_request == "recall_memory":
+                args = "query"
             resume_cmd = {"resume":{"action": "update", "data": {args:data}},"config":config,"prompt":input_prompt}
 
         elif action == "feedback":
@@ -131,49 +251,22 @@ with gr.Blocks() as ui:
 
         else:
             messages.append(ChatMessage(role="assistant", content="Invalid feedback option."))
-            yield messages
+            yield messages, gr.update(visible=True), tool_state
+            return
 
-        print(resume_cmd)
-        
-        if action:
-            async with httpx.AsyncClient() as client:
-                try:
-                    json_response = await client.post(
-                        RESUME_WORKFLOW,
-                        json=resume_cmd,
-                        timeout=60.0
-                    )
-                    json_response.raise_for_status()
-                except Exception as e:
-                    raise HTTPException(status_code=502, detail=str(e))
-
-            print("ori_json_response:", json_response.json())
-            print("ori_response:", json_response.json()["response"])
-            response = json_response.json()["response"]# deserialize to lc format
-            print("response:", response)
-            for chunk in response:
-            
-                if "AIMessage" in chunk["id"]:
-                    if chunk['kwargs']["tool_calls"]:
-                        messages.append(ChatMessage(role="assistant", content=f"Invoking with args {chunk['kwargs']["tool_calls"][0]["name"]}",
-                                    metadata={"title": f"🛠️ Used tool {chunk['kwargs']["tool_calls"][0]["name"]}"})) #  have to sort out no. of abnormal tool call returned'
-                        
-                        yield messages, gr.update(visible=False)
-
-                    if chunk["kwargs"]["content"]:
-                        messages.append(ChatMessage(role="assistant", content=chunk["kwargs"]["content"]))
-                        #time.sleep(0.001)
-                        yield messages, gr.update(visible=False)
-        
-        # Handling normal conversation
-        else:
-            yield None,gr.update(visible=False)
+        logger.debug(f"[{config['configurable']['thread_id']}] resume: {truncate(resume_cmd['resume'])}")
+
+        yield messages, gr.update(visible=False), tool_state
+
+        events = stream_workflow(RESUME_WORKFLOW_STREAM, resume_cmd)
+        async for messages, show_feedback in render_events(events, messages, tool_state, config):
+            yield messages, gr.update(visible=show_feedback), tool_state
 
 
     # Event wiring
-    submit.click(agent_response, inputs=[input, chatbot,input_state,tool_state], outputs=[chatbot, feedback_ui,input_state,tool_state], concurrency_limit=1)
-    resume_button.click(handle_feedback, inputs=[feedback_action, feedback_data, chatbot,input_state,tool_state], outputs=[chatbot,feedback_ui], concurrency_limit=1)
-    clear.click(lambda: ([],[],[],{}), outputs=[chatbot,input,feedback_ui,tool_state])
+    submit.click(agent_response, inputs=[input, chatbot,input_state,tool_state,session_state], outputs=[chatbot, feedback_ui,input_state,tool_state], concurrency_limit=UI_CONCURRENCY)
+    resume_button.click(handle_feedback, inputs=[feedback_action, feedback_data, chatbot,input_state,tool_state,session_state], outputs=[chatbot,feedback_ui,tool_state], concurrency_limit=UI_CONCURRENCY)
+    clear.click(lambda: ([],[],[],{},new_session()), outputs=[chatbot,input,feedback_ui,tool_state,session_state])
 
 
 # ensures the server listens on all interfaces, not just inside the container.